@@ -4,29 +4,50 @@ import time
 import tables
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
-from scipy import signal
 from os import path
 import uuid
 
-from .channel import ProcessedFileMultiChannel
-from .arraytools import chunk_samples, chunk_iter
+from .channel import (ProcessedFileMultiChannel, ScaledFileMultiChannel,
+                      ChannelMask)
+from .arraytools import chunk_samples, chunk_iter, hdf5_lock
 from . import get_config
-from .io import copy_block_data
-from mne.time_frequency import tfr
+from .util.math import RunningCovariance
 
 default_chunk_size = get_config('CHUNK_SIZE')
 
 import logging
 log = logging.getLogger(__name__)
 
-def zero_waveform(input_node, duration):
+def _prefetch_depth(chunk_size):
+    '''
+    Number of chunks to read ahead given the PREFETCH_BYTES setting
+    '''
+    return max(0, int(get_config('PREFETCH_BYTES')//chunk_size)-2)
+
+# Waveforms (group, node) under input_node/data that are zeroed or truncated
+# together since they share the same timebase
+waveform_nodes = (('physiology', 'raw'),
+                  ('contact', 'TO_TTL'),
+                  ('contact', 'poke_TTL'),
+                  ('contact', 'reaction_TTL'),
+                  ('contact', 'response_TTL'),
+                  ('contact', 'reward_TTL'),
+                  ('contact', 'signal_TTL'),
+                  ('contact', 'spout_TTL'),
+                 )
+
+def zero_waveform(input_node, duration, virtual=False):
     '''
     Given the experiment data, zeros out both the raw physiology and TTL
     waveforms up to the specified duration.   Useful for eliminating transients
     in the physiology signal that occur just before the animal enters the cage.
 
     This is a destructive operation that manipulates the raw data and cannot be
-    undone.  Be sure to backup your data.
+    undone.  Be sure to backup your data.  If virtual is True, a mask is added
+    to the raw physiology instead (see `cns.channel.ChannelMask`).  The data
+    is zeroed when read and can be restored by clearing the mask or written to
+    the file using `apply_mask`.  TTL waveforms are not masked in this mode;
+    they are zeroed along with the raw physiology when the mask is applied.
 
     Parameters
     ----------
@@ -40,18 +61,13 @@ def zero_waveform(input_node, duration):
     The value (in samples) that was zeroed out for each waveform will be stored
     as an attribute in the node for each waveform.
     '''
+    if virtual:
+        raw = input_node.data.physiology.raw
+        samples = int(duration*raw._v_attrs['fs'])
+        ChannelMask.from_array(raw, create=True).add(0, samples)
+        return
 
-    nodes = (('physiology', 'raw'),
-             ('contact', 'TO_TTL'),
-             ('contact', 'poke_TTL'),
-             ('contact', 'reaction_TTL'),
-             ('contact', 'response_TTL'),
-             ('contact', 'reward_TTL'),
-             ('contact', 'signal_TTL'),
-             ('contact', 'spout_TTL'),
-            )
-
-    for group_name, node_name in nodes:
+    for group_name, node_name in waveform_nodes:
         group = input_node.data._f_getChild(group_name)
         node = group._f_getChild(node_name)
         node_fs = node._v_attrs['fs']
@@ -63,7 +79,7 @@ def zero_waveform(input_node, duration):
         node[..., :samples] = 0
         node._v_attrs['zero:samples'] = samples
 
-def truncate_waveform(input_node, duration):
+def truncate_waveform(input_node, duration, virtual=False):
     '''
     Given the experiment data, truncates both the raw physiology and TTL
     waveforms after the specified duration.  Useful for eliminating transients
@@ -71,7 +87,8 @@ def truncate_waveform(input_node, duration):
     the animal is removed from the cage.
 
     This is a destructive operation that manipulates the raw data and cannot be
-    undone.  Be sure to backup your data.
+    undone.  Be sure to backup your data.  If virtual is True, a mask is added
+    to the raw physiology instead (see `zero_waveform`).
 
     Parameters
     ----------
@@ -85,17 +102,13 @@ def truncate_waveform(input_node, duration):
     The value (in samples) that was zeroed out for each waveform will be stored
     as an attribute in the node for each waveform.
     '''
-    nodes = (('physiology', 'raw'),
-             ('contact', 'TO_TTL'),
-             ('contact', 'poke_TTL'),
-             ('contact', 'reaction_TTL'),
-             ('contact', 'response_TTL'),
-             ('contact', 'reward_TTL'),
-             ('contact', 'signal_TTL'),
-             ('contact', 'spout_TTL'),
-            )
-
-    for group_name, node_name in nodes:
+    if virtual:
+        raw = input_node.data.physiology.raw
+        new_size = int(duration*raw._v_attrs['fs'])
+        ChannelMask.from_array(raw, create=True).add(new_size, action='trim')
+        return
+
+    for group_name, node_name in waveform_nodes:
         group = input_node.data._f_getChild(group_name)
         node = group._f_getChild(node_name)
         node_fs = node._v_attrs['fs']
@@ -108,6 +121,55 @@ def truncate_waveform(input_node, duration):
         if 'truncate:original_size' not in node._v_attrs:
             node._v_attrs['truncate:original_size'] = old_size
 
+def apply_mask(input_node):
+    '''
+    Write the mask of the raw physiology (see `zero_waveform` and
+    `truncate_waveform`) to the data and remove the mask.  The ranges that
+    apply to all channels are also written to the TTL waveforms so that they
+    remain aligned with the raw physiology.
+
+    This is a destructive operation that manipulates the raw data and cannot be
+    undone.  Be sure to backup your data.  The ranges that were applied are
+    stored as the mask:applied attribute of each node.
+    '''
+    raw = input_node.data.physiology.raw
+    mask = ChannelMask.from_array(raw)
+    if mask is None:
+        return
+    rows = mask.table.read()
+    raw_fs = raw._v_attrs['fs']
+
+    for group_name, node_name in waveform_nodes:
+        group = input_node.data._f_getChild(group_name)
+        node = group._f_getChild(node_name)
+        is_raw = node._v_pathname == raw._v_pathname
+
+        # The ranges are in samples of the raw physiology
+        scale = node._v_attrs['fs']/raw_fs
+        for channel, start, stop, action in rows:
+            if action != 'zero':
+                continue
+            if channel == -1:
+                channels = Ellipsis
+            elif is_raw:
+                channels = channel
+            else:
+                continue
+            start = int(start*scale)
+            stop = node.shape[-1] if stop == -1 else int(stop*scale)
+            node[channels, start:stop] = 0
+
+        if mask.trim is not None:
+            old_size = node.shape[-1]
+            new_size = int(mask.trim*scale)
+            if new_size < old_size:
+                node.truncate(new_size)
+                if 'truncate:original_size' not in node._v_attrs:
+                    node._v_attrs['truncate:original_size'] = old_size
+        node._v_attrs['mask:applied'] = rows
+
+    mask.table._f_remove()
+
 def median_std(x, axis=-1):
     '''
     Given a multichannel array, compute the standard deviation of the signal
@@ -119,9 +181,158 @@ def median_std(x, axis=-1):
     '''
     return np.median(np.abs(x)/0.6745, axis=axis)
 
+def load_processed(raw_node, processing, processed_cache=None):
+    '''
+    Returns a ProcessedFileMultiChannel that references and filters the raw
+    physiology data using the settings in the processing dictionary (see
+    `extract_spikes` for the required keys).
+
+    If processed_cache (the node created by `cache_processed`) is provided and
+    was generated using the same referencing and filtering settings, the data
+    is read from the cache instead.
+    '''
+    channel = ProcessedFileMultiChannel.from_node(raw_node, **processing)
+    if processed_cache is not None:
+        channel.processed_cache = \
+                ScaledFileMultiChannel.from_node(processed_cache)
+        if channel.use_processed_cache:
+            log.debug('Using processed cache %s', processed_cache._v_pathname)
+        else:
+            log.debug('Processed cache %s is stale, ignoring',
+                      processed_cache._v_pathname)
+    return channel
+
+def cache_processed(input_node, output_node, processing, headroom=4,
+                    progress_callback=None, chunk_size=default_chunk_size):
+    '''
+    Save a copy of the referenced and filtered physiology data so that
+    subsequent passes (e.g. re-extracting spikes with new thresholds) can skip
+    the referencing and filtering.  The copy is stored as int16 (with the
+    per-channel gain needed to rescale the data) under output_node/processed.
+    A hash of the filter coefficients and referencing matrix is stored as the
+    processing_hash attribute and is used by `load_processed` to check whether
+    the copy is still valid.
+
+    Parameters
+    ----------
+    input_node : instance of tables.Group
+        The PyTables group pointing to the root of the experiment node.  The
+        physiology data will be found under input_node/data/physiology/raw.
+    output_node : instance of tables.Group
+        The target node to save the data to.
+    processing : dict
+        Referencing and filtering settings (see `extract_spikes`)
+    headroom : float
+        The full-scale range of each channel is set to headroom times the
+        largest absolute value found in the first chunk.  If samples later in
+        the recording exceed this range, the copy is written a second time
+        using the largest absolute value found on each channel so that no
+        samples are clipped (the number of clipped samples is stored as the
+        clipped_samples attribute).
+    progress_callback : callable
+        See `extract_spikes`
+    chunk_size : float
+        Maximum memory size (in bytes) each chunk should occupy
+    '''
+    if progress_callback is None:
+        progress_callback = lambda x, y, z: False
+
+    raw_node = input_node.data.physiology.raw
+    channel = ProcessedFileMultiChannel.from_node(raw_node, **processing)
+    c_samples = chunk_samples(raw_node, chunk_size)
+    cache, peak, aborted = _write_processed(channel, output_node, headroom,
+                                            None, c_samples, chunk_size,
+                                            progress_callback)
+    if cache.clipped and not aborted:
+        log.warn('%d samples clipped, rewriting processed cache using the '
+                 'largest value found on each channel', cache.clipped)
+        cache._buffer._f_remove()
+        cache, peak, aborted = _write_processed(channel, output_node, 1, peak,
+                                                c_samples, chunk_size,
+                                                progress_callback)
+
+    node = cache._buffer
+    node._v_attrs['processing_hash'] = channel.processing_hash
+    node._v_attrs['clipped_samples'] = cache.clipped
+    node._v_attrs['headroom'] = headroom
+    node._v_attrs['aborted'] = aborted
+    node._v_attrs['fc_lowpass'] = channel.filter_freq_lp
+    node._v_attrs['fc_highpass'] = channel.filter_freq_hp
+    node._v_attrs['filter_order'] = channel.filter_order
+    node._v_attrs['filter_btype'] = channel.filter_btype
+    node._v_attrs['diff_mode'] = channel.diff_mode
+    node._v_attrs['differential'] = channel.diff_matrix
+    node._v_attrs['source_file'] = path.basename(input_node._v_file.filename)
+    node._v_attrs['source_pathname'] = input_node._v_pathname
+    return node
+
+def _write_processed(channel, output_node, headroom, full_scale, c_samples,
+                     chunk_size, progress_callback):
+    '''
+    Write the processed data to output_node/processed (see `cache_processed`).
+    If full_scale is None, it is computed from the first chunk.  Returns the
+    ScaledFileMultiChannel, the largest absolute value found on each channel
+    and whether processing was aborted.
+    '''
+    total_samples = channel.shape[-1]
+    duration = total_samples/channel.fs
+    iterable = chunk_iter(channel, c_samples, out=True,
+                          prefetch=_prefetch_depth(chunk_size))
+
+    cache = None
+    peak = np.zeros(channel.channels)
+    aborted = False
+    for i_chunk, chunk in enumerate(iterable):
+        # Never write past the end of the trimmed data (see ChannelMask)
+        chunk = chunk[..., :total_samples-i_chunk*c_samples]
+        peak = np.maximum(peak, np.abs(chunk).max(axis=-1))
+        # Chunks are read in a background thread (see prefetch_iter)
+        with hdf5_lock:
+            if cache is None:
+                if full_scale is None:
+                    full_scale = np.abs(chunk).max(axis=-1)
+                cache = _create_processed(channel, output_node,
+                                          headroom*full_scale, duration)
+            cache.send(chunk)
+        if progress_callback(i_chunk*c_samples, total_samples, ''):
+            aborted = True
+            break
+    iterable.close()
+
+    # No data to process (e.g. the data was trimmed to zero samples)
+    if cache is None:
+        cache = _create_processed(channel, output_node, peak, duration)
+    return cache, peak, aborted
+
+def _create_processed(channel, output_node, full_scale, duration):
+    full_scale = np.where(full_scale == 0, 1, full_scale)
+    gain = full_scale/np.iinfo(np.int16).max
+    return ScaledFileMultiChannel(node=output_node, name='processed',
+                                  channels=channel.channels, fs=channel.fs,
+                                  t0=channel.t0, gain=gain,
+                                  offset=np.zeros_like(gain),
+                                  compression_level=1,
+                                  compression_type='lzo', use_shuffle=True,
+                                  cache_duration=0, expected_duration=duration)
+
+def update_processed_cache(input_node, cache_filename, processing, **kwargs):
+    '''
+    Ensure the processed cache in cache_filename (see `cache_processed`) was
+    generated using the current processing settings, regenerating it if
+    required.  Additional keyword arguments are passed to `cache_processed`.
+    '''
+    with tables.openFile(cache_filename, 'a') as fh:
+        if 'processed' in fh.root:
+            raw_node = input_node.data.physiology.raw
+            channel = load_processed(raw_node, processing, fh.root.processed)
+            if channel.use_processed_cache:
+                return
+            fh.root.processed._f_remove()
+        cache_processed(input_node, fh.root, processing, **kwargs)
+
 def running_rms(input_node, output_node, duration, step, processing,
                 algorithm='mean', channels=None, progress_callback=None,
-                chunk_size=default_chunk_size):
+                chunk_size=default_chunk_size, processed_cache=None):
     '''
     Compute the running RMS value of the noise floor using a sliding window
 
@@ -169,13 +380,17 @@ def running_rms(input_node, output_node, duration, step, processing,
         each chunk is processed, the function will be called with updates to the
         progress.  If the function returns a nonzero (True) value, the
         processing will terminate.
+    processed_cache : instance of tables.EArray
+        Node created by `cache_processed`.  If provided and generated using the
+        same processing settings, the data are read from the cache rather than
+        referenced and filtered.
     '''
     # Make a dummy progress callback if none is requested
     if progress_callback is None:
         progress_callback = lambda x, y, z: False
     raw_node = input_node.data.physiology.raw
 
-    channel = ProcessedFileMultiChannel.from_node(raw_node, **processing)
+    channel = load_processed(raw_node, processing, processed_cache)
 
     if channels is None:
         n_channels = raw_node.shape[0]
@@ -240,7 +455,14 @@ def running_rms(input_node, output_node, duration, step, processing,
     # Create the output data node
     fh_out = output_node._v_file
     filters = tables.Filters(complevel=1, complib='zlib', fletcher32=True)
-    rms = fh_out.createEArray(output_node, 'rms', raw_node.atom,
+    # The RMS of raw data stored as scaled integers (see
+    # ScaledFileMultiChannel) is in the original units and would be truncated
+    # if saved using the integer atom of the raw data.
+    if 'gain' in raw_node._v_attrs:
+        atom = tables.Float32Atom()
+    else:
+        atom = raw_node.atom
+    rms = fh_out.createEArray(output_node, 'rms', atom,
                               (n_channels, 0), filters=filters,
                               title='Running RMS of signal')
 
@@ -302,10 +524,12 @@ def running_rms(input_node, output_node, duration, step, processing,
         # adding an extra dimension to the data.
         iterable = chunk_iter(channel, c_samples,
                               step_samples=c_samples-c_loverlap,
-                              ndslice=np.s_[channels, :])
+                              ndslice=np.s_[channels, :], out=True,
+                              prefetch=_prefetch_depth(chunk_size))
     else:
         iterable = chunk_iter(channel, c_samples,
-                              step_samples=c_samples-c_loverlap)
+                              step_samples=c_samples-c_loverlap, out=True,
+                              prefetch=_prefetch_depth(chunk_size))
     aborted = False
     for i_chunk, chunk in enumerate(iterable):
         if chunk.shape[-1] != c_samples:
@@ -314,8 +538,9 @@ def running_rms(input_node, output_node, duration, step, processing,
             window_n = np.floor((n_samples-window_samples)/window_step)
             new_shape = n_channels, window_n, window_samples
             discarded = n_samples-(window_n*window_step+window_samples)
-            rms._v_attrs['last_chunk_new_shape'] = new_shape
-            rms._v_attrs['samples_discarded'] = discarded
+            with hdf5_lock:
+                rms._v_attrs['last_chunk_new_shape'] = new_shape
+                rms._v_attrs['samples_discarded'] = discarded
             print 'Discarding last {} samples from last chunk'.format(discarded)
 
         # We need to load the stride information from the chunk.  Although we
@@ -327,11 +552,14 @@ def running_rms(input_node, output_node, duration, step, processing,
         strides = ch_stride, window_step*s_stride, s_stride
 
         chunk = as_strided(chunk, new_shape, strides) # <- the optimization
-        rms.append(compute_rms(chunk))
+        chunk_rms = compute_rms(chunk)
+        with hdf5_lock:
+            rms.append(chunk_rms)
 
         if progress_callback(i_chunk*c_samples, total_samples, ''):
             aborted = True
             break
+    iterable.close()
 
     rms._v_attrs['aborted'] = aborted
 
@@ -384,6 +612,9 @@ def decimate_waveform(input_node, output_node, q=None, dec_fs=600.0, N=4,
         that you can carry around with you rather than the raw multi-gigabyte
         physiology data.
     '''
+    from scipy import signal
+    from .io import copy_block_data
+
     # Make a dummy progress callback if none is requested
     if progress_callback is None:
         progress_callback = lambda x, y, z: False
@@ -398,9 +629,23 @@ def decimate_waveform(input_node, output_node, q=None, dec_fs=600.0, N=4,
 
     n_channels, n_samples = raw.shape
 
+    # If the raw data are stored as scaled integers (see
+    # ScaledFileMultiChannel), convert each chunk back to the original units.
+    scaled = 'gain' in raw._v_attrs
+    if scaled:
+        dtype = np.dtype(np.float32)
+        gain = raw._v_attrs['gain'][:, np.newaxis]
+        offset = raw._v_attrs['offset'][:, np.newaxis]
+    else:
+        dtype = raw.dtype
+
+    # Zeroed and trimmed ranges (see zero_waveform and truncate_waveform)
+    mask = ChannelMask.from_array(raw)
+
     fh_out = output_node._v_file
     filters = tables.Filters(complevel=1, complib='zlib', fletcher32=True)
-    lfp = fh_out.createEArray(output_node, 'lfp', raw.atom,
+    atom = tables.Atom.from_dtype(dtype)
+    lfp = fh_out.createEArray(output_node, 'lfp', atom,
                               (n_channels, 0), filters=filters,
                               title="Lowpass filtered signal for LFP analysis")
 
@@ -410,22 +655,33 @@ def decimate_waveform(input_node, output_node, q=None, dec_fs=600.0, N=4,
     b, a = signal.iirfilter(N, Wn, btype='lowpass')
 
     # Need to consider this in more detail
-    b = b.astype(raw.dtype)
-    a = a.astype(raw.dtype)
+    b = b.astype(dtype)
+    a = a.astype(dtype)
 
     # The number of samples in each chunk *must* be a multiple of the decimation
     # factor so that we can extract the *correct* samples from each chunk.
     c_samples = chunk_samples(raw, chunk_size, q)
     overlap = 3*len(b)
     iterable = chunk_iter(raw, chunk_samples=c_samples, loverlap=overlap,
-                          roverlap=overlap)
+                          roverlap=overlap, out=True,
+                          prefetch=_prefetch_depth(chunk_size))
 
     for i, chunk in enumerate(iterable):
-        chunk = signal.filtfilt(b, a, chunk, padlen=0).astype(raw.dtype)
+        if scaled:
+            chunk = chunk*gain+offset
+        if mask is not None:
+            mask.apply(chunk, np.arange(n_channels), i*c_samples-overlap)
+        chunk = signal.filtfilt(b, a, chunk, padlen=0).astype(dtype)
         chunk = chunk[:, overlap:-overlap:q]
-        lfp.append(chunk)
+        with hdf5_lock:
+            lfp.append(chunk)
         if progress_callback(i*c_samples, n_samples, ''):
             break
+    iterable.close()
+
+    # Discard the decimated samples that fall in the trimmed portion
+    if mask is not None and mask.trim is not None:
+        lfp.truncate(min(lfp.nrows, int(np.ceil(mask.trim/q))))
 
     # Save some data about how the lfp data was generated
     lfp._v_attrs['q'] = q
@@ -450,7 +706,8 @@ def decimate_waveform(input_node, output_node, q=None, dec_fs=600.0, N=4,
 def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
                    rej_threshold_stds, processing, window_size=2.1,
                    cross_time=0.5, cov_samples=10000, progress_callback=None,
-                   chunk_size=default_chunk_size, include_block_data=True):
+                   chunk_size=default_chunk_size, include_block_data=True,
+                   adaptive_threshold=False, processed_cache=None):
     '''
     Extracts spikes.  Lots of options.
 
@@ -501,8 +758,9 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     cross_time : float (msec)
         Alignment point for peak of waveform
     cov_samples : int
-        Number of samples to collect for estimating the covariance matrix (used
-        by UMS2000)
+        Number of randomly selected windows to save (as covariance_data) for
+        inspecting the noise.  The covariance matrix (used by UMS2000) is
+        estimated from all windows that do not contain an event.
     progress_callback : callable
         Function to be notified each time a chunk is processed.  The function
         must take three arguments, (chunk number, total chunks, message).  As
@@ -517,7 +775,20 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
         as well.  This is useful for creating a smaller, more compact datafile
         that you can carry around with you rather than the raw multi-gigabyte
         physiology data.
+    adaptive_threshold : boolean
+        If True, the noise floor is re-estimated from each chunk (using the
+        same median-based estimate as `median_std`) and the detection threshold
+        for that chunk is the new estimate multiplied by `threshold_stds`.  This
+        tracks slow changes in the noise floor over the course of a recording.
+        The noise estimate and threshold used for each segment are saved under
+        event_data along with the first sample of each segment.  Reject
+        thresholds are always based on `noise_std`.
+    processed_cache : instance of tables.EArray
+        Node created by `cache_processed`.  If provided and generated using the
+        same processing settings, the data are read from the cache rather than
+        referenced and filtered.
     '''
+    from .io import copy_block_data
 
     # Make sure data is in the format we want
     channels = np.asarray(channels)
@@ -536,8 +807,8 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     # filtering (as well as chunking the data).  TODO I'd rather explicitly code
     # the referencing and filtering logic into this function rather than adding
     # a layer of abstraction.
-    node = ProcessedFileMultiChannel.from_node(input_node.data.physiology.raw,
-                                               **processing)
+    node = load_processed(input_node.data.physiology.raw, processing,
+                          processed_cache)
     fs = node.fs
 
     n_channels = len(channels)
@@ -628,6 +899,31 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
                                        tables.Int8Atom(), size,
                                        title='Artifact (event, channel)')
 
+    # Peak absolute amplitude of each event on each channel and the sample
+    # (relative to the start of the waveform) at which the peak occurs.  This is
+    # a fraction of the size of the waveforms array, so operations that only
+    # depend on the amplitude (e.g. changing the artifact reject threshold, see
+    # scripts/rethreshold_extracted_artifacts.py) do not need to read the
+    # waveforms.
+    fh_peak_amplitudes = fh_out.createEArray(event_node, 'peak_amplitudes',
+            atom, size, title='Peak absolute amplitude (event, channel)')
+    fh_peak_indices = fh_out.createEArray(event_node, 'peak_indices',
+            tables.Int16Atom(), size,
+            title='Sample of peak amplitude (event, channel)')
+
+    # When using adaptive thresholds, save the noise estimate and detection
+    # threshold used for each segment (i.e. chunk) so that we can reproduce the
+    # extraction.  Segment i spans segment_start[i] up to segment_start[i+1].
+    if adaptive_threshold:
+        fh_segment_start = fh_out.createEArray(event_node, 'segment_start',
+                tables.Int64Atom(), (0,), title='First sample of segment')
+        fh_segment_noise_std = fh_out.createEArray(event_node,
+                'segment_noise_std', tables.Float64Atom(), (0, n_channels),
+                title='Noise floor (segment, channel)')
+        fh_segment_thresholds = fh_out.createEArray(event_node,
+                'segment_thresholds', tables.Float64Atom(), (0, n_channels),
+                title='Detection threshold (segment, channel)')
+
     # Since we conventionally count channels from 1, convert our 0-based index
     # to a 1-based index.  It's OK to set these as node attributes becasue they
     # will never be empty arrays.  However, let's keep consistency and make
@@ -646,6 +942,7 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     fh_out.setNodeAttr(event_node, 'reject_threshold', rej_thresholds)
     fh_out.setNodeAttr(event_node, 'threshold_std', threshold_stds)
     fh_out.setNodeAttr(event_node, 'reject_threshold_std', rej_threshold_stds)
+    fh_out.setNodeAttr(event_node, 'adaptive_threshold', adaptive_threshold)
 
     ########################################################################
     # END EVENT NODE
@@ -709,6 +1006,12 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     cov_indices = np.sort(cov_indices)
     cov_i = 0
 
+    # The covariance matrix is accumulated chunk by chunk from all windows that
+    # do not overlap an event, so memory does not depend on the number of
+    # windows used for the estimate.
+    cov_accumulator = RunningCovariance(n_channels*window_samples)
+    cov_offsets = np.arange(window_samples)
+
     thresholds = thresholds[:, np.newaxis]
     signs = np.ones(thresholds.shape)
     signs[thresholds < 0] = -1
@@ -717,8 +1020,17 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     # Keep the user updated as to how many candidate spikes they're getting
     tot_features = 0
 
+    # Reshape for broadcasting against the waveforms [event, channel, sample]
+    # and track the number of events flagged as an artifact on each channel.
+    rej_thresholds = rej_thresholds[:, np.newaxis]
+    artifact_counts = np.zeros(n_channels, dtype=np.int64)
+
+    # Each chunk is read into the same buffer.  Anything we need to keep from
+    # the chunk (waveforms, covariance samples) is copied out of it before the
+    # next chunk is read.
     iterable = chunk_iter(node, chunk_samples=c_samples, loverlap=loverlap,
-                          roverlap=roverlap, ndslice=np.s_[channels, :])
+                          roverlap=roverlap, ndslice=np.s_[channels, :],
+                          out=True, prefetch=_prefetch_depth(chunk_size))
 
     aborted = False
     samples_processed = 0
@@ -732,6 +1044,15 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
         # threshold requested) so that we can perform the thresholding on all
         # channels at the same time using broadcasting.
         c = chunk[..., samples_before:-samples_after] * signs
+        if adaptive_threshold:
+            # The sign flip does not affect the estimate since it's based on
+            # the absolute value.
+            segment_std = median_std(c)[:, np.newaxis]
+            thresholds = segment_std*np.abs(threshold_stds)[:, np.newaxis]
+            with hdf5_lock:
+                fh_segment_start.append([i_chunk*c_samples])
+                fh_segment_noise_std.append(segment_std.T)
+                fh_segment_thresholds.append(thresholds.T)
         crossings = (c[..., :-1] <= thresholds) & (c[..., 1:] > thresholds)
 
         # Get the channel number and index for each crossing.
@@ -740,19 +1061,39 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
         n_features = len(sample_index)
         tot_features += n_features
 
-        # This may not be the most efficient approach, but it suffices.
-        for s in sample_index:
-            fh_waveforms.append(chunk[..., s:s+window_samples][np.newaxis])
-
-        # The indices saved to the file must be referenced to t0.  Since we're
-        # processing in chunks and the indices are referenced to the start of
-        # the chunk, not the start of the experiment, we need to correct for
-        # this.  The number of chunks processed is stored in i_chunk.
-        fh_indices.append(sample_index+i_chunk*c_samples)
-
-        # Channel on which the event was detected
-        fh_channels.append(channels[channel_index]+1)
-        fh_channel_indices.append(channel_index)
+        # Pull out the waveforms for all events in the chunk at once.
+        # Indexing returns a copy (shaped [channel, event, sample]), so the
+        # waveforms are not affected when the next chunk is read into the
+        # buffer.
+        window = sample_index[:, np.newaxis]+np.arange(window_samples)
+        waveforms = chunk[:, window].swapaxes(0, 1)
+        amplitudes = np.abs(waveforms)
+
+        # Flag the artifacts while the waveforms are still in memory.  For each
+        # event, check whether the waveform on each channel exceeds the reject
+        # threshold for that channel (via broadcasting) at any sample.
+        artifacts = np.any((waveforms >= rej_thresholds) |
+                           (waveforms < -rej_thresholds), axis=-1)
+        artifact_counts += artifacts.sum(axis=0)
+
+        # Chunks are read in a background thread (see prefetch_iter), so the
+        # lock must be held while writing to the file.
+        with hdf5_lock:
+            fh_waveforms.append(waveforms)
+            fh_peak_amplitudes.append(amplitudes.max(axis=-1))
+            fh_peak_indices.append(amplitudes.argmax(axis=-1))
+            fh_artifacts.append(artifacts)
+
+            # The indices saved to the file must be referenced to t0.  Since
+            # we're processing in chunks and the indices are referenced to the
+            # start of the chunk, not the start of the experiment, we need to
+            # correct for this.  The number of chunks processed is stored in
+            # i_chunk.
+            fh_indices.append(sample_index+i_chunk*c_samples)
+
+            # Channel on which the event was detected
+            fh_channels.append(channels[channel_index]+1)
+            fh_channel_indices.append(channel_index)
 
         # Check to see if any of the samples requested for the covariance matrix
         # lie in this chunk.  If so, pull them out.
@@ -768,6 +1109,21 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
             cov_waves[cov_i] = chunk[..., index:index+window_samples]
             cov_i += 1
 
+        # Windows tile the portion of the chunk that does not overlap with the
+        # following chunk (using the same coordinates as sample_index), so each
+        # sample is used only once.  Discard any window that overlaps the
+        # window of an event.
+        starts = np.arange(0, c.shape[-1], window_samples)
+        events = np.unique(sample_index)
+        lb = np.searchsorted(events, starts-window_samples, 'right')
+        ub = np.searchsorted(events, starts+window_samples, 'left')
+        starts = starts[lb == ub]
+        for i in range(0, len(starts), 4096):
+            block = starts[i:i+4096]
+            noise = chunk[:, block[:, np.newaxis]+cov_offsets]
+            noise = noise.swapaxes(0, 1).reshape((len(block), -1))
+            cov_accumulator.update(noise)
+
         # Track the total number of samples processed.  For the first n-1
         # blocks, this will be equivalent to i_chunk*c_samples.  However, the
         # size of the last chunk will be variable since it's highly unlikely
@@ -783,6 +1139,7 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
         if progress_callback(i_chunk*c_samples, total_samples, mesg):
             aborted = True
             break
+    iterable.close()
 
     # Save some informationa bout whet
     output_node._v_attrs['aborted'] = aborted
@@ -792,32 +1149,24 @@ def extract_spikes(input_node, output_node, channels, noise_std, threshold_stds,
     t_chunk = t_chunk_end-t_chunk_start
     log.debug('Extracting spikes took {} seconds'.format(t_chunk))
 
-    # Find all the artifacts.  First, check the entire waveform array to see if
-    # the signal exceeds the artifact threshold defined on any given sample.
-    # Note that the specified reject threshold for each channel will be honored
-    # via broadcasting of the array.  This uses tables.Expr to avoid creating
-    # large Numpy temporary arrays in memory (and should be much faster).
-    rej_thresholds = rej_thresholds[np.newaxis].T
-    exp = tables.Expr("(fh_waveforms >= rej_thresholds) |"
-                      "(fh_waveforms < -rej_thresholds)")
-
-    # Now, evaluate and reduce the expression so that we end up with a 2d array
-    # [event, channel] indicating whether the waveform for any given event
-    # exceed the reject threshold specified for that channel.
-    artifacts = np.any(exp.eval(), axis=-1)
-    fh_artifacts.append(artifacts)
-
-    # If the user explicitly requested a cancel, compute the covariance matrix
-    # only on the samples we were able to draw from the data.
+    # Number of events flagged as an artifact on each channel
+    fh_out.setNodeAttr(event_node, 'artifact_counts', artifact_counts)
+
+    # If the user explicitly requested a cancel, save only the samples we were
+    # able to draw from the data.
     cov_waves = cov_waves[:cov_i]
 
-    # Compute the covariance matrix in the format required by UltraMegaSort2000
+    # Save the covariance matrix in the format required by UltraMegaSort2000
     # (note by Brad -- I don't fully understand how the covariance matrix is
     # used by UMS2000; however, I spoke with the author and he indicated this is
-    # the correct format for the matrix).
+    # the correct format for the matrix).  The number of windows and the mean
+    # are saved as well so that estimates from different segments of the
+    # recording can be merged (see RunningCovariance.from_covariance).
     cov_waves.shape = cov_i, -1
-    cov_matrix = np.cov(cov_waves.T)
+    cov_matrix = cov_accumulator.covariance()
     fh_out.createArray(event_node, 'covariance_matrix', cov_matrix)
+    fh_out.createArray(event_node, 'covariance_mean', cov_accumulator.mean)
+    fh_out.setNodeAttr(event_node, 'covariance_windows', cov_accumulator.n)
     fh_out.createArray(event_node, 'covariance_data', cov_waves)
 
     # Convert the timestamp indices to seconds and save in an array called
@@ -864,6 +1213,9 @@ def compute_spectrogram(lfp, output_node, frequencies, cycles=3,
     -----
     Chunk size has to be much smaller to handle arrays of this size.
     '''
+    from mne.time_frequency import tfr
+    from .io import copy_block_data
+
     # Make a dummy progress callback if none is requested
     if progress_callback is None:
         progress_callback = lambda x, y, z: False
@@ -891,7 +1243,8 @@ def compute_spectrogram(lfp, output_node, frequencies, cycles=3,
     overlap = max(map(len, wavelets))
     c_samples = chunk_samples(lfp, chunk_size)
     iterable = chunk_iter(lfp, chunk_samples=c_samples, loverlap=overlap,
-                          roverlap=overlap)
+                          roverlap=overlap, out=True,
+                          prefetch=_prefetch_depth(chunk_size))
 
     for i, chunk in enumerate(iterable):
         for j, Wn in enumerate(wavelets):
@@ -899,9 +1252,11 @@ def compute_spectrogram(lfp, output_node, frequencies, cycles=3,
                 lb = i*c_samples
                 ub = lb+c_samples
                 c_spect = np.convolve(chunk[k], Wn, 'same')
-                spectrogram[k,j,lb:ub] = c_spect[overlap:-overlap]
+                with hdf5_lock:
+                    spectrogram[k,j,lb:ub] = c_spect[overlap:-overlap]
         if progress_callback(i*c_samples, n_samples, ''):
             break
+    iterable.close()
 
     # Save some data about how the lfp data was generated
     spectrogram._v_attrs['chunk_overlap'] = overlap
@@ -20,13 +20,22 @@ properly.  You can run these doctests by typing 'python -m cns.arraytools' at
 the command prompt.
 '''
 
+import sys
+import threading
+import Queue
 import numpy as np
 
 __author__ = "Brad N. Buran"
 __contact__ = "bburan@alum.mit.edu"
 __license__ = "GPL"
 
-__all__ = ['chunk_samples', 'chunk_iter', 'slice_overlap']
+__all__ = ['chunk_samples', 'chunk_iter', 'slice_overlap', 'prefetch_iter',
+           'hdf5_lock']
+
+# The HDF5 library is not built to be thread-safe and PyTables releases the GIL
+# while calling it.  When chunks are prefetched in a background thread (see
+# `prefetch_iter`), all HDF5 access (in any thread) must hold this lock.
+hdf5_lock = threading.RLock()
 
 def chunk_samples(x, max_bytes=10e6, block_size=None, axis=-1):
     '''
@@ -97,7 +106,7 @@ def chunk_samples(x, max_bytes=10e6, block_size=None, axis=-1):
     
 def chunk_iter(x, chunk_samples=None, step_samples=None, loverlap=0, roverlap=0,
                padding='const', axis=-1, ndslice=None, initial_padding=0,
-               final_padding=0):
+               final_padding=0, out=None, views=False, prefetch=0):
     '''
     Return an iterable that yields the data in chunks along the specified axis.  
 
@@ -133,6 +142,27 @@ def chunk_iter(x, chunk_samples=None, step_samples=None, loverlap=0, roverlap=0,
         as requested by `padding`.  This is in addition to `right_overlap` (e.g.
         the total number of samples added will be
         `initial_padding`+`right_overlap`).
+    out : { None, True, ndarray }
+        Buffer to read each chunk into.  Each chunk is returned as a view into
+        the buffer, so it is only valid until the next chunk is requested.  The
+        buffer must be large enough to hold the largest chunk along the
+        specified axis (i.e. chunk_samples+loverlap+roverlap+initial_padding+
+        final_padding) and match the shape of the chunk along the remaining
+        axes.  If True, a buffer of the appropriate size is allocated when the
+        first chunk is read.  This eliminates the allocation of a new array for
+        each chunk, which can be significant when processing very large
+        datasets.
+    views : bool
+        If True, return views into `x` (which must be an in-memory array)
+        rather than copies.  Since the chunk cannot extend beyond the edges of
+        `x`, no padding is applied (i.e. chunks at the edges will contain fewer
+        samples).
+    prefetch : int
+        Number of chunks to read ahead in a background thread (see
+        `prefetch_iter`) while the current chunk is processed.  If `out` is
+        True, prefetch+2 buffers are allocated and used in rotation, so a chunk
+        is not overwritten until the chunk following it has been requested.
+        Cannot be combined with an `out` array.
 
     >>> x = np.arange(1000).reshape((4, 250))
     >>> iterable = chunk_iter(x, 5)
@@ -303,21 +333,152 @@ def chunk_iter(x, chunk_samples=None, step_samples=None, loverlap=0, roverlap=0,
     Now, if you are performing filtering *and* computing a running metric, you
     would likely use all three keywords to achieve the optimal chunking
     behavior.
+
+    If you do not need to keep the chunk after processing it, you can have
+    each chunk read into the same buffer.  Note that the chunks are views into
+    the buffer, so the prior chunk is overwritten when the next one is read.
+
+    >>> x = np.arange(1000).reshape((4, 250))
+    >>> chunks = list(chunk_iter(x, 5, loverlap=1, roverlap=2, out=True))
+    >>> chunks[0] is chunks[1]
+    False
+    >>> np.may_share_memory(chunks[1], chunks[2])
+    True
+    >>> print chunks[-1]
+    [[244 245 246 247 248 249 249 249]
+     [494 495 496 497 498 499 499 499]
+     [744 745 746 747 748 749 749 749]
+     [994 995 996 997 998 999 999 999]]
+
+    If the array is in memory, the chunks can be views into the array.  The
+    chunks at the edges are not padded.
+
+    >>> iterable = chunk_iter(x, 5, loverlap=1, roverlap=2, views=True)
+    >>> chunk = next(iterable)
+    >>> print chunk.shape, np.may_share_memory(chunk, x)
+    (4, 7) True
+
+    Chunks can be read ahead in a background thread.  The result is the same.
+
+    >>> chunks = chunk_iter(x, 5, loverlap=1, roverlap=2, out=True, prefetch=2)
+    >>> print list(chunks)[-1]
+    [[244 245 246 247 248 249 249 249]
+     [494 495 496 497 498 499 499 499]
+     [744 745 746 747 748 749 749 749]
+     [994 995 996 997 998 999 999 999]]
     '''
+    if step_samples is None:
+        step_samples = chunk_samples
+    kwargs = dict(loverlap=loverlap, roverlap=roverlap, padding=padding,
+                  axis=axis, ndslice=ndslice, initial_padding=initial_padding,
+                  final_padding=final_padding, out=out, views=views)
+    if not prefetch:
+        return _chunk_iter(x, chunk_samples, step_samples, n_buffers=1,
+                           **kwargs)
+    if out is not None and out is not True:
+        raise ValueError, 'cannot prefetch into a single output buffer'
+    iterable = _chunk_iter(x, chunk_samples, step_samples,
+                           n_buffers=prefetch+2, **kwargs)
+    return prefetch_iter(iterable, prefetch)
+
+def _chunk_iter(x, chunk_samples, step_samples, loverlap, roverlap, padding,
+                axis, ndslice, initial_padding, final_padding, out, views,
+                n_buffers):
     samples = x.shape[axis]
     i = 0
 
-    if step_samples is None:
-        step_samples = chunk_samples
-    
+    if out is True:
+        max_samples = chunk_samples+loverlap+roverlap+initial_padding+\
+            final_padding
+        buffers = []
+        buffer = None
+    else:
+        buffer = out
+
     while i < samples:
         s = slice(i, i+chunk_samples)
-        yield slice_overlap(x, s, start_overlap=loverlap, stop_overlap=roverlap,
-                            axis=axis, ndslice=ndslice, padding=padding,
-                            initial_padding=initial_padding,
-                            final_padding=final_padding)
+        chunk = slice_overlap(x, s, start_overlap=loverlap,
+                              stop_overlap=roverlap, axis=axis,
+                              ndslice=ndslice, padding=padding,
+                              initial_padding=initial_padding,
+                              final_padding=final_padding, out=buffer,
+                              views=views)
+        if out is True:
+            if not buffers:
+                # Now that we know the shape of the remaining axes, allocate the
+                # buffers for the chunks that follow.
+                shape = list(chunk.shape)
+                shape[axis] = max_samples
+                buffers = [np.empty(shape, dtype=chunk.dtype) \
+                           for b in range(n_buffers)]
+            buffers.append(buffers.pop(0))
+            buffer = buffers[0]
+        yield chunk
         i += step_samples
 
+def prefetch_iter(iterable, depth=2, lock=hdf5_lock):
+    '''
+    Advance the iterable in a background thread, keeping up to `depth` items
+    ready so the caller can process the current item while the next ones are
+    obtained.  The lock is held each time the iterable is advanced, so the
+    caller must hold the same lock whenever it accesses a HDF5 file while
+    iterating (e.g. appending the result to an array).
+
+    This is intended for reading chunks from a HDF5 file (where decompressing
+    the data can take as long as processing it).  Reading proceeds while the
+    caller is working on a chunk, provided the caller's processing releases
+    the GIL (e.g. most Numpy and Scipy routines operating on large arrays).
+    Exceptions raised by the iterable are raised in the caller.  If the caller
+    stops iterating early (e.g. because the user aborted the analysis), close
+    the generator to stop the background thread.  Closing the generator waits
+    for any read in progress to finish.
+
+    >>> list(prefetch_iter(iter(range(5))))
+    [0, 1, 2, 3, 4]
+    '''
+    queue = Queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def worker():
+        iterator = iter(iterable)
+        try:
+            while not stop.is_set():
+                with lock:
+                    item = next(iterator, done)
+                if item is done:
+                    break
+                if not put((item, None)):
+                    return
+        except:
+            put((None, sys.exc_info()))
+        else:
+            put((done, None))
+
+    thread = threading.Thread(target=worker, name='prefetch_iter')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, exc_info = queue.get()
+            if exc_info is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
 def axis_slice(a, start=None, stop=None, step=None, axis=-1, ndslice=None):
     """
     Take a slice along axis 'axis' from 'a'.
@@ -372,7 +533,25 @@ def axis_slice(a, start=None, stop=None, step=None, axis=-1, ndslice=None):
     return a[tuple(ndslice)]
 
 def slice_overlap(a, s, start_overlap=0, stop_overlap=0, axis=-1, ndslice=None,
-                  padding='const', initial_padding=0, final_padding=0):
+                  padding='const', initial_padding=0, final_padding=0,
+                  out=None, views=False):
+    '''
+    Return the slice along the specified axis expanded by the requested overlap
+    (see `chunk_iter` for a description of the parameters).
+
+    If `out` is provided, the data is read into the beginning of `out` (along
+    the specified axis) and a view of the portion containing the data is
+    returned.  Padding is filled in place.
+
+    >>> x = np.arange(10)
+    >>> print slice_overlap(x, np.s_[0:4], 2, 2)
+    [0 0 0 1 2 3 4 5]
+    >>> out = np.empty(12, dtype=x.dtype)
+    >>> print slice_overlap(x, np.s_[6:10], 2, 2, padding=-1, out=out)
+    [ 4  5  6  7  8  9 -1 -1]
+    >>> print slice_overlap(x, np.s_[6:10], 2, 2, views=True)
+    [4 5 6 7 8 9]
+    '''
 
     # First obtain the start, stop and step values of the slice provided.
     samples = a.shape[axis]
@@ -406,31 +585,63 @@ def slice_overlap(a, s, start_overlap=0, stop_overlap=0, axis=-1, ndslice=None,
         n_stop_padding = padded_stop-samples
         padded_stop = int(samples)
 
-    b = axis_slice(a, padded_start, padded_stop, step, axis, ndslice=ndslice)
+    if views or (out is None and not (n_start_padding or n_stop_padding)):
+        return axis_slice(a, padded_start, padded_stop, step, axis,
+                          ndslice=ndslice)
+
+    n = len(xrange(padded_start, padded_stop, step))
+    if out is None:
+        data = axis_slice(a, padded_start, padded_stop, step, axis,
+                          ndslice=ndslice)
+        shape = list(data.shape)
+        shape[axis] = n_start_padding+n+n_stop_padding
+        b = np.empty(shape, dtype=data.dtype)
+        axis_slice(b, n_start_padding, n_start_padding+n, axis=axis)[...] = data
+    else:
+        b = axis_slice(out, 0, n_start_padding+n+n_stop_padding, axis=axis)
+        data = axis_slice(b, n_start_padding, n_start_padding+n, axis=axis)
+        _read_into(a, data, padded_start, padded_stop, step, axis, ndslice)
 
-    if n_start_padding or n_stop_padding:
-        start_ext = _get_padding(b, n_start_padding, 'start', padding, axis)
-        stop_ext = _get_padding(b, n_stop_padding, 'stop', padding, axis)
-        b = np.c_[start_ext, b, stop_ext]
+    _fill_padding(b, n_start_padding, n_stop_padding, padding, axis)
     return b
 
-def _get_padding(x, n, where='start', padding='const', axis=-1):
+def _read_into(a, out, start, stop, step, axis, ndslice):
+    '''
+    Read the slice of `a` along the axis directly into `out`.  PyTables arrays
+    can read directly into the buffer if we are reading along the main
+    dimension and the buffer is contiguous.  Otherwise, the data is read and
+    then copied into the buffer.
     '''
-    Return the padding required for the array
+    if ndslice is None and out.flags.c_contiguous and \
+            getattr(a, 'maindim', None) == axis % len(a.shape):
+        try:
+            a.read(start, stop, step, out=out)
+            return
+        except TypeError:
+            # Versions of PyTables prior to 3.0 do not support the out argument
+            pass
+    out[...] = axis_slice(a, start, stop, step, axis, ndslice=ndslice)
+
+def _fill_padding(x, n_start, n_stop, padding='const', axis=-1):
     '''
-    if padding == 'const':
-        if where == 'start':
-            pad_value = axis_slice(x, start=0, stop=1, axis=axis)
-        elif where == 'stop':
-            pad_value = axis_slice(x, start=-1, axis=axis)
+    Fill the first n_start and last n_stop samples (along the axis) of the
+    array in place.  If padding is 'const', the first and last samples of the
+    remaining data are used.
+    '''
+    samples = x.shape[axis]
+    if n_start:
+        if padding == 'const':
+            pad_value = axis_slice(x, n_start, n_start+1, axis=axis)
         else:
-            raise ValueError, 'Unsupported option for where: ' + str(where)
-    else:
-        pad_value = padding
-
-    shape = list(x.shape)
-    shape[axis] = n
-    return np.ones(shape, dtype=x.dtype) * pad_value
+            pad_value = padding
+        axis_slice(x, 0, n_start, axis=axis)[...] = pad_value
+    if n_stop:
+        if padding == 'const':
+            pad_value = axis_slice(x, samples-n_stop-1, samples-n_stop,
+                                   axis=axis)
+        else:
+            pad_value = padding
+        axis_slice(x, samples-n_stop, samples, axis=axis)[...] = pad_value
 
 if __name__ == '__main__':
     import doctest
@@ -1,7 +1,6 @@
 from os import path
 from cns.sigtools import patodb, dbtopa
 
-from scipy import signal
 import numpy as np
 
 import logging
@@ -283,6 +282,7 @@ class Calibration(object):
         # Prepare the FIR coefficients for use
         self.fir_coefficients = fir_coefficients
         if fir_coefficients is not None:
+            from scipy import signal
             self.fir_zi = signal.lfiltic(fir_coefficients, 1, 0)
             if fir_fs is None:
                 mesg = 'Must provide sampling frequency for fir_coefficients' 
@@ -489,6 +489,7 @@ class Calibration(object):
         '''
         if self.fir_coefficients is None:
             raise ValueError, "No FIR data available"
+        from scipy import signal
         return signal.lfilter(self.fir_coefficients, 1, waveform)
     
     def get_best_attenuation(self, expected_range, voltage=1, gain=0):
@@ -1,7 +1,8 @@
 from __future__ import division
 
 from chaco.api import DataRange1D
-from traits.api import Float, List, Instance, Enum, on_trait_change
+from pyface.api import GUI
+from traits.api import Float, List, Instance, Enum, Dict, Bool, on_trait_change
 
 import logging
 log = logging.getLogger(__name__)
@@ -15,6 +16,18 @@ class ChannelDataRange(DataRange1D):
     update_mode     = Enum('auto', 'auto full', 'triggered')
     scroll_period   = Float(20)
 
+    # When several sources add data during a single tick of the controller, we
+    # only want to update the bounds (and trigger a redraw of the plots) once.
+    # If True, the refresh is deferred until control returns to the GUI event
+    # loop so that all of the updates are coalesced into a single refresh.
+    coalesce_updates = Bool(True)
+
+    # Upper bound (in seconds) of the data in each source.  This is updated
+    # incrementally from the payload of the `added` event so we never have to
+    # query the shape of the underlying buffers (which may be HDF5 nodes).
+    _max_times      = Dict
+    _refresh_pending = Bool(False)
+
     def _trigger_changed(self):
         self.refresh()
 
@@ -28,10 +41,33 @@ class ChannelDataRange(DataRange1D):
         self.refresh()
 
     def get_max_time(self):
-        bounds = [s.get_bounds()[1] for s in self.sources if s.get_size()>0]
-        return 0 if len(bounds) == 0 else max(bounds)
+        return max(self._max_times.values()) if self._max_times else 0
+
+    @on_trait_change('sources[]')
+    def _sources_updated(self):
+        # The list of sources changed, so we need to query each source for its
+        # current bounds.  This is the only time we need to do so.
+        self._max_times = dict((s, s.get_bounds()[1]) for s in self.sources \
+                               if s.get_size() > 0)
+        self.refresh()
+
+    @on_trait_change('sources:added')
+    def _source_added(self, source, name, new):
+        # Channel.write sets added to the (lower, upper) bound (relative to t0)
+        # of the data that was just written.
+        max_time = source.t0 + new[-1]
+        if max_time > self._max_times.get(source, 0):
+            self._max_times[source] = max_time
+        if not self.coalesce_updates:
+            self.refresh()
+        elif not self._refresh_pending:
+            self._refresh_pending = True
+            GUI.invoke_later(self._deferred_refresh)
+
+    def _deferred_refresh(self):
+        self._refresh_pending = False
+        self.refresh()
 
-    @on_trait_change('sources.added')
     def refresh(self):
         '''
         Keep this very simple.  The user cannot change low/high settings.  If
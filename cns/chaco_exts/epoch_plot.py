@@ -1,14 +1,22 @@
 import numpy as np
 
 from .channel_plot import ChannelPlot
+from .interval_index import IntervalIndex
 from enable.api import black_color_trait, LineStyle, MarkerTrait
-from traits.api import Instance, Float
+from traits.api import Instance, Float, Any, Int, Bool
 
 class EpochPlot(ChannelPlot):
     '''
     Designed for efficiently handling time series data stored in a channel.
     Each time a Channel.updated event is fired, the new data is obtained and
     plotted.
+
+    The epochs are mirrored in an `IntervalIndex` that is extended with the
+    epochs added to the channel since the last redraw (the added and changed
+    events are handled outside the GUI thread, see `BaseChannelPlot`).  Redraws
+    query the index for the epochs
+    intersecting the visible range rather than reading the channel, so the cost
+    of a redraw does not depend on the number of epochs acquired.
     '''
 
     source              = Instance('cns.channel.Epoch')
@@ -21,6 +29,38 @@ class EpochPlot(ChannelPlot):
     line_color          = black_color_trait
     line_style          = LineStyle
 
+    _index              = Any
+    _epochs_seen        = Int(0)
+    _index_valid        = Bool(False)
+
+    def _source_changed(self, old, new):
+        super(EpochPlot, self)._source_changed(old, new)
+        self._index_valid = False
+
+    def _reset_index(self):
+        self._index = IntervalIndex()
+        self._epochs_seen = 0
+        self._index_valid = True
+
+    def _update_index(self):
+        if self.source is None:
+            return
+        epochs = self.source[self._epochs_seen:]
+        if len(epochs):
+            self._index.append(epochs[:,0], epochs[:,1])
+            self._epochs_seen += len(epochs)
+
+    def _gather_points(self):
+        if not self._data_cache_valid:
+            if not self._index_valid:
+                self._reset_index()
+            self._update_index()
+            range = self.index_mapper.range
+            starts, ends = self._index.query(range.low, range.high)
+            self._cached_data = np.c_[starts, ends]
+            self._data_cache_valid = True
+            self._screen_cache_valid = False
+
     def _get_screen_points(self):
         if not self._screen_cache_valid:
             screen_index = self.index_mapper.map_screen(self._cached_data)
@@ -56,8 +96,14 @@ class EpochPlot(ChannelPlot):
             self._draw_default_axes(gc)
 
     def _data_added(self, timestamps):
-        # Only fire an update if the changed data is within bounds
-        if self.index_range.mask_data(np.array(timestamps)).any():
+        timestamps = np.asarray(timestamps).reshape((-1, 2))
+        # Only fire an update if the new epochs intersect the visible range
+        low, high = self.index_range.low, self.index_range.high
+        if ((timestamps[:,0] < high) & (timestamps[:,1] >= low)).any():
             self.invalidate_draw()
             self._data_cache_valid = False
             self.request_redraw()
+
+    def _data_changed(self):
+        self._index_valid = False
+        super(EpochPlot, self)._data_changed()
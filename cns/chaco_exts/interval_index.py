@@ -0,0 +1,93 @@
+import numpy as np
+
+class IntervalIndex(object):
+    '''
+    In-memory index of intervals (e.g. epochs or the periods during which a TTL
+    is high) that supports fast queries for the intervals intersecting a range.
+
+    Intervals are stored in order of their start time.  Since intervals may
+    overlap, a running maximum of the end times is also maintained.  The running
+    maximum is non-decreasing, so the first interval that may intersect the
+    range can be found using a binary search (as can the last interval, using
+    the start times).  Queries therefore cost O(log n + k) where k is the number
+    of intervals returned, regardless of how many intervals have been added.
+
+    The most recent interval may be left open (i.e. the start is known but the
+    end is not yet known).  When queried, an open interval extends to the
+    `extent` passed to `query`.
+    '''
+
+    def __init__(self, capacity=1024):
+        self._starts = np.empty(capacity)
+        self._ends = np.empty(capacity)
+        self._max_ends = np.empty(capacity)
+        self.n = 0
+        self.open_start = None
+
+    def __len__(self):
+        return self.n
+
+    def _reserve(self, n):
+        if n <= len(self._starts):
+            return
+        capacity = max(n, len(self._starts)*2)
+        for name in ('_starts', '_ends', '_max_ends'):
+            old = getattr(self, name)
+            new = np.empty(capacity)
+            new[:self.n] = old[:self.n]
+            setattr(self, name, new)
+
+    def append(self, starts, ends):
+        '''
+        Add closed intervals to the index.  Intervals are expected to arrive in
+        order of their start time.  If they do not, the index is re-sorted.
+        '''
+        starts = np.asarray(starts, dtype=np.double).ravel()
+        ends = np.asarray(ends, dtype=np.double).ravel()
+        m = len(starts)
+        if m == 0:
+            return
+        i, j = self.n, self.n+m
+        self._reserve(j)
+        self._starts[i:j] = starts
+        self._ends[i:j] = ends
+        if (i > 0 and starts[0] < self._starts[i-1]) or \
+                (np.diff(starts) < 0).any():
+            order = np.argsort(self._starts[:j], kind='mergesort')
+            self._starts[:j] = self._starts[:j][order]
+            self._ends[:j] = self._ends[:j][order]
+            i = 0
+        np.maximum.accumulate(self._ends[i:j], out=self._max_ends[i:j])
+        if i > 0:
+            np.maximum(self._max_ends[i:j], self._max_ends[i-1],
+                       out=self._max_ends[i:j])
+        self.n = j
+
+    def clear(self):
+        self.n = 0
+        self.open_start = None
+
+    def query(self, lb, ub, extent=None):
+        '''
+        Returns the start and end of each interval that intersects the range
+        [lb, ub) as a tuple of arrays.  If an interval is open, it is included
+        (ending at `extent`) provided it intersects the range.
+        '''
+        n = self.n
+        i = np.searchsorted(self._max_ends[:n], lb, 'left')
+        j = np.searchsorted(self._starts[:n], ub, 'left')
+        starts = self._starts[i:j]
+        ends = self._ends[i:j]
+        mask = ends >= lb
+        if not mask.all():
+            # Only needed when intervals overlap.  If an interval ending before
+            # lb follows an interval that ends after lb, the running maximum
+            # won't exclude it.
+            starts, ends = starts[mask], ends[mask]
+        if self.open_start is not None and self.open_start < ub:
+            if extent is None:
+                extent = ub
+            if extent >= lb:
+                starts = np.r_[starts, self.open_start]
+                ends = np.r_[ends, extent]
+        return starts, ends
@@ -1,10 +1,17 @@
 from enable.api import ColorTrait, black_color_trait, color_table
 from traits.api import (Property, Int, cached_property,
-        on_trait_change, List)
+        on_trait_change, List, Instance)
 import numpy as np
 from base_channel_plot import BaseChannelPlot
 
 class SnippetChannelPlot(BaseChannelPlot):
+    '''
+    Plots the most recent snippets detected on a channel, colored by
+    classifier.  The snippets are obtained from the in-memory ring maintained
+    by the source, so the cost of a redraw depends only on `history`.
+    '''
+
+    source = Instance('cns.channel.SnippetRing')
 
     last_reset  = Int(0)
     history = Int(20)
@@ -12,9 +19,9 @@ class SnippetChannelPlot(BaseChannelPlot):
 
     index_data = Property(depends_on='source.fs, source.snippet_size')
     index_screen = Property(depends_on='index_data')
-    value_data = Property(depends_on='source.added, source.updated, last_reset, history')
+    value_data = Property(depends_on='source.added, source.changed, last_reset, history')
     value_screen = Property(depends_on='value_data')
-    classifier_masks = Property(depends_on='source.added, source.updated')
+    classifier_masks = Property(depends_on='value_data')
 
     colors = List(ColorTrait, ['red', 'green', 'blue', 'orange', 'black'])
 
@@ -31,7 +38,7 @@ class SnippetChannelPlot(BaseChannelPlot):
 
     @cached_property
     def _get_value_data(self):
-        return self.source[self.last_reset:][-self.history:]
+        return self.source.get_recent(self.history, since=self.last_reset)
 
     @cached_property
     def _get_value_screen(self):
@@ -39,7 +46,8 @@ class SnippetChannelPlot(BaseChannelPlot):
 
     @cached_property
     def _get_classifier_masks(self):
-        classifiers = self.source.classifiers[self.last_reset:][-self.history:]
+        classifiers = self.source.get_recent_classifiers(self.history,
+                                                         since=self.last_reset)
         return [c==classifiers for c in np.unique(classifiers)]
 
     def _configure_gc(self, gc):
@@ -25,9 +25,16 @@ class SpikeOverlay(AbstractOverlay):
                 gc.set_fill_color(self.fill_color_)
                 gc.set_stroke_color(self.line_color_)
 
+                low = plot.index_mapper.range.low
+                high = plot.index_mapper.range.high
                 for o, n in zip(plot.screen_offsets, plot.channel_visible):
                     spikes = self.spikes[n]
-                    ts = spikes.timestamps[:]/spikes.fs
+                    # Timestamps are in order, so we can locate the spikes in
+                    # the visible range with a binary search.
+                    ts = spikes.timestamps
+                    lb, ub = np.searchsorted(ts, [low*spikes.fs,
+                                                  high*spikes.fs])
+                    ts = ts[lb:ub]/spikes.fs
                     ts_offset = np.ones(len(ts))*o
                     ts_screen = plot.index_mapper.map_screen(ts)
                     points = np.column_stack((ts_screen, ts_offset))
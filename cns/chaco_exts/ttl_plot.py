@@ -1,43 +1,95 @@
 import numpy as np
 from channel_plot import ChannelPlot
-from traits.api import Float
+from interval_index import IntervalIndex
+from traits.api import Float, Any, Int, Bool
 
 class TTLPlot(ChannelPlot):
+    '''
+    Plots the periods during which a TTL is high as rectangles.
+
+    Rather than reading and diffing the samples in the visible range on every
+    redraw, the high periods are tracked in an `IntervalIndex`.  Each time data
+    is added to the channel, only the new samples are read and scanned for
+    edges.  Redraws query the index for the periods intersecting the visible
+    range, so the cost of a redraw does not depend on the length of the
+    session.  The index is only updated when the plot is redrawn since the
+    added and changed events are handled outside the GUI thread (see
+    `BaseChannelPlot`).  If the channel stores the edges directly (see
+    `cns.channel.FileEdgeChannel`), the edges are obtained from the channel.
+    '''
 
     rect_height = Float(0.5)
     rect_center = Float(0.5)
 
+    _index          = Any
+    _samples_seen   = Int(0)
+    _index_valid    = Bool(False)
+
+    def _source_changed(self, old, new):
+        super(TTLPlot, self)._source_changed(old, new)
+        self._index_valid = False
+
+    def _reset_index(self):
+        self._index = IntervalIndex()
+        self._samples_seen = 0
+        self._index_valid = True
+
+    def _update_index(self):
+        if self.source is None or hasattr(self.source, 'get_edges'):
+            return
+        lb, ub = self._samples_seen, self.source.get_size()
+        if ub <= lb:
+            return
+        # Prepend the last state so that a transition spanning the boundary
+        # between the previous and current read is detected.
+        state = self._index.open_start is not None
+        samples = np.asarray(self.source[..., lb:ub], dtype=np.int8)
+        changes = np.flatnonzero(np.diff(np.r_[state, samples]))
+        times = (changes+lb)/self.source.fs + self.source.t0
+
+        # Pair the edges up into high periods
+        if state and len(times):
+            times = np.r_[self._index.open_start, times]
+            self._index.open_start = None
+        if len(times) % 2:
+            self._index.open_start = times[-1]
+            times = times[:-1]
+        self._index.append(times[::2], times[1::2])
+        self._samples_seen = ub
+
+    def _gather_points(self):
+        if not self._data_cache_valid:
+            range = self.index_mapper.range
+            if hasattr(self.source, 'get_edges'):
+                low = max(range.low, self.source.t0)
+                high = max(range.high, low)
+                edges = self.source.get_edges(low, high)
+                self._cached_data = edges[:,0], edges[:,1]
+            else:
+                if not self._index_valid:
+                    self._reset_index()
+                self._update_index()
+                # If the TTL is still high, the period extends to the most
+                # recent sample.
+                extent = self._samples_seen/self.source.fs + self.source.t0
+                self._cached_data = self._index.query(range.low, range.high,
+                                                      extent)
+            self._data_cache_valid = True
+            self._screen_cache_valid = False
+
     def _get_screen_points(self):
         if not self._screen_cache_valid:
-            # Obtain cached data and map to screen
-            val_pts = self._cached_data
-            idx_pts = self.index_values[:len(val_pts)]
-
-            # Add a 0 to beginning of val_pts so we always ensure that a start
-            # comes before an end.  Starts are where the TTL goes high, ends are
-            # where the TTL goes low.
-            val_pts = np.r_[0, val_pts]
-            dv = np.diff(val_pts)
-            starts = dv == 1
-            ends = dv == -1
-
-            # Ensure that we have an end for plotting purposes (if the TTL ends
-            # in a high, then we just "stick" an end on and it will appear as
-            # the leading edge of the TTL).
-            if val_pts[-1] == 1:
-                ends[-1] = True
-
-            # Obtain cached data bounds and create index points
-            t_starts = idx_pts[starts]
-            t_ends = idx_pts[ends]
+            t_starts, t_ends = self._cached_data
             s_t_starts = self.index_mapper.map_screen(t_starts)
             s_t_ends = self.index_mapper.map_screen(t_ends)
             self._cached_screen_index = s_t_starts, s_t_ends
-            
             self._screen_cache_valid = True
-            
         return self._cached_screen_index
 
+    def _data_changed(self):
+        self._index_valid = False
+        super(TTLPlot, self)._data_changed()
+
     def _render_icon(self, gc, x, y, width, height):
         gc.save_state()
         try:
@@ -16,11 +16,13 @@ __getitem__ method.
 
 from traits.api import HasTraits, Property, Array, Int, Event, \
     Instance, on_trait_change, Bool, Any, String, Float, cached_property, \
-    Enum, Set
+    Enum, Set, List
+from collections import deque
+import hashlib
 import numpy as np
 import tables
-from scipy import signal
 from .arraytools import slice_overlap
+from . import get_config
 
 import logging
 log = logging.getLogger(__name__)
@@ -143,12 +145,23 @@ class FileMixin(HasTraits):
         return earray
 
     # Ensure that all 'Traits' are synced with the file so we have that
-    # information stored away.
+    # information stored away.  Attributes that change on every write are
+    # marked with defer_attr and are only saved when the channel is flushed.
     @on_trait_change('+attr', post_init=True)
     def update_attrs(self, name, new):
+        if self.trait(name).defer_attr:
+            return
         log.debug('%s: updating %s to %r', self, name, new)
         self._buffer.setAttr(name, new)
 
+    def flush(self):
+        '''
+        Save the attributes marked with defer_attr and flush the buffer
+        '''
+        for name, value in self.trait_get(defer_attr=True).items():
+            self._buffer.setAttr(name, value)
+        self._buffer.flush()
+
     def _write(self, data):
         self._buffer.append(data)
 
@@ -158,6 +171,87 @@ class FileMixin(HasTraits):
     def __repr__(self):
         return '<HDF5Store {}>'.format(self.name)
 
+class BufferMirror(object):
+    '''
+    Append-only in-memory copy of a buffer that grows along the first axis
+    (e.g. the EArray backing a `FileTimeseries` or `FileEpoch`).
+
+    Event channels are small (typically a few thousand events) but are queried
+    continuously by the plots and analysis code.  Rather than reading the
+    entire buffer on each query, the mirror reads only the rows appended since
+    the last query.  The mirror also tracks whether the first column (e.g. the
+    timestamp or epoch start) is non-decreasing so that range queries can use a
+    binary search and, for epochs, maintains a running maximum of the second
+    column (the epoch end).
+    '''
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.size = 0
+        self.monotonic = True
+        self._data = None
+        self._max_end = None
+
+    def _grow(self, new, size):
+        capacity = max(size, 1024)
+        if self._data is not None:
+            capacity = max(capacity, 2*len(self._data))
+        data = np.empty((capacity,)+new.shape[1:], dtype=new.dtype)
+        max_end = np.empty(capacity, dtype=new.dtype)
+        if self._data is not None:
+            data[:self.size] = self._data[:self.size]
+            max_end[:self.size] = self._max_end[:self.size]
+        self._data, self._max_end = data, max_end
+
+    def update(self):
+        size = len(self.buffer)
+        if size <= self.size:
+            return
+        new = np.asarray(self.buffer[self.size:size])
+        if self._data is None or size > len(self._data):
+            self._grow(new, size)
+        i = self.size
+        self._data[i:size] = new
+        keys = self._data[max(i-1, 0):size]
+        if keys.ndim == 2:
+            keys = keys[:,0]
+        if self.monotonic and (np.diff(keys) < 0).any():
+            log.debug('%r: timestamps are not monotonic', self.buffer)
+            self.monotonic = False
+        if new.ndim == 2:
+            np.maximum.accumulate(new[:,-1], out=self._max_end[i:size])
+            if i > 0:
+                np.maximum(self._max_end[i:size], self._max_end[i-1],
+                           out=self._max_end[i:size])
+        self.size = size
+
+    @property
+    def data(self):
+        self.update()
+        if self._data is None:
+            return np.asarray(self.buffer[:])
+        return self._data[:self.size]
+
+    def candidates(self, lb, ub):
+        '''
+        Returns the slice of rows that may intersect [lb, ub).  For
+        one-dimensional buffers the slice contains exactly the rows in the
+        range.  For epochs, it contains every epoch that starts before ub and
+        ends on or after lb.  If the data is not monotonic, all rows are
+        returned.
+        '''
+        self.update()
+        if not self.monotonic or self._data is None:
+            return slice(0, self.size)
+        if self._data.ndim == 2:
+            keys = self._data[:self.size,0]
+            i = np.searchsorted(self._max_end[:self.size], lb, 'left')
+        else:
+            keys = self._data[:self.size]
+            i = np.searchsorted(keys, lb, 'left')
+        j = np.searchsorted(keys, ub, 'left')
+        return slice(i, max(i, j))
+
 class Timeseries(HasTraits):
 
     updated = Event
@@ -165,17 +259,25 @@ class Timeseries(HasTraits):
     fs      = Float(attr=True)
     t0      = Float(0, attr=True)
 
+    # In-memory copy of the timestamps used for range queries.  Created on the
+    # first query and extended with new timestamps on subsequent queries.
+    _mirror = Any(transient=True)
+
+    def __mirror_default(self):
+        return BufferMirror(self._buffer)
+
     def send(self, timestamps):
         if len(timestamps):
             self.append(timestamps)
             self.added = np.array(timestamps)/self.fs
 
     def get_range(self, lb, ub):
-        ts = self._buffer.read()
         ilb = int(lb*self.fs)
         iub = int(ub*self.fs)
-        mask = (ts>=ilb) & (ts<iub)
-        return ts[mask]/self.fs
+        ts = self._mirror.data[self._mirror.candidates(ilb, iub)]
+        if not self._mirror.monotonic:
+            ts = ts[(ts>=ilb) & (ts<iub)]
+        return ts/self.fs
 
     def latest(self):
         if len(self._buffer) > 0:
@@ -203,12 +305,18 @@ class Epoch(HasTraits):
     fs = Float(attr=True)
     t0 = Float(0, attr=True)
 
+    # In-memory copy of the epochs used for range queries (see `Timeseries`)
+    _mirror = Any(transient=True)
+
+    def __mirror_default(self):
+        return BufferMirror(self._buffer)
+
     def get_range(self, lb, ub):
-        timestamps = self._buffer[:]
-        starts = timestamps[:,0]
-        ends = timestamps[:,1]
         ilb = int(lb*self.fs)
         iub = int(ub*self.fs)
+        timestamps = self._mirror.data[self._mirror.candidates(ilb, iub)]
+        starts = timestamps[:,0]
+        ends = timestamps[:,1]
         start_mask = (starts >= ilb) & (starts < iub)
         end_mask = (ends >= ilb) & (ends < iub)
         mask = start_mask | end_mask
@@ -442,7 +550,172 @@ class Channel(HasTraits):
     def n_samples(self):
         return self._buffer.shape[-1]
 
-class FileChannel(FileMixin, Channel):
+class CumulativeSumIndex(object):
+    '''
+    Cumulative sum of a single-channel waveform that allows us to compute the
+    mean of the waveform over any window in constant time.
+
+    This is primarily intended for scoring behavior (e.g. the fraction of time
+    the subject was in contact with the spout) over a large number of trials.
+    Rather than reading the window for each trial from the file and computing
+    the mean, the mean for all trials is computed as a single vectorized
+    difference of lookups into the cumulative sum.  Changing the window (e.g.
+    when the user adjusts the analysis parameters) does not require reading
+    any data from the file.
+
+    The index is extended with only the samples acquired since the last query,
+    so it can be used with a channel that is still acquiring data or built on
+    demand for a channel loaded from a file.  The channel must only grow by
+    appending new samples (e.g. a `FileChannel`).
+    '''
+
+    def __init__(self, channel):
+        self.channel = channel
+        self._samples = 0
+        self._csum = np.zeros(1024)
+
+    def update(self):
+        '''
+        Extend the index with any samples added to the channel since the last
+        update.
+        '''
+        size = self.channel.get_size()
+        if size <= self._samples:
+            return
+        if size+1 > len(self._csum):
+            csum = np.empty(max(size+1, 2*len(self._csum)))
+            csum[:self._samples+1] = self._csum[:self._samples+1]
+            self._csum = csum
+        data = self.channel[self._samples:size]
+        out = self._csum[self._samples+1:size+1]
+        np.cumsum(data, out=out)
+        out += self._csum[self._samples]
+        self._samples = size
+
+    def window_mean(self, timestamps, offset, duration):
+        '''
+        Equivalent to `Channel.summarize(timestamps, offset, duration,
+        np.mean)`.  Windows that fall entirely outside the acquired data are
+        NaN.
+        '''
+        self.update()
+        timestamps = np.asarray(timestamps)
+        if timestamps.size == 0:
+            return np.array([])
+        channel = self.channel
+        lb_index = channel.to_samples(offset)
+        ub_index = channel.to_samples(offset+duration)
+        reference = channel.to_samples(timestamps)-int(channel.t0*channel.fs)
+        lb = np.clip(lb_index+reference, 0, self._samples)
+        ub = np.clip(ub_index+reference, 0, self._samples)
+        count = ub-lb
+        result = np.empty(lb.shape)
+        result.fill(np.nan)
+        valid = count > 0
+        total = self._csum[ub[valid]]-self._csum[lb[valid]]
+        result[valid] = total/count[valid]
+        return result
+
+class RecentDataCache(object):
+    '''
+    Copy of (at least) the most recent `samples` written to a channel.
+
+    The data is stored in a linear array with room for twice the number of
+    samples requested.  Once the array is full, the most recent samples are
+    moved to the beginning of the array.  This means each sample is copied at
+    most twice, but the cached data is always contiguous so it can be sliced
+    directly.
+    '''
+
+    def __init__(self, samples, shape, dtype, offset=0):
+        self.samples = samples
+        self._data = np.empty(tuple(shape)+(2*samples,), dtype=dtype)
+        # Range of samples (relative to the beginning of the channel) in the
+        # cache.
+        self.lb = self.ub = offset
+
+    def append(self, data):
+        n = data.shape[-1]
+        if n >= self.samples:
+            self._data[..., :self.samples] = data[..., -self.samples:]
+            self.ub += n
+            self.lb = self.ub-self.samples
+            return
+        size = self.ub-self.lb
+        if size+n > self._data.shape[-1]:
+            keep = min(size, self.samples)
+            self._data[..., :keep] = self._data[..., size-keep:size]
+            self.lb = self.ub-keep
+            size = keep
+        self._data[..., size:size+n] = data
+        self.ub += n
+
+    def get(self, key, lb, ub):
+        '''
+        Returns a copy of data[key+(slice(lb, ub),)] if the range is in the
+        cache, otherwise None.
+        '''
+        if self.lb <= lb and ub <= self.ub:
+            key = tuple(key) + (slice(lb-self.lb, ub-self.lb),)
+            return self._data[key].copy()
+
+class RecentCacheMixin(HasTraits):
+    '''
+    Keeps a write-through cache of the most recent data written to the channel.
+
+    Plots and behavior scoring typically request data shortly after it has been
+    written.  Serving these requests from the cache avoids reading (and
+    decompressing) the data from the HDF5 file.  Requests that fall partly or
+    entirely outside the cache are read from the file.  Only data written via
+    the channel is cached (i.e. data already present in a file that was
+    reopened is always read from the file).
+
+    The duration of the cache (in seconds) defaults to the
+    CHANNEL_CACHE_DURATION setting.  Set to 0 to disable the cache.
+    '''
+
+    cache_duration  = Float(transient=True)
+    _cache          = Any(transient=True)
+
+    def _cache_duration_default(self):
+        return get_config('CHANNEL_CACHE_DURATION')
+
+    def _write(self, data):
+        offset = self.get_size()
+        super(RecentCacheMixin, self)._write(data)
+        if self._cache is None:
+            samples = int(self.cache_duration*self.fs)
+            if samples <= 0:
+                return
+            self._cache = RecentDataCache(samples, self._buffer.shape[:-1],
+                                          self._buffer.dtype, offset)
+        self._cache.append(np.asarray(data))
+
+    def _cache_duration_changed(self):
+        self._cache = None
+
+    def __getitem__(self, key):
+        if self._cache is not None:
+            data = self._cached_item(key)
+            if data is not None:
+                return data
+        return super(RecentCacheMixin, self).__getitem__(key)
+
+    def _cached_item(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        # The last element of the key only refers to the time axis if the key
+        # spans all the dimensions of the buffer.
+        if len(key) != len(self._buffer.shape) and \
+                not any(k is Ellipsis for k in key):
+            return None
+        time = key[-1]
+        if not isinstance(time, slice) or time.step not in (None, 1):
+            return None
+        lb, ub, step = time.indices(self.get_size())
+        return self._cache.get(key[:-1], lb, max(lb, ub))
+
+class FileChannel(RecentCacheMixin, FileMixin, Channel):
     '''
     Uses a HDF5 datastore for the buffer
     '''
@@ -450,6 +723,158 @@ class FileChannel(FileMixin, Channel):
     name  = 'FileChannel'
     dtype = Any(np.float32)
 
+class FileEdgeChannel(FileChannel):
+    '''
+    Stores a boolean waveform (e.g. a TTL) as the sample index of each
+    transition rather than one value per sample.
+
+    TTLs typically change state only a few thousand times over the course of an
+    experiment, so storing the transitions requires orders of magnitude less
+    space than storing each sample.  The waveform is assumed to be low prior to
+    the first sample, so edges[0::2] are the rising edges and edges[1::2] are
+    the falling edges.  Since the edges do not tell us how long the waveform
+    is, the number of samples acquired is stored as an attribute of the node.
+    Since it changes on every write, the attribute is only updated when the
+    channel is flushed (see `FileMixin.flush`).
+
+    Slicing the channel (and therefore `get_range` and `get_range_index`)
+    reconstructs the waveform for the requested samples on demand.  The
+    fraction of time the waveform is high in any window (see `window_mean`) and
+    the high epochs intersecting a time range (see `get_edges`) are computed
+    from the edges directly in O(log edges).
+    '''
+
+    name                = 'FileEdgeChannel'
+    dtype               = Any(np.int32)
+    samples_acquired    = Int(0, attr=True, defer_attr=True, transient=True)
+
+    # In-memory copy of the edges (typically only a few thousand) so we don't
+    # have to read them from the file on every query.
+    _edges              = Any(transient=True)
+
+    # Cumulative number of high samples at the end of each high epoch.  Cleared
+    # whenever a new edge is added.
+    _high_csum          = Any(transient=True)
+
+    def __edges_default(self):
+        return self._buffer[:].astype(np.int64)
+
+    def _write(self, data):
+        data = np.asarray(data, dtype=np.bool)
+        if len(data) == 0:
+            return
+        state = len(self._edges) % 2
+        changes = np.flatnonzero(np.diff(np.r_[state, data].astype('i1')))
+        if len(changes):
+            changes += self.samples_acquired
+            self._buffer.append(changes)
+            self._edges = np.r_[self._edges, changes]
+            self._high_csum = None
+        self.samples_acquired += len(data)
+
+    append = _write
+
+    def get_size(self):
+        return self.samples_acquired
+
+    @property
+    def n_samples(self):
+        return self.samples_acquired
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            key = key[-1]
+        if key is Ellipsis:
+            key = slice(None)
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.samples_acquired)
+            return self._reconstruct(start, stop)[::step]
+        key = np.asarray(key)
+        key = np.where(key < 0, key+self.samples_acquired, key)
+        return np.searchsorted(self._edges, key, 'right') % 2 == 1
+
+    def _reconstruct(self, start, stop):
+        n = max(stop-start, 0)
+        if n == 0:
+            return np.zeros(0, dtype=np.bool)
+        # Edges at or before start determine the initial state.  Each
+        # subsequent edge toggles the state.
+        i = np.searchsorted(self._edges, start, 'right')
+        j = np.searchsorted(self._edges, stop, 'left')
+        toggles = np.zeros(n, dtype='i')
+        toggles[0] = i % 2
+        toggles[self._edges[i:j]-start] += 1
+        return (np.cumsum(toggles) % 2).astype(np.bool)
+
+    def _high_samples(self, x):
+        '''
+        Number of high samples in [0, x) for each value in the array x
+        '''
+        edges = self._edges
+        if self._high_csum is None:
+            n = len(edges)//2*2
+            durations = edges[1:n:2]-edges[0:n:2]
+            self._high_csum = np.r_[0, np.cumsum(durations)]
+        x = np.clip(x, 0, self.samples_acquired)
+        k = np.searchsorted(edges, x, 'left')
+        result = self._high_csum[k//2]
+        odd = k % 2 == 1
+        result[odd] += x[odd]-edges[k[odd]-1]
+        return result
+
+    def window_mean(self, timestamps, offset, duration):
+        '''
+        Fraction of each window that the waveform is high.  Equivalent to
+        `summarize(timestamps, offset, duration, np.mean)` (see
+        `CumulativeSumIndex.window_mean`) but does not reconstruct the waveform.
+        '''
+        timestamps = np.asarray(timestamps)
+        if timestamps.size == 0:
+            return np.array([])
+        lb_index = self.to_samples(offset)
+        ub_index = self.to_samples(offset+duration)
+        reference = self.to_samples(timestamps)-int(self.t0*self.fs)
+        lb = np.clip(lb_index+reference, 0, self.samples_acquired)
+        ub = np.clip(ub_index+reference, 0, self.samples_acquired)
+        count = ub-lb
+        result = np.empty(lb.shape)
+        result.fill(np.nan)
+        valid = count > 0
+        high = self._high_samples(ub[valid])-self._high_samples(lb[valid])
+        result[valid] = high.astype(np.double)/count[valid]
+        return result
+
+    def summarize(self, timestamps, offset, duration, fun):
+        if fun is np.mean and np.iterable(timestamps):
+            return self.window_mean(timestamps, offset, duration)
+        return super(FileEdgeChannel, self).summarize(timestamps, offset,
+                                                      duration, fun)
+
+    def get_edges(self, start, end):
+        '''
+        Returns the start and end time of each high epoch that intersects the
+        range as a 2D array.  Epochs that extend beyond the range are clipped.
+        '''
+        lb, ub = self._to_bounds(start, end)
+        ub = min(ub, self.samples_acquired)
+        i = np.searchsorted(self._edges, lb, 'right')
+        j = np.searchsorted(self._edges, ub, 'left')
+        edges = self._edges[i:j]
+        if i % 2:
+            edges = np.r_[lb, edges]
+        if len(edges) % 2:
+            edges = np.r_[edges, ub]
+        return edges.reshape((-1, 2))/self.fs + self.t0
+
+def ttl_channel_from_node(node, **kwargs):
+    '''
+    Load a boolean channel from the node regardless of whether it was stored as
+    one value per sample (`FileChannel`) or as edges (`FileEdgeChannel`).
+    '''
+    if 'samples_acquired' in node._v_attrs:
+        return FileEdgeChannel.from_node(node, **kwargs)
+    return FileChannel.from_node(node, **kwargs)
+
 class RAMChannel(Channel):
     '''
     Buffers data in memory without saving it to disk.
@@ -552,6 +977,130 @@ class RAMChannel(Channel):
         else:
             return self.partial_idx
 
+class ChannelMask(object):
+    '''
+    Ranges of samples in a multichannel array that are zeroed or trimmed when
+    the data are read.  This allows transients (e.g. before the animal enters
+    the cage or after the headstage falls off) to be removed without rewriting
+    the data stored in the file.  See `cns.analysis.zero_waveform`,
+    `cns.analysis.truncate_waveform` and `cns.analysis.apply_mask`.
+
+    The ranges are stored in a table (channel, start, stop, action) saved
+    alongside the array (e.g. raw_mask for the raw array).  A channel of -1
+    applies the range to all channels and a stop of -1 extends the range to
+    the end of the data.  The action is either 'zero' or 'trim'.  Since all
+    channels must have the same number of samples, trim discards the data on
+    all channels from start onward.
+    '''
+
+    description = {
+        'channel':  tables.Int16Col(pos=0),
+        'start':    tables.Int64Col(pos=1),
+        'stop':     tables.Int64Col(pos=2),
+        'action':   tables.StringCol(8, pos=3),
+    }
+
+    def __init__(self, table):
+        self.table = table
+        self.update()
+
+    @classmethod
+    def from_array(cls, node, create=False):
+        '''
+        Returns the mask for the array, or None if the array does not have a
+        mask (and create is False)
+        '''
+        name = node._v_name + '_mask'
+        parent = node._v_parent
+        if name in parent:
+            return cls(parent._f_getChild(name))
+        if not create:
+            return None
+        title = 'Mask for {}'.format(node._v_name)
+        table = node._v_file.createTable(parent, name, cls.description,
+                                         title=title)
+        return cls(table)
+
+    def update(self):
+        rows = self.table.read()
+        zero = rows[rows['action'] == 'zero']
+        self._zero = zip(zero['channel'], zero['start'], zero['stop'])
+        trim = rows['start'][rows['action'] == 'trim']
+        self.trim = int(trim.min()) if len(trim) else None
+
+    def add(self, start, stop=-1, channel=-1, action='zero'):
+        if action not in ('zero', 'trim'):
+            raise ValueError, 'Unsupported action {}'.format(action)
+        self.table.append([(channel, start, stop, action)])
+        self.table.flush()
+        self.update()
+
+    def clear(self):
+        if self.table.nrows:
+            self.table.removeRows(0, self.table.nrows)
+        self.update()
+
+    def size(self, n):
+        '''
+        Number of samples remaining in an array of n samples once trimmed
+        '''
+        return n if self.trim is None else min(n, self.trim)
+
+    def apply(self, data, channels, lb, step=1):
+        '''
+        Zero the masked samples in data (in place) and return data.
+
+        Parameters
+        ----------
+        data : array
+            Data read from the array.  The last axis is time and the first
+            sample corresponds to sample lb of the array (negative values are
+            allowed if the data have been padded).
+        channels : int or array-like (int)
+            Channel number of each row of data (or a single channel number if
+            data only has a time axis).
+        lb : int
+            Sample of the array corresponding to the first sample of data
+        step : int
+            Step size between samples of data
+        '''
+        ub = lb+data.shape[-1]*step
+        ranges = list(self._zero)
+        if self.trim is not None:
+            ranges.append((-1, self.trim, -1))
+        channels = np.asarray(channels)
+        for channel, start, stop in ranges:
+            if stop < 0:
+                stop = ub
+            if stop <= lb or start >= ub:
+                continue
+            # Convert the range to indices along the time axis of data
+            i = max(0, -(-(start-lb)//step))
+            j = max(0, -(-(stop-lb)//step))
+            if channels.ndim == 0:
+                if channel == -1 or channel == channels:
+                    data[..., i:j] = 0
+            elif channel == -1:
+                data[..., i:j] = 0
+            else:
+                data[channels == channel, i:j] = 0
+        return data
+
+def _mask_key(key, n_channels):
+    '''
+    Returns the channel numbers and time slice requested by a key used to
+    index a multichannel array (channel, time).
+    '''
+    if not isinstance(key, tuple):
+        key = (key,)
+    if len(key) == 1 and key[0] is not Ellipsis:
+        channels, time = key[0], slice(None)
+    else:
+        channels, time = key[0], key[-1]
+    if channels is Ellipsis:
+        channels = slice(None)
+    return np.arange(n_channels)[channels], time
+
 class MultiChannel(Channel):
 
     # Default to 0 to make it clear that the class has not been properly
@@ -664,12 +1213,65 @@ class ProcessedMultiChannel(MultiChannel):
 
     _padding            = Property(depends_on='filter_order')
 
+    # If the raw data are stored as scaled integers (see
+    # ScaledFileMultiChannel), the per-channel gain and offset needed to
+    # convert the stored values back to the original units.
+    gain                = Any
+    offset              = Any
+
+    # Ranges of the raw data that are zeroed or trimmed (see ChannelMask)
+    mask                = Any
+
+    # Optional copy of the referenced and filtered signal (see
+    # cns.analysis.cache_processed).  The copy is used in place of the raw data
+    # only when it was generated with the current referencing and filtering
+    # settings.  Otherwise the raw data is referenced and filtered as usual.
+    processed_cache     = Instance('cns.channel.ScaledFileMultiChannel')
+    processing_hash     = Property(depends_on='filter_coefficients, '
+                                   'diff_matrix, mask')
+    use_processed_cache = Property(depends_on='processed_cache, processing_hash')
+
+    @cached_property
+    def _get_processing_hash(self):
+        b, a = self.filter_coefficients
+        h = hashlib.md5()
+        for x in (self.diff_matrix, b, a, self._padding):
+            h.update(np.asarray(x, dtype=np.float64).tostring())
+        if self.mask is not None and self.mask.table.nrows:
+            h.update(self.mask.table.read().tostring())
+        # Edits written to the raw data (see cns.analysis.zero_waveform,
+        # truncate_waveform and apply_mask) do not necessarily change its shape
+        attrs = getattr(self._buffer, '_v_attrs', None)
+        if attrs is not None:
+            for name in ('zero:samples', 'truncate:original_size',
+                         'mask:applied'):
+                if name in attrs:
+                    h.update(name)
+                    h.update(np.asarray(attrs[name]).tostring())
+        return h.hexdigest()
+
+    @cached_property
+    def _get_use_processed_cache(self):
+        cache = self.processed_cache
+        if cache is None:
+            return False
+        attrs = cache._buffer._v_attrs
+        # Caches that are incomplete or where samples were clipped (see
+        # cns.analysis.cache_processed) are not a faithful copy of the data
+        if getattr(attrs, 'aborted', False) or \
+                getattr(attrs, 'clipped_samples', 0) > 0:
+            return False
+        cache_hash = getattr(attrs, 'processing_hash', None)
+        # The cache holds the data remaining once trimmed (see ChannelMask)
+        return cache_hash == self.processing_hash and \
+                cache._buffer.shape == self.shape
+
     @cached_property
     def _get_filter_instable(self):
         b, a = self.filter_coefficients
         return not np.all(np.abs(np.roots(a)) < 1)
 
-    @on_trait_change('filter_coefficients, diff_matrix')
+    @on_trait_change('filter_coefficients, diff_matrix, mask')
     def _fire_change(self):
         # Objects that use this channel as a datasource need to know when the
         # data changes.  Since changes to the filter coefficients, differential
@@ -713,6 +1315,7 @@ class ProcessedMultiChannel(MultiChannel):
             Wp = self.filter_freq_lp
         Wp = Wp/(0.5*self.fs)
 
+        from scipy import signal
         return signal.iirfilter(self.filter_order, Wp, 60, 2,
                                 ftype=self.filter_type,
                                 btype=self.filter_btype, 
@@ -723,21 +1326,36 @@ class ProcessedMultiChannel(MultiChannel):
         return 3*self.filter_order
 
     def __getitem__(self, slice):
+        if self.use_processed_cache:
+            return self.processed_cache[slice]
+
         # We need to stabilize the edges of the chunk with extra data from
         # adjacent chunks.  Expand the time slice to obtain this extra data.
+        # The time slice is relative to the data remaining once trimmed.
         padding = self._padding
-        data = slice_overlap(self._buffer, slice[-1], padding, padding)
+        lb, ub, step = slice[-1].indices(self.shape[-1])
+        data = slice_overlap(self._buffer, np.s_[lb:ub:step], padding, padding)
+        if self.mask is not None:
+            self.mask.apply(data, np.arange(len(data)), lb-padding)
 
         # It does not matter whether we compute the differential first or apply
         # the filter.  Since the differential requires data from all channels
         # while filtering does not, we compute the differential first then throw
-        # away the channels we do not need.
-        data = self.diff_matrix.dot(data)
+        # away the channels we do not need.  If the data are stored as scaled
+        # integers, the gain is folded into the differential matrix so we only
+        # need a single pass through the data.
+        if self.gain is None:
+            data = self.diff_matrix.dot(data)
+        else:
+            matrix = self.diff_matrix*self.gain
+            offset = self.diff_matrix.dot(self.offset)[:, np.newaxis]
+            data = matrix.dot(data)+offset
 
         # For the filtering, we do not need all the channels, so we can throw
         # out the extra channels by slicing along the second axis
         data = data[slice[:-1]]
         if self.filter_btype is not None:
+            from scipy import signal
             b, a = self.filter_coefficients
             # Since we have already padded the data at both ends padlen can be
             # set to 0.  The "unstable" edges of the filtered waveform will be
@@ -746,7 +1364,30 @@ class ProcessedMultiChannel(MultiChannel):
         return data[..., padding:-padding]
 
 class ProcessedFileMultiChannel(FileMixin, ProcessedMultiChannel):
-    pass
+
+    def _get_shape(self):
+        shape = self._buffer.shape
+        if self.mask is not None:
+            shape = shape[:-1] + (self.mask.size(shape[-1]),)
+        return shape
+
+    def get_size(self):
+        return self._get_shape()[-1]
+
+    @classmethod
+    def from_node(cls, node, **kwargs):
+        # Raw data stored as scaled integers is converted back to the original
+        # units (as single-precision floats) when read.
+        scaled = 'gain' in node._v_attrs
+        if scaled:
+            kwargs.setdefault('gain', node._v_attrs['gain'])
+            kwargs.setdefault('offset', node._v_attrs['offset'])
+        kwargs.setdefault('mask', ChannelMask.from_array(node))
+        channel = super(ProcessedFileMultiChannel, cls).from_node(node,
+                                                                  **kwargs)
+        if scaled:
+            channel.dtype = np.dtype(np.float32)
+        return channel
 
 class RAMMultiChannel(RAMChannel, MultiChannel):
 
@@ -760,13 +1401,81 @@ class RAMMultiChannel(RAMChannel, MultiChannel):
         self.partial_idx = 0
         self._write = self._partial_write
 
-class FileMultiChannel(FileMixin, MultiChannel):
+class FileMultiChannel(RecentCacheMixin, FileMixin, MultiChannel):
 
     name = 'FileMultiChannel'
 
+    # Ranges of the data that are zeroed or trimmed (see ChannelMask)
+    mask = Any(transient=True)
+
+    @classmethod
+    def from_node(cls, node, **kwargs):
+        # Data stored as scaled integers must be rescaled when read
+        if cls is FileMultiChannel and 'gain' in node._v_attrs:
+            cls = ScaledFileMultiChannel
+        kwargs.setdefault('mask', ChannelMask.from_array(node))
+        return super(FileMultiChannel, cls).from_node(node, **kwargs)
+
+    def get_size(self):
+        size = super(FileMultiChannel, self).get_size()
+        if self.mask is not None:
+            size = self.mask.size(size)
+        return size
+
+    def _rescale(self, key, data):
+        return data
+
+    def __getitem__(self, key):
+        data = super(FileMultiChannel, self).__getitem__(key)
+        data = self._rescale(key, data)
+        if self.mask is not None:
+            channels, time = _mask_key(key, self._buffer.shape[0])
+            if isinstance(time, slice):
+                lb, ub, step = time.indices(self._buffer.shape[-1])
+                self.mask.apply(data, channels, lb, step)
+            else:
+                data = np.asarray(data)[..., np.newaxis]
+                data = self.mask.apply(data, channels, time)[..., 0]
+        return data
+
     def _get_shape(self):
         return (self.channels, 0)
 
+class ScaledFileMultiChannel(FileMultiChannel):
+    '''
+    Multichannel data stored as integers (int16 by default) along with the
+    per-channel gain and offset required to convert the stored values back to
+    the original units (i.e. value = stored*gain + offset).  Data are converted
+    when written and read, so this can be used anywhere a FileMultiChannel is
+    expected.  Values that fall outside the range of the storage type are
+    clipped and counted.
+    '''
+
+    gain    = Array(dtype='float32', attr=True)
+    offset  = Array(dtype='float32', attr=True)
+    clipped = Int(0, transient=True)
+
+    def _dtype_default(self):
+        return np.int16
+
+    def _write(self, data):
+        info = np.iinfo(self.dtype)
+        data = np.round((data-self.offset[:, np.newaxis])/
+                        self.gain[:, np.newaxis])
+        self.clipped += np.sum((data < info.min) | (data > info.max))
+        data = np.clip(data, info.min, info.max).astype(self.dtype)
+        super(ScaledFileMultiChannel, self)._write(data)
+
+    def _rescale(self, key, data):
+        channels, time = _mask_key(key, self.channels)
+        gain = self.gain[channels]
+        offset = self.offset[channels]
+        # An integer time index drops the time axis
+        if np.ndim(gain) and not isinstance(time, (int, np.integer)):
+            gain = gain[..., np.newaxis]
+            offset = offset[..., np.newaxis]
+        return data*gain+offset
+
 class FileSnippetChannel(FileChannel):
 
     snippet_size        = Int
@@ -816,6 +1525,194 @@ class FileSnippetChannel(FileChannel):
     def get_recent_average(self, count=1, classifier=None):
         return self.get_recent(count, classifier).mean(0)
 
+class SnippetRing(HasTraits):
+    '''
+    In-memory copy of the snippets detected on a single channel for display.
+
+    Only the most recent `history` snippets are retained (in a ring buffer)
+    along with the number of each retained snippet assigned to each classifier.
+    The classifier index is updated as snippets arrive, so looking up the
+    recent snippets for a classifier does not require scanning the
+    classifiers.  The timestamps (in samples) of all snippets are retained so
+    the spike times can be plotted without reading the file.
+    '''
+
+    added               = Event
+    changed             = Event
+    fs                  = Float
+    snippet_size        = Int
+    history             = Int(100)
+    unique_classifiers  = Set
+
+    # Total number of snippets received
+    n_snippets          = Int(0)
+
+    _snippets           = Any
+    _classifiers        = Any
+    _timestamps         = Any
+    _classifier_index   = Any
+
+    def __init__(self, **kwargs):
+        super(SnippetRing, self).__init__(**kwargs)
+        self.clear()
+
+    @on_trait_change('snippet_size, history')
+    def clear(self):
+        self._snippets = np.empty((self.history, self.snippet_size),
+                                  dtype=np.float32)
+        self._classifiers = np.empty(self.history, dtype=np.int32)
+        self._timestamps = np.empty(1024, dtype=np.int32)
+        self._classifier_index = {}
+        self.n_snippets = 0
+        self.unique_classifiers = set()
+        self.changed = True
+
+    def send(self, data, timestamps, classifiers):
+        data = np.asarray(data).reshape((-1, self.snippet_size))
+        m = len(data)
+        if m == 0:
+            return
+        n = self.n_snippets
+        numbers = np.arange(n, n+m)
+
+        # Only the last `history` snippets of the block will fit in the ring
+        keep = slice(max(0, m-self.history), m)
+        position = numbers[keep] % self.history
+        self._snippets[position] = data[keep]
+        self._classifiers[position] = classifiers[keep]
+
+        if n+m > len(self._timestamps):
+            buffer = np.empty(max(n+m, 2*len(self._timestamps)), dtype=np.int32)
+            buffer[:n] = self._timestamps[:n]
+            self._timestamps = buffer
+        self._timestamps[n:n+m] = timestamps
+
+        # Update the classifier index and drop the snippets that have been
+        # overwritten in the ring.
+        oldest = n+m-self.history
+        for classifier in np.unique(classifiers):
+            index = self._classifier_index.setdefault(classifier, deque())
+            index.extend(numbers[classifiers == classifier])
+        for index in self._classifier_index.values():
+            while index and index[0] < oldest:
+                index.popleft()
+
+        self.n_snippets = n+m
+        self.unique_classifiers.update(set(classifiers))
+        self.added = data, timestamps, classifiers
+
+    @property
+    def timestamps(self):
+        '''
+        Timestamps (in samples) of all snippets received
+        '''
+        return self._timestamps[:self.n_snippets]
+
+    def _recent_numbers(self, history, classifier=None, since=0):
+        lb = max(self.n_snippets-min(history, self.history), since)
+        if classifier is None:
+            return np.arange(lb, self.n_snippets)
+        index = self._classifier_index.get(classifier, ())
+        numbers = np.fromiter(index, dtype=np.int64)
+        return numbers[numbers >= lb]
+
+    def get_recent(self, history=1, classifier=None, since=0):
+        '''
+        Returns the most recent snippets (oldest first).  Only the snippets
+        that are still in the ring can be returned.
+
+        Parameters
+        ----------
+        history : int
+            Number of snippets to consider
+        classifier : { None, int }
+            If specified, only return the snippets (of the most recent
+            `history` snippets) assigned to this classifier.
+        since : int
+            Ignore snippets received before the `since`-th snippet
+        '''
+        numbers = self._recent_numbers(history, classifier, since)
+        return self._snippets[numbers % self.history]
+
+    def get_recent_classifiers(self, history=1, since=0):
+        numbers = self._recent_numbers(history, None, since)
+        return self._classifiers[numbers % self.history]
+
+    def get_recent_average(self, count=1, classifier=None):
+        return self.get_recent(count, classifier).mean(0)
+
+class FileSnippetTable(HasTraits):
+    '''
+    Stores the snippets detected on all channels in a single HDF5 table.
+
+    Each row contains the channel (zero-based), timestamp (in samples),
+    classifier and snippet.  All snippets acquired on a single tick are written
+    with a single append rather than three appends per channel (as required by
+    `FileSnippetChannel`).  Each channel also has a `SnippetRing` (see
+    `rings`) that retains the most recent snippets for display.
+    '''
+
+    node                = Instance(tables.group.Group, transient=True)
+    name                = String('snippets', transient=True)
+    channels            = Int
+    snippet_size        = Int
+    fs                  = Float
+    history             = Int(100)
+    expected_duration   = Float(1800, transient=True)
+
+    rings               = List(Instance(SnippetRing))
+    _table              = Any(transient=True)
+
+    def _rings_default(self):
+        return [SnippetRing(fs=self.fs, snippet_size=self.snippet_size,
+                            history=self.history) \
+                for i in range(self.channels)]
+
+    @on_trait_change('fs, snippet_size, history')
+    def _update_rings(self, name, new):
+        for ring in self.rings:
+            setattr(ring, name, new)
+
+    def _get_description(self):
+        return np.dtype([('channel', np.int16), ('timestamp', np.int32),
+                         ('classifier', np.int32),
+                         ('snippet', np.float32, (self.snippet_size,))])
+
+    def __table_default(self):
+        # Assume roughly 100 snippets/sec (across all channels) when sizing the
+        # table.
+        table = self.node._v_file.createTable(self.node._v_pathname,
+                self.name, self._get_description(),
+                expectedrows=int(100*self.expected_duration))
+        table.setAttr('fs', self.fs)
+        table.setAttr('snippet_size', self.snippet_size)
+        return table
+
+    def send(self, channels, data, timestamps, classifiers):
+        '''
+        Append the snippets (from any number of channels) to the table and
+        update the rings for display.  Arrays should have the same length (the
+        number of snippets).
+        '''
+        channels = np.asarray(channels)
+        if len(channels) == 0:
+            return
+        records = np.empty(len(channels), dtype=self._get_description())
+        records['channel'] = channels
+        records['timestamp'] = timestamps
+        records['classifier'] = classifiers
+        records['snippet'] = np.asarray(data).reshape((-1, self.snippet_size))
+        self._table.append(records)
+
+        order = np.argsort(channels, kind='mergesort')
+        records = records[order]
+        bounds = np.searchsorted(records['channel'], np.arange(self.channels+1))
+        for channel, (lb, ub) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if lb < ub:
+                r = records[lb:ub]
+                self.rings[channel].send(r['snippet'], r['timestamp'],
+                                         r['classifier'])
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -52,7 +52,6 @@ import re
 import tables
 import logging
 from datetime import datetime
-from pandas import DataFrame
 from os import path
 import fnmatch
 
@@ -482,6 +481,8 @@ def p_list_nodes(file_name, pattern, dereference=True):
             yield node
 
 def extract_node_data(node, fields, summary):
+    from pandas import DataFrame
+
     # Node is a HDF5 table.  Table.read() returns a Numpy record array (a data
     # structure that is essentially an array with named columns and nested data
     # structures).  We convert this record array into a DataFrame and add some
@@ -513,6 +514,8 @@ def _extract_data(file_name, filters, fields=None, summary=None,
     is cleared if the last modified time changes.  Note that if you move the
     file to a different folder, this does not clear the cache.
     '''
+    from pandas import DataFrame
+
     log.info('... No cached copy of data found, reloading data')
     with tables.openFile(file_name, 'r') as h:
         data = DataFrame()
@@ -859,6 +862,8 @@ def extract_data(input_files, filters, fields=None, summary=None,
         analyze it too critically.
 
     '''
+    from pandas import DataFrame
+
     # basestring matches both ASCII and Unicode strings
     if isinstance(input_files, basestring):
         input_files = (input_files,)
@@ -2,7 +2,7 @@ from __future__ import division
 
 import tables
 import sys
-import pandas
+import re
 import numpy as np
 
 import h5
@@ -77,6 +77,8 @@ def load_trial_log(filename, path='*/data'):
     Path can have wildcards in it, but must point to the data node (not the
     trial_log node).
     '''
+    import pandas
+
     epochs = (
         'trial_epoch',
         'physiology_epoch',
@@ -189,6 +191,8 @@ def create_extract_arguments_from_extracted(filename):
         kwargs['rej_threshold_stds'] = event_node._v_attrs.reject_threshold_std
         kwargs['window_size'] = event_node._v_attrs.window_size
         kwargs['cross_time'] = event_node._v_attrs.cross_time
+        kwargs['adaptive_threshold'] = getattr(event_node._v_attrs,
+                                               'adaptive_threshold', False)
 
         return kwargs
 
@@ -223,6 +227,14 @@ def create_extract_arguments_from_raw(filename):
 
         return kwargs
 
+def processed_cache_filename(raw_filename):
+    '''
+    Filename of the processed cache (see `cns.analysis.cache_processed`) that
+    accompanies the raw data file
+    '''
+    return re.sub(r'(.*?)(_raw)?\.(h5|hd5|hdf5)$', r'\1_processed.\3',
+                  raw_filename)
+
 def create_extract_arguments(filename):
     if 'raw' in filename:
         return create_extract_arguments_from_raw(filename)
@@ -249,6 +261,7 @@ def load_curated_metadata(curated_file, single_unit=False):
     -------
     clusters : pandas.DataFrame
     '''
+    import pandas
 
     # Hardcoded based on UMS2000 default settings
     cluster_type = pandas.Series({
@@ -330,20 +343,40 @@ def _channel_mask(event_channels, channels):
     return mask
 
 
-def load_extracted(extracted_file, channel, include_waveforms=False):
+def load_extracted(extracted_file, channel, include_waveforms=False,
+                   max_amplitude=None):
     '''
     Load extracted spike data
+
+    If the file contains the peak amplitude of each event, the amplitude on
+    the channel is included as the peak_amplitude column.  Events where the
+    peak amplitude on any extracted channel is greater than or equal to
+    max_amplitude (if specified) are discarded.
     '''
+    import pandas
+
     with tables.openFile(extracted_file) as fh:
-        event_channels = fh.root.event_data.channels[:]-1
+        event_node = fh.root.event_data
+        extracted = (event_node._v_attrs['extracted_channels'][:]-1).tolist()
+        event_channels = event_node.channels[:]-1
         mask = event_channels == channel
+        if 'peak_amplitudes' in event_node:
+            peak_amplitudes = event_node.peak_amplitudes[:]
+            if max_amplitude is not None:
+                mask &= np.all(peak_amplitudes < max_amplitude, axis=-1)
+        elif max_amplitude is not None:
+            raise ValueError, 'peak amplitudes are not available'
+        else:
+            peak_amplitudes = None
         event_channels = event_channels[mask]
-        timestamps = fh.root.event_data.timestamps[:][mask]
+        timestamps = event_node.timestamps[:][mask]
         result = {'channel': event_channels, 'ts': timestamps}
+        if peak_amplitudes is not None and channel in extracted:
+            channel_index = extracted.index(channel)
+            result['peak_amplitude'] = peak_amplitudes[mask, channel_index]
         if include_waveforms:
-            extracted = fh.root.event_data._v_attrs['extracted_channels'][:]-1
-            channel_index = extracted.tolist().index(channel)
-            waveforms = fh.root.event_data.waveforms[:,channel_index][mask]
+            channel_index = extracted.index(channel)
+            waveforms = event_node.waveforms[:,channel_index][mask]
             return pandas.DataFrame(result), waveforms
         else:
             return pandas.DataFrame(result)
@@ -369,6 +402,8 @@ def load_curated(curated_file, single_unit=False, include_waveforms=False):
     clusters : pandas.DataFrame
     channels : list
     '''
+    import pandas
+
     clusters = load_curated_metadata(curated_file, single_unit)
 
     # Load the timestamps only if we have *good* data in the clusters (otherwise
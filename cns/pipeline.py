@@ -46,6 +46,77 @@ def acquire(generator, samples):
 
     return np.fromiter(generator, count=samples, dtype=np.float)
 
+class SampleBuffer(object):
+    '''
+    Preallocated first-in, first-out buffer of samples (samples are stored along
+    the first axis).
+
+    Pipelines typically need to hold on to a partial block of data until enough
+    samples have arrived to process it.  Growing the buffer via `np.r_` or
+    `np.c_` on every send allocates a new array and copies the entire contents
+    of the buffer each time.  Instead, we preallocate the storage and append
+    new samples in place.  When the end of the storage is reached, the
+    unconsumed samples (typically only a fraction of a block) are moved back to
+    the beginning.  The storage is only reallocated if a single send exceeds
+    the free space.
+
+    Parameters
+    ----------
+    capacity : integer
+        Initial number of samples to preallocate.  Ideally this should be at
+        least twice the number of samples you expect to hold on to at any given
+        time.
+    '''
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._storage = None
+        self._lb = 0
+        self._ub = 0
+
+    def __len__(self):
+        return self._ub-self._lb
+
+    def extend(self, data):
+        data = np.asarray(data)
+        n = len(data)
+        if self._storage is None:
+            shape = (max(self._capacity, n),) + data.shape[1:]
+            self._storage = np.empty(shape, dtype=data.dtype)
+        if self._ub+n > len(self._storage):
+            size = len(self)
+            remaining = self._storage[self._lb:self._ub]
+            if size+n > len(self._storage):
+                shape = (max(2*len(self._storage), size+n),) + \
+                        self._storage.shape[1:]
+                storage = np.empty(shape, dtype=self._storage.dtype)
+            else:
+                storage = self._storage
+                # The source and destination overlap, so make a copy first
+                if size > self._lb:
+                    remaining = remaining.copy()
+            storage[:size] = remaining
+            self._storage = storage
+            self._lb, self._ub = 0, size
+        self._storage[self._ub:self._ub+n] = data
+        self._ub += n
+
+    def discard(self, n):
+        '''
+        Remove the `n` oldest samples from the buffer
+        '''
+        self._lb = min(self._lb+n, self._ub)
+
+    @property
+    def data(self):
+        '''
+        View (not a copy) of the samples currently in the buffer.  The view is
+        only valid until the next call to `extend`.
+        '''
+        if self._storage is None:
+            return np.array([])
+        return self._storage[self._lb:self._ub]
+
 ################################################################################
 # SOURCES
 ################################################################################
@@ -81,23 +152,48 @@ def rand_source(count, size, sleep):
 # PIPELINES
 ################################################################################
 @pipeline
-def lfilter(b, a, target):
+def lfilter(b, a, target, axis=-1):
     '''
     Incremential linear filter
+
+    The filter state is carried over from one block to the next, so the output
+    is identical to filtering the concatenated data in a single pass.  Each
+    block is filtered and passed to the target as soon as it is received (no
+    buffering is required).
     '''
     from scipy.signal import lfilter
-    margin = len(b)
-    n = margin*2
+    order = max(len(a), len(b))-1
+    zi = None
+    while True:
+        data = np.asarray((yield))
+        if zi is None:
+            shape = list(data.shape)
+            shape[axis] = order
+            zi = np.zeros(shape)
+        filtered, zi = lfilter(b, a, data, axis=axis, zi=zi)
+        target.send(filtered)
+
+@pipeline
+def sosfilt(sos, target, axis=-1):
+    '''
+    Incremental linear filter using cascaded second-order sections
 
-    buffer = (yield)
+    Second-order sections are numerically more stable than the transfer
+    function representation used by `lfilter` (especially for high-order
+    bandpass filters).  As with `lfilter`, the filter state is carried over
+    from one block to the next.
+    '''
+    from scipy.signal import sosfilt
+    sos = np.atleast_2d(sos)
+    zi = None
     while True:
-        if buffer.shape[-1] > n:
-            filtered_buffer = lfilter(b, a, buffer)
-            target.send(filtered_buffer[..., margin:-margin])
-            buffer = buffer[..., -margin:]
-        data  = (yield)
-        print "LFILTER", buffer.shape, data.shape
-        buffer = np.c_[buffer, (yield)]
+        data = np.asarray((yield))
+        if zi is None:
+            shape = list(data.shape)
+            shape[axis] = 2
+            zi = np.zeros([len(sos)]+shape)
+        filtered, zi = sosfilt(sos, data, axis=axis, zi=zi)
+        target.send(filtered)
 
 def deinterleave_bits(targets):
     return int_to_TTL(len(targets), deinterleave(targets))
@@ -130,17 +226,14 @@ def sp_decimate(n, target):
     target : coroutine
         Sink that recieves a tuple containing ([max values], [min values]).
     '''
-
-    buffered = (yield)
+    buffered = SampleBuffer(n*4)
     while True:
-        min_data = []
-        max_data = []
-        while len(buffered) >= n:
-            min_data.append(buffered[:n].min(axis=0))
-            max_data.append(buffered[:n].max(axis=0))
-            buffered = buffered[n:]
-        target.send(max_data, min_data)
-        buffered = np.r_[buffered, (yield)]
+        buffered.extend((yield))
+        data = buffered.data
+        m = len(data)//n
+        blocks = data[:m*n].reshape((m, n) + data.shape[1:])
+        target.send((blocks.max(axis=1), blocks.min(axis=1)))
+        buffered.discard(m*n)
 
 @pipeline
 def moving_average(n, weights, overlap, target):
@@ -160,21 +253,34 @@ def moving_average(n, weights, overlap, target):
 
     If you want to set up different types of averages (e.g. exponential), use
     functools.partial to freeze the weights parameter.
+
+    All averages that can be computed from the buffered data are computed at
+    once.  Unweighted averages are computed from the difference of the
+    cumulative sum at the window boundaries.  Weighted averages are computed as
+    a single dot product against a strided view of the windows.
     '''
-    #buffered = np.ones(n)*np.nan
-    #buffered = np.zeros(n)
-    buffered = (yield)
+    from numpy.lib.stride_tricks import as_strided
+    step = n-overlap
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.double)
+        weights = weights/weights.sum()
+    buffered = SampleBuffer(n*4)
     while True:
-        averaged_data = []
-        while len(buffered) >= n:
-            # This is likely not an optimal way to do this.  If speed starts to
-            # become an issue investigate the scipy.weave libraries to see if we
-            # can do this more efficiently.
-            average = np.average(buffered[:n], weights=weights, axis=0)
-            averaged_data.append(average)
-            buffered = buffered[n-overlap:]
-        target.send(np.array(averaged_data))
-        buffered = np.r_[buffered, (yield)]
+        buffered.extend((yield))
+        data = buffered.data
+        m = (len(data)-n)//step+1 if len(data) >= n else 0
+        starts = np.arange(m)*step
+        if weights is None:
+            csum = np.zeros((len(data)+1,) + data.shape[1:])
+            np.cumsum(data, axis=0, out=csum[1:])
+            averaged_data = (csum[starts+n]-csum[starts])/float(n)
+        else:
+            shape = (m, n) + data.shape[1:]
+            strides = (step*data.strides[0],) + data.strides
+            windows = as_strided(data, shape=shape, strides=strides)
+            averaged_data = np.tensordot(weights, windows, axes=([0], [1]))
+        target.send(averaged_data)
+        buffered.discard(m*step)
 
 # Remember that coroutines return a generator object.  Since moving_average
 # returns a generator object that has already been "pipelined", we should not
@@ -185,15 +291,26 @@ def simple_moving_average(n, target):
 
 @pipeline
 def buffer(n, target):
-    buffer = np.ones(n)*np.nan
+    '''
+    Sends the most recent `n` samples to the target each time new data is
+    received.  The array sent to the target is a view of a preallocated buffer
+    that is only valid until the next send (copy it if you need to hold on to
+    it).
+    '''
+    buffered = SampleBuffer(n*2)
+    buffered.extend(np.ones(n)*np.nan)
     while True:
-        buffer = np.r_[buffer, (yield)][-n:]
-        target.send(buffer)
+        buffered.extend(np.asarray((yield))[-n:])
+        buffered.discard(len(buffered)-n)
+        target.send(buffered.data)
 
 @pipeline
 def broadcast(targets):
     '''Broadcasts data to multiple targets.
 
+    The same array is sent to each target (no copies are made), so targets must
+    not modify the data in place.
+
     Parameters
     ----------
     targets
@@ -207,8 +324,13 @@ def broadcast(targets):
 
 @pipeline
 def deinterleave(targets):
+    '''
+    Sends each row of the data to the corresponding target.  Rows are sent as
+    views of the original data (no copies are made unless the data is not
+    contiguous).
+    '''
     while True:
-        item = np.array((yield))
+        item = np.asarray((yield))
         for i, target in enumerate(targets):
             if target is not None:
                 target.send(item[i].ravel())
@@ -263,15 +385,3 @@ def file_sink(handle, mode='w'):
 def printer():
     while True:
         print (yield),
-
-import unittest, random, time
-from numpy.testing import assert_array_equal
-
-def test_pipeline():
-    rand_source(10, 10, 1,
-                average(10, None, 2,
-                buffer(100,
-                printer())))
-
-if __name__ == '__main__':
-    test_pipeline()
@@ -19,9 +19,29 @@ MAX_SPEAKER_DAC_VOLTAGE = 7
 # and cause memory size to balloon.
 CHUNK_SIZE      = 50e6
 
+# Memory (in bytes) available for reading chunks of the raw physiology data
+# ahead in a background thread while the current chunk is processed.  The
+# number of chunks read ahead is chosen so that the prefetched chunks (plus the
+# chunks currently being read and processed) fit within this limit.  Set to 0
+# to disable read-ahead.
+PREFETCH_BYTES  = 200e6
+
 # Size of sample (in seconds) to use for computing the noise floor
 NOISE_DURATION  = 16 
 
+# Format for storing the boolean (TTL) channels acquired during behavior
+# experiments.  'samples' stores one value per sample.  'edges' stores only the
+# sample index of each transition (see cns.channel.FileEdgeChannel), which
+# reduces file size by several orders of magnitude but requires
+# cns.channel.ttl_channel_from_node (or knowledge of the format) to read.
+TTL_STORAGE     = 'samples'
+
+# Duration (in seconds) of the most recent data written to each channel that is
+# kept in memory.  Requests for recent data (e.g. by the plots or when scoring
+# a trial) are served from memory rather than read back from the file.  Set to
+# 0 to disable.
+CHANNEL_CACHE_DURATION = 10
+
 try:
     BASE_DIRECTORY  = os.environ['NEUROBEHAVIOR_BASE']
     neurobehavior_base_defined = True
@@ -114,6 +134,15 @@ CAL_SECONDARY   = get_recent_cal(cal_secondary_pattern)
 # Physiology settings
 PHYSIOLOGY_CHANNELS = 16
 
+# Format for storing the raw physiology data.  'float32' stores the values
+# acquired from the DSP.  'int16' stores each sample as a 16-bit integer along
+# with the per-channel gain and offset needed to convert it back to volts (see
+# cns.channel.ScaledFileMultiChannel), which halves the size of the raw data.
+# Values beyond +/- PHYSIOLOGY_RAW_FULL_SCALE (in volts) are clipped, so this
+# should be at least the input range of the amplifier.
+PHYSIOLOGY_RAW_STORAGE = 'float32'
+PHYSIOLOGY_RAW_FULL_SCALE = 10e-3
+
 # Chaco options
 CHACO_NOAXES_PADDING = 5
 CHACO_AXES_PADDING = [50, 5, 5, 50]
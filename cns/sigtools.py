@@ -1,5 +1,4 @@
 import numpy as np
-from scipy import signal
 
 def rfftfreq(n, d=1.0):
     """
@@ -200,6 +199,7 @@ def filter_response(b, a, fs, axes_magnitude=None, axes_phase=None):
     # based on PyQt may want to use Neurogen, and Matplotlib currently does not
     # play well with these applications
     from pylab import figure
+    from scipy import signal
     w, h = signal.freqz(b, a)
     f = w*0.5*fs/np.pi
 
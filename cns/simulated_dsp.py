@@ -0,0 +1,594 @@
+'''
+Simulated stand-in for the TDTPy DSPProject
+
+The experiment controllers only talk to the hardware through the handful of
+methods TDTPy provides (`DSPProject.load_circuit`, `DSPCircuit.get_buffer`,
+`get_tag`/`set_tag`, `DSPBuffer.read`, etc.).  The classes in this module
+implement the same methods without any hardware so that the controllers can be
+exercised (and their ability to keep up with the data measured) on any
+computer.
+
+The circuit "acquires" data in real time once the project is started.  Each
+time a buffer is read, the data acquired since the previous read is generated
+by the source attached to the buffer.  A source is any callable that takes the
+buffer, the index of the first sample and the number of samples and returns an
+array of shape (channels, n).  The sources provided are:
+
+    NoiseSource
+        Gaussian noise (a stand-in for the raw and filtered physiology)
+    ReplaySource
+        Data replayed (in a loop) from a multichannel array in a HDF5 file
+    TTLSource
+        Integer words whose bits toggle at random (e.g. FromBits/CompTo8)
+    EventSource
+        Timestamps of events occuring at random (e.g. trig/ and poke_all/).
+        The end of each event (e.g. trig\\) is reported by EventEndSource.
+    SnippetSource
+        Spike snippets in the format used by the SpikeSort component
+
+Like the hardware buffers, each buffer only holds a limited number of samples.
+If the buffer is not read often enough, the oldest samples are discarded and
+counted as dropped.  Each buffer also tracks the latency (the time between the
+acquisition of the oldest sample returned and the read) and the time spent
+reading.
+
+    >>> project = SimulatedDSPProject()
+    >>> circuit = project.load_circuit('physiology', 'RZ5')
+    >>> buffer = circuit.get_buffer('craw', 'r', channels=16)
+    >>> project.start()
+    >>> waveform = buffer.read()
+    >>> stats = buffer.statistics()
+'''
+
+from __future__ import division
+
+import re
+import time
+from collections import deque
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+# Sampling frequency of the circuit for each device type
+DEVICE_FS = {
+    'RZ5':  24414.0625,
+    'RZ6':  97656.25,
+    'RX6':  97656.25,
+    'RZ2':  24414.0625,
+    }
+
+# Number of seconds of data each buffer holds before samples are dropped
+BUFFER_DURATION = 2.0
+
+class NoiseSource(object):
+    '''
+    Gaussian noise with the given standard deviation
+
+    To keep the cost of generating the data well below the cost of reading it
+    from the hardware, a table of noise (table_duration seconds long) is
+    generated when the buffer is first read and then played in a loop.
+    '''
+
+    def __init__(self, std=10e-6, table_duration=1.0, seed=None):
+        self.std = std
+        self.table_duration = table_duration
+        self.random = np.random.RandomState(seed)
+        self._table = None
+
+    def __call__(self, buffer, start, samples):
+        if self._table is None or len(self._table) != buffer.channels:
+            n = max(1, int(self.table_duration*buffer.fs))
+            size = buffer.channels, n
+            self._table = (self.random.normal(size=size)*self.std) \
+                    .astype(buffer.dest_type)
+        i = np.arange(start, start+samples) % self._table.shape[-1]
+        return self._table[:, i]
+
+class ReplaySource(object):
+    '''
+    Replay data from a multichannel array (channels, samples), e.g. the raw
+    physiology saved in a previous experiment.  When the end of the array is
+    reached, the data is replayed from the start.  If the buffer has more
+    channels than the array, the channels are reused.
+    '''
+
+    def __init__(self, node, gain=1):
+        self.node = node
+        self.gain = gain
+
+    def __call__(self, buffer, start, samples):
+        n_channels, n_samples = self.node.shape[0], self.node.shape[-1]
+        blocks = []
+        while samples > 0:
+            lb = start % n_samples
+            ub = min(n_samples, lb+samples)
+            blocks.append(self.node[..., lb:ub])
+            samples -= ub-lb
+            start += ub-lb
+        data = np.concatenate(blocks, axis=-1)*self.gain
+        channels = np.arange(buffer.channels) % n_channels
+        return data[channels].astype(buffer.dest_type)
+
+class TTLSource(object):
+    '''
+    Integer words containing `width` TTLs (one per bit).  Each TTL toggles at
+    random, on average `rate` times per second.
+    '''
+
+    def __init__(self, rate=1.0, width=6, seed=None):
+        self.rate = rate
+        self.width = width
+        self.random = np.random.RandomState(seed)
+        self.state = np.zeros(width, dtype=np.int64)
+
+    def __call__(self, buffer, start, samples):
+        p = self.rate/buffer.fs
+        toggles = self.random.uniform(size=(samples, self.width)) < p
+        bits = (np.cumsum(toggles, axis=0)+self.state) % 2
+        if samples:
+            self.state = bits[-1]
+        words = (bits << np.arange(self.width)).sum(axis=1)
+        return words[np.newaxis].astype(buffer.dest_type)
+
+class EventSource(object):
+    '''
+    Timestamps (in samples) of events that occur at random, on average `rate`
+    times per second.  Each event lasts `duration` seconds.
+
+    The events are generated once and kept so that the buffer reporting the
+    start of each event (e.g. trig/) and the buffer reporting the end (e.g.
+    trig\\, see `EventEndSource`) see the same events regardless of the order
+    in which they are read.
+    '''
+
+    def __init__(self, rate=1.0, duration=0.1, seed=None):
+        self.rate = rate
+        self.duration = duration
+        self.random = np.random.RandomState(seed)
+        self._events = np.array([], dtype=np.int64)
+        self._generated = 0
+
+    def timestamps(self, buffer, start, samples):
+        stop = start+samples
+        if stop > self._generated:
+            n = self.random.poisson(self.rate*(stop-self._generated)/buffer.fs)
+            ts = np.sort(self.random.randint(self._generated, stop, n))
+            self._events = np.concatenate((self._events, ts))
+            self._generated = stop
+        lb, ub = np.searchsorted(self._events, [start, stop])
+        return self._events[lb:ub]
+
+    def ends(self, buffer, start, samples):
+        '''
+        Timestamps of the end of the events that end between start and
+        start+samples
+        '''
+        offset = int(self.duration*buffer.fs)
+        return self.timestamps(buffer, start-offset, samples)+offset
+
+    def __call__(self, buffer, start, samples):
+        ts = self.timestamps(buffer, start, samples)
+        return ts[np.newaxis].astype(buffer.dest_type)
+
+class EventEndSource(object):
+    '''
+    Timestamps (in samples) of the end of the events generated by an
+    EventSource.  The end of an event is never reported before its start.
+    '''
+
+    def __init__(self, source):
+        self.source = source
+        self.fs = getattr(source, 'fs', None)
+
+    def __call__(self, buffer, start, samples):
+        ts = self.source.ends(buffer, start, samples)
+        return ts[np.newaxis].astype(buffer.dest_type)
+
+class SnippetSource(EventSource):
+    '''
+    Spike snippets in the format of the SpikeSort component.  Each snippet
+    occupies block_size samples of the buffer.  The first sample is the
+    timestamp and the last sample is the classifier (both are 32-bit integers
+    stored in the float32 buffer).  The samples in between are the waveform.
+    '''
+
+    def __init__(self, rate=20.0, amplitude=50e-6, std=10e-6, seed=None):
+        EventSource.__init__(self, rate, seed=seed)
+        self.amplitude = amplitude
+        self.std = std
+
+    def __call__(self, buffer, start, samples):
+        ts = self.timestamps(buffer, start, samples)
+        n = buffer.block_size-2
+        t = np.linspace(-1, 1, n)
+        template = -self.amplitude*np.exp(-(t*4)**2)
+        snippets = np.empty((len(ts), buffer.block_size), dtype=np.float32)
+        snippets[:, 1:-1] = template + \
+                self.random.normal(size=(len(ts), n))*self.std
+        snippets[:, 0] = ts.astype(np.int32).view(np.float32)
+        snippets[:, -1] = np.zeros(len(ts), dtype=np.int32).view(np.float32)
+        return snippets.reshape((1, -1))
+
+# Sources used when no source has been specified for the buffer.  The first
+# pattern that matches the buffer name is used.
+DEFAULT_SOURCES = [
+    (r'.*[/\\]$',   EventSource),
+    (r'^spike\d+$', SnippetSource),
+    (r'^TTL',       TTLSource),
+    (r'.*',         NoiseSource),
+    ]
+
+def default_source(name):
+    for pattern, factory in DEFAULT_SOURCES:
+        if re.match(pattern, name):
+            return factory()
+
+class SimulatedBuffer(object):
+    '''
+    Simulated hardware buffer.  Read buffers return all data acquired since
+    the previous read (up to the capacity of the buffer).  Write buffers
+    simply count the number of samples written.
+    '''
+
+    def __init__(self, circuit, name, mode, source=None, channels=1,
+                 block_size=1, dest_type='float32', fs=None, size=None):
+        self.circuit = circuit
+        self.name = name
+        self.mode = mode
+        self.source = default_source(name) if source is None else source
+        self.channels = channels
+        self.block_size = block_size
+        self.dest_type = np.dtype(dest_type)
+        self.fs = circuit.fs if fs is None else fs
+        if size is None:
+            size = int(circuit.project.buffer_duration*self.fs)
+        self.size = size
+
+        # Each entry in the queue is the time the first sample of the block was
+        # acquired and the block of data
+        self._pending = deque()
+        self._n_pending = 0
+        self._position = 0
+
+        self.n_reads = 0
+        self.samples_read = 0
+        self.samples_written = 0
+        self.dropped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.read_time = 0.0
+
+    def _acquire(self, now):
+        if self.circuit.start_time is None:
+            return
+        samples = int((now-self.circuit.start_time)*self.fs)-self._position
+        if samples <= 0:
+            return
+        acquired = self.circuit.start_time + (self._position+1)/self.fs
+        data = self.source(self, self._position, samples)
+        self._position += samples
+        if data.shape[-1]:
+            self._pending.append((acquired, data))
+            self._n_pending += data.shape[-1]
+
+        # Discard the oldest data if the buffer has overflowed.  Data is
+        # discarded in whole blocks so that snippets are never split.
+        excess = self._n_pending-self.size
+        excess = int(np.ceil(excess/self.block_size))*self.block_size
+        while excess > 0:
+            acquired, data = self._pending.popleft()
+            if data.shape[-1] > excess:
+                self._pending.appendleft((acquired+excess/self.fs,
+                                          data[:, excess:]))
+                n = excess
+            else:
+                n = data.shape[-1]
+            self._n_pending -= n
+            self.dropped += n
+            excess -= n
+
+    def pending(self):
+        '''
+        Number of samples acquired that have not been read
+        '''
+        self._acquire(self.circuit.project.clock())
+        return self._n_pending
+
+    def read(self, samples=None):
+        '''
+        Return the data acquired since the last read.  If samples is provided,
+        no more than the requested number of samples are returned (the rest
+        are left in the buffer).
+        '''
+        t_start = self.circuit.project.clock()
+        self._acquire(t_start)
+        if samples is None or samples > self._n_pending:
+            samples = self._n_pending
+
+        blocks = []
+        latency = 0.0
+        remaining = samples
+        while remaining > 0:
+            acquired, data = self._pending.popleft()
+            if not blocks:
+                latency = t_start-acquired
+            if data.shape[-1] > remaining:
+                self._pending.appendleft((acquired+remaining/self.fs,
+                                          data[:, remaining:]))
+                data = data[:, :remaining]
+            blocks.append(data)
+            remaining -= data.shape[-1]
+        self._n_pending -= samples
+
+        if blocks:
+            data = np.concatenate(blocks, axis=-1)
+        else:
+            data = np.empty((self.channels, 0), dtype=self.dest_type)
+        if self.circuit.project.transfer_rate:
+            time.sleep(data.nbytes/self.circuit.project.transfer_rate)
+
+        self.n_reads += 1
+        self.samples_read += samples
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.read_time += self.circuit.project.clock()-t_start
+        return data[0] if self.channels == 1 else data
+
+    def read_all(self):
+        return self.read()
+
+    def write(self, data):
+        self.samples_written += np.asarray(data).shape[-1]
+
+    def set(self, data):
+        self.samples_written = 0
+        self.write(data)
+
+    def clear(self):
+        self._pending.clear()
+        self._n_pending = 0
+
+    def statistics(self):
+        '''
+        Returns dictionary containing the number of reads, samples read and
+        dropped, the mean and maximum latency (in seconds) and the total time
+        spent reading (in seconds)
+        '''
+        mean = self.total_latency/self.n_reads if self.n_reads else 0.0
+        return dict(name=self.name, n=self.n_reads, samples=self.samples_read,
+                    dropped=self.dropped, mean_latency=mean,
+                    max_latency=self.max_latency, read_time=self.read_time)
+
+class SimulatedCircuit(object):
+
+    def __init__(self, project, circuit_name, device_name, fs, tags=None):
+        self.project = project
+        self.circuit_name = circuit_name
+        self.device_name = device_name
+        self.fs = fs
+        self.tags = {} if tags is None else dict(tags)
+        self.buffers = []
+        self.triggers = []
+        self.start_time = None
+        self._event_sources = {}
+
+    def get_source(self, name):
+        '''
+        Returns the source for the buffer (None if the default source should
+        be used).  The buffers reporting the start (e.g. trig/) and end (e.g.
+        trig\\) of the same events share a single EventSource.
+        '''
+        source = self.project.sources.get(name, None)
+        if source is not None:
+            return source
+        if name.endswith('\\'):
+            return EventEndSource(self.get_source(name[:-1]+'/'))
+        if name.endswith('/'):
+            if name not in self._event_sources:
+                self._event_sources[name] = default_source(name)
+            return self._event_sources[name]
+        return None
+
+    def get_buffer(self, name, mode, src_type='float32', dest_type=None,
+                   channels=1, block_size=1, **kwargs):
+        if dest_type is None:
+            dest_type = src_type
+        source = self.get_source(name)
+        buffer = SimulatedBuffer(self, name, mode, source, channels,
+                                 block_size, dest_type,
+                                 getattr(source, 'fs', None))
+        self.buffers.append(buffer)
+        return buffer
+
+    def get_clock(self):
+        '''
+        Number of samples since the circuit was started
+        '''
+        if self.start_time is None:
+            return 0
+        return int((self.project.clock()-self.start_time)*self.fs)
+
+    def get_tag(self, name):
+        # zTime is the tag the circuits use to report the current time
+        if name == 'zTime':
+            return self.get_clock()
+        return self.tags.get(name, 0)
+
+    def set_tag(self, name, value):
+        self.tags[name] = value
+
+    def convert(self, value, src_unit, dest_unit):
+        scale = {'s': self.fs, 'ms': self.fs*1e-3, 'n': 1, None: 1}
+        return value*scale[src_unit]/scale[dest_unit]
+
+    def cset_tag(self, name, value, src_unit=None, dest_unit=None):
+        self.set_tag(name, self.convert(value, src_unit, dest_unit))
+
+    def cget_tag(self, name, src_unit=None, dest_unit=None):
+        return self.convert(self.get_tag(name), src_unit, dest_unit)
+
+    def set_coefficients(self, name, coefficients):
+        self.tags[name] = np.asarray(coefficients)
+
+    def trigger(self, name, mode='pulse'):
+        self.triggers.append((self.project.clock(), name, mode))
+
+    def start(self):
+        if self.start_time is None:
+            self.start_time = self.project.clock()
+
+    def stop(self):
+        pass
+
+class SimulatedDSPProject(object):
+    '''
+    Drop-in replacement for tdt.DSPProject
+
+    Parameters
+    ----------
+    sources : dict
+        Mapping of buffer name to the source that generates the data for the
+        buffer.  If the source has a `fs` attribute, it is used as the
+        sampling frequency of the buffer.  Buffers not listed use the source
+        returned by `default_source`.
+    tags : dict
+        Initial value of the tags in each circuit (tags that have not been set
+        are 0)
+    fs : float
+        Sampling frequency of the circuits.  Defaults to the sampling frequency
+        of the device (see DEVICE_FS).
+    buffer_duration : float
+        Number of seconds of data each buffer holds before samples are dropped
+    transfer_rate : float
+        If provided, each read sleeps for the time it would take to transfer
+        the data at this rate (in bytes per second) to emulate the cost of
+        downloading the data from the hardware.
+    clock : callable
+        Returns the current time in seconds
+    '''
+
+    def __init__(self, address=None, sources=None, tags=None, fs=None,
+                 buffer_duration=BUFFER_DURATION, transfer_rate=None,
+                 clock=time.time):
+        self.address = address
+        self.sources = {} if sources is None else sources
+        self.tags = {} if tags is None else tags
+        self.fs = fs
+        self.buffer_duration = buffer_duration
+        self.transfer_rate = transfer_rate
+        self.clock = clock
+        self.circuits = []
+        self.triggers = []
+
+    def load_circuit(self, circuit_name, device_name, **kwargs):
+        log.debug('Loading simulated circuit %s on %s', circuit_name,
+                  device_name)
+        fs = self.fs if self.fs is not None else DEVICE_FS.get(device_name,
+                                                               DEVICE_FS['RZ5'])
+        circuit = SimulatedCircuit(self, circuit_name, device_name, fs,
+                                   self.tags)
+        self.circuits.append(circuit)
+        return circuit
+
+    def start(self):
+        for circuit in self.circuits:
+            circuit.start()
+
+    def stop(self):
+        for circuit in self.circuits:
+            circuit.stop()
+
+    def trigger(self, name, mode='pulse'):
+        self.triggers.append((self.clock(), name, mode))
+
+    def statistics(self):
+        '''
+        Returns list of statistics (see `SimulatedBuffer.statistics`) for all
+        read buffers
+        '''
+        return [b.statistics() for c in self.circuits for b in c.buffers \
+                if b.mode == 'r']
+
+class RZ6(object):
+    '''
+    Attenuator helpers normally provided by tdt.device.RZ6
+    '''
+
+    @staticmethod
+    def split_attenuation(atten):
+        '''
+        Split the attenuation into the hardware attenuation (in 20 dB steps,
+        up to 60 dB) and the remaining attenuation that must be realized by
+        scaling the waveform.
+        '''
+        hw = min(max(0, np.floor(atten/20.0)*20), 60)
+        return hw, atten-hw
+
+    @staticmethod
+    def atten_to_bits(att1, att2):
+        '''
+        Encode the number of hardware attenuation steps for both outputs in a
+        single integer.  The simulated circuit only stores the value, so the
+        encoding does not match the one used by the RZ6.
+        '''
+        steps1 = int(RZ6.split_attenuation(att1)[0]//20)
+        steps2 = int(RZ6.split_attenuation(att2)[0]//20)
+        return steps1 | (steps2 << 2)
+
+class SimulatedPump(object):
+    '''
+    Stand-in for new_era.PumpInterface that stores the settings and adds the
+    volume to the volume infused each time the pump is run.  Volumes are
+    stored in ml.
+    '''
+
+    VOLUME_UNITS = {'ul': 1e-3, 'ml': 1.0, None: 1.0}
+
+    def __init__(self):
+        self.volume = 0.0
+        self.rate = 0.0
+        self.diameter = 0.0
+        self.direction = 'infuse'
+        self.trigger = ('rising', None)
+        self.infused = 0.0
+
+    def set_volume(self, volume, unit=None):
+        self.volume = volume*self.VOLUME_UNITS[unit]
+
+    def get_volume(self, unit=None):
+        return self.volume/self.VOLUME_UNITS[unit]
+
+    def set_rate(self, rate, unit=None):
+        self.rate = rate
+
+    def get_rate(self, unit=None):
+        return self.rate
+
+    def set_diameter(self, diameter, unit=None):
+        self.diameter = diameter
+
+    def set_direction(self, direction):
+        self.direction = direction
+
+    def set_trigger(self, start, stop):
+        self.trigger = start, stop
+
+    def get_trigger(self):
+        return self.trigger
+
+    def get_infused(self, unit=None):
+        return self.infused/self.VOLUME_UNITS[unit]
+
+    def run(self):
+        self.infused += self.volume
+
+    def stop(self):
+        pass
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        pass
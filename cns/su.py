@@ -90,6 +90,54 @@ def rossum_distance(smoothed):
     b = smoothed[:,np.newaxis,:]
     return ne.evaluate('sum((a-b)**2, axis=2)')
 
+def condensed_rossum_distance(smoothed, max_memory=100e6):
+    '''
+    Compute pair-wise rossum distance between the smoothed trains (see
+    `smoothed_train`) given a MxN matrix, `smoothed`, and return the result as
+    a condensed distance matrix (i.e. the upper triangle in the same order used
+    by `scipy.spatial.distance.squareform`).
+
+    This returns the same values as `rossum_distance`; however, the memory
+    required by `rossum_distance` grows as M*M*N which is not practical for
+    more than a few hundred trials.  Here, the distances are computed using the
+    identity |a-b|^2 = |a|^2 + |b|^2 - 2a.b so the bulk of the work is a matrix
+    product that is handed off to BLAS.  The product is computed in blocks of
+    rows so that the temporary arrays never exceed `max_memory` bytes.
+
+    Result *must* be normalized by vector density and smoothing time constant.
+
+    Example
+    -------
+    >>> smoothed = smoothed_train(et, tt, 0, 0.5)
+    >>> d = condensed_rossum_distance(smoothed, max_memory=500e6)
+    >>> square = scipy.spatial.distance.squareform(d)
+    '''
+    smoothed = np.asarray(smoothed, dtype=np.double)
+    m = len(smoothed)
+    if m < 2:
+        return np.empty(0)
+    norms = np.einsum('ij,ij->i', smoothed, smoothed)
+    result = np.empty(m*(m-1)//2)
+
+    # Each block requires a (block, m) array for the dot product, the boolean
+    # mask used to extract the upper triangle and the copy of the upper
+    # triangle extracted by the mask.
+    block = int(max(1, max_memory//(17*m)))
+    offset = 0
+    for lb in range(0, m, block):
+        ub = min(lb+block, m)
+        d = np.dot(smoothed[lb:ub], smoothed[lb:].T)
+        d *= -2
+        d += norms[lb:ub, np.newaxis]
+        d += norms[np.newaxis, lb:]
+        # Roundoff error can produce small negative values for identical trains
+        np.clip(d, 0, np.inf, out=d)
+        mask = np.arange(lb, m)[np.newaxis] > np.arange(lb, ub)[:, np.newaxis]
+        values = d[mask]
+        result[offset:offset+len(values)] = values
+        offset += len(values)
+    return result
+
 def smoothed_train(et, tt, offset, duration, density=0.001, tau=0.01):
     '''
     Return the spike train extracted at [offset, offset+duration) smoothed by an
@@ -141,6 +189,154 @@ def fano_factor(et, tt, bin_width, lb, ub):
     histograms = np.c_[histograms]
     return histograms.var(0)/histograms.mean(0)
 
+def _window_members(lb_i, ub_i):
+    '''
+    Given the lower and upper index (as returned by searchsorted) of a set of
+    windows, return the index of every event falling in each window along with
+    the index of the window it belongs to.  Overlapping windows are handled
+    correctly (the event will be returned once for each window it falls in).
+    '''
+    counts = ub_i-lb_i
+    window = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts)-counts
+    event = lb_i[window] + np.arange(counts.sum()) - starts[window]
+    return event, window
+
+def binned_counts(et, units, tt, conditions, bin_width, lb, ub, latency=0,
+                  censored=None):
+    '''
+    Compute the binned spike counts for all units and all trials in a single
+    pass.
+
+    Rather than looping over each unit and condition in Python, the spike times
+    from all units are sorted once and the window for each trigger is located
+    via a single call to searchsorted.  The spikes falling in each window are
+    then assigned to a (unit, condition, trial, bin) index and tallied with a
+    single call to bincount.
+
+    Unlike the other functions in this module, `et` does not need to be sorted.
+
+    Parameters
+    ----------
+    et : 1D array
+        Spike times (from all units)
+    units : 1D array
+        Unit label of each spike in `et` (e.g. the cluster id)
+    tt : 1D array
+        Trigger times
+    conditions : 1D array
+        Condition label of each trigger in `tt` (e.g. the stimulus level)
+    bin_width, lb, ub, latency
+        See `histogram_bins`
+    censored : 2D array of epochs
+        Triggers whose window overlaps a censored epoch are discarded
+
+    Returns
+    -------
+    counts : 4D array (unit, condition, trial, bin)
+        Number of spikes in each bin.  Since the number of trials typically
+        varies from condition to condition, the trial axis is sized to the
+        condition with the most trials and the unused trials are padded with
+        zeros (use `n_trials` when reducing across trials).
+    bins : 1D array
+        Lower edge of each bin relative to the trigger
+    unit_ids : 1D array
+        Unit label for each index along the first axis of `counts`
+    condition_ids : 1D array
+        Condition label for each index along the second axis of `counts`
+    n_trials : 1D array
+        Number of valid trials for each condition
+
+    Example
+    -------
+    >>> counts, bins, unit_ids, condition_ids, n_trials = \\
+    ...     binned_counts(et, units, tt, levels, 0.01, -0.1, 0.5)
+    >>> psth = batch_histogram(counts, n_trials, 0.01)
+    >>> ff = batch_fano_factor(counts, n_trials)
+    '''
+    et = np.asarray(et)
+    units = np.asarray(units)
+    tt = np.asarray(tt)
+    conditions = np.asarray(conditions)
+
+    if censored is not None:
+        mask = epochs_contain(censored, tt+lb) | epochs_contain(censored, tt+ub)
+        tt, conditions = tt[~mask], conditions[~mask]
+    if len(tt) == 0:
+        raise ValueError, 'No trials to compute histogram on'
+
+    # Map the unit and condition labels onto a contiguous set of indices
+    unit_ids, unit_i = np.unique(units, return_inverse=True)
+    condition_ids, condition_i = np.unique(conditions, return_inverse=True)
+
+    # Index of each trigger within its condition (in order of presentation)
+    n_trials = np.bincount(condition_i, minlength=len(condition_ids))
+    order = np.argsort(condition_i, kind='mergesort')
+    trial_i = np.empty(len(tt), dtype='i')
+    trial_i[order] = np.arange(len(tt)) - \
+            (np.cumsum(n_trials)-n_trials)[condition_i[order]]
+
+    # Sort the spikes (from all units) once so we can locate the window for
+    # each trigger using a single searchsorted pass.
+    spike_order = np.argsort(et, kind='mergesort')
+    et, unit_i = et[spike_order], unit_i[spike_order]
+    bins = histogram_bins(bin_width, lb, ub, latency)
+    lb_i = np.searchsorted(et, tt+bins[0])
+    ub_i = np.searchsorted(et, tt+bins[-1])
+    spike, trigger = _window_members(lb_i, ub_i)
+
+    n_bins = len(bins)-1
+    bin_i = np.searchsorted(bins, et[spike]-tt[trigger], side='right')-1
+    valid = (bin_i >= 0) & (bin_i < n_bins)
+    spike, trigger, bin_i = spike[valid], trigger[valid], bin_i[valid]
+
+    shape = len(unit_ids), len(condition_ids), n_trials.max(), n_bins
+    index = np.ravel_multi_index((unit_i[spike], condition_i[trigger],
+                                  trial_i[trigger], bin_i), shape)
+    counts = np.bincount(index, minlength=np.prod(shape)).reshape(shape)
+    return counts, bins[:-1], unit_ids, condition_ids, n_trials
+
+def batch_rates(counts, bin_width):
+    '''
+    Compute the rate on each trial across the full analysis window given the
+    output of `binned_counts`.
+
+    Returns
+    -------
+    3D array (unit, condition, trial)
+    '''
+    return counts.sum(-1)/(counts.shape[-1]*bin_width)
+
+def batch_histogram(counts, n_trials, bin_width):
+    '''
+    Compute the peri-stimulus time histogram (as a rate) for each unit and
+    condition given the output of `binned_counts`.  Equivalent to calling
+    `histogram` on each unit and condition.
+
+    Returns
+    -------
+    3D array (unit, condition, bin)
+    '''
+    return counts.sum(2)/n_trials[:,np.newaxis]/bin_width
+
+def batch_fano_factor(counts, n_trials):
+    '''
+    Compute the Fano factor in each bin for each unit and condition given the
+    output of `binned_counts`.  Equivalent to calling `fano_factor` on each
+    unit and condition.
+
+    The padded trials in `counts` are zero, so they do not contribute to the
+    sums used to compute the mean and variance.
+
+    Returns
+    -------
+    3D array (unit, condition, bin)
+    '''
+    n = n_trials[:,np.newaxis]
+    mean = counts.sum(2)/n
+    var = (counts**2).sum(2)/n - mean**2
+    return var/mean
+
 def histogram_bins(bin_width, lb, ub, latency=0):
     '''
     Compute bins to use for generating histograms
@@ -0,0 +1,42 @@
+import unittest
+from os import path
+from tempfile import mkdtemp
+
+import numpy as np
+import tables
+from numpy.testing import assert_array_almost_equal
+
+from cns.channel import ScaledFileMultiChannel
+
+class TestScaledFileMultiChannel(unittest.TestCase):
+
+    def setUp(self):
+        self.fh = tables.openFile(path.join(mkdtemp(), 'test.h5'), 'w')
+        self.gain = np.array([1e-3, 2e-3, 4e-3], dtype='float32')
+        self.offset = np.array([0, 0.5, -0.5], dtype='float32')
+
+    def tearDown(self):
+        self.fh.close()
+
+    def testIndexing(self):
+        data = np.random.RandomState(1).uniform(-1, 1, size=(3, 100))
+        keys = [np.s_[0], np.s_[1, :], np.s_[:, 5], np.s_[[0, 2], :10],
+                np.s_[..., 20:30]]
+        # Read from the file and from the cache of recent data
+        for cache_duration in (0, 1):
+            channel = ScaledFileMultiChannel(node=self.fh.root,
+                                             name='c{}'.format(cache_duration),
+                                             channels=3, fs=1000,
+                                             gain=self.gain,
+                                             offset=self.offset,
+                                             cache_duration=cache_duration)
+            channel.send(data)
+            stored = channel._buffer[:]
+            expected = stored*self.gain[:, np.newaxis] + \
+                    self.offset[:, np.newaxis]
+            for key in keys:
+                self.assertEqual(channel[key].shape, stored[key].shape)
+                assert_array_almost_equal(channel[key], expected[key])
+
+if __name__ == '__main__':
+    unittest.main()
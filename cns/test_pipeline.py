@@ -0,0 +1,107 @@
+import unittest
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+
+from cns import pipeline
+
+@pipeline.pipeline
+def collector(result):
+    while True:
+        result.append((yield))
+
+class TestSampleBuffer(unittest.TestCase):
+
+    def testExtendDiscard(self):
+        buffered = pipeline.SampleBuffer(4)
+        expected = np.array([])
+        for i in range(20):
+            data = np.arange(i*3, i*3+3)
+            buffered.extend(data)
+            expected = np.r_[expected, data]
+            buffered.discard(2)
+            expected = expected[2:]
+            assert_array_equal(buffered.data, expected)
+
+    def testMultidimensional(self):
+        buffered = pipeline.SampleBuffer(4)
+        data = np.random.uniform(size=(10, 3))
+        buffered.extend(data[:7])
+        buffered.discard(5)
+        buffered.extend(data[7:])
+        assert_array_equal(buffered.data, data[5:])
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.result = []
+        self.sink = collector(self.result)
+
+    def testLfilter(self):
+        from scipy import signal
+        b, a = signal.butter(4, 0.1)
+        data = np.random.uniform(size=(4, 1000))
+        stage = pipeline.lfilter(b, a, self.sink)
+        for block in np.split(data, 10, axis=-1):
+            stage.send(block)
+        assert_array_almost_equal(np.concatenate(self.result, axis=-1),
+                                  signal.lfilter(b, a, data))
+
+    def testSosfilt(self):
+        from scipy import signal
+        sos = signal.butter(4, (0.1, 0.2), btype='band', output='sos')
+        data = np.random.uniform(size=(4, 1000))
+        stage = pipeline.sosfilt(sos, self.sink)
+        for block in np.split(data, 10, axis=-1):
+            stage.send(block)
+        assert_array_almost_equal(np.concatenate(self.result, axis=-1),
+                                  signal.sosfilt(sos, data))
+
+    def testMovingAverage(self):
+        data = np.random.uniform(size=(97, 2))
+        for weights in (None, np.arange(10)):
+            del self.result[:]
+            stage = pipeline.moving_average(10, weights, 3, self.sink)
+            for block in np.array_split(data, 7):
+                stage.send(block)
+            expected = [np.average(data[i:i+10], weights=weights, axis=0) \
+                        for i in range(0, len(data)-9, 7)]
+            assert_array_almost_equal(np.concatenate(self.result), expected)
+
+    def testDecimate(self):
+        data = np.random.uniform(size=103)
+        stage = pipeline.sp_decimate(10, self.sink)
+        for block in np.array_split(data, 7):
+            stage.send(block)
+        max_data = np.concatenate([r[0] for r in self.result])
+        min_data = np.concatenate([r[1] for r in self.result])
+        assert_array_equal(max_data, data[:100].reshape((10, 10)).max(1))
+        assert_array_equal(min_data, data[:100].reshape((10, 10)).min(1))
+
+    def testBuffer(self):
+        data = np.random.uniform(size=50)
+        padded = np.r_[np.ones(20)*np.nan, data]
+        stage = pipeline.buffer(20, self.sink)
+        for i in range(5, 55, 5):
+            stage.send(data[i-5:i])
+            assert_array_equal(self.result[-1], padded[i:i+20])
+
+    def testDeinterleave(self):
+        other = []
+        stage = pipeline.deinterleave([self.sink, None, collector(other)])
+        data = np.random.uniform(size=(3, 10))
+        stage.send(data)
+        assert_array_equal(self.result[0], data[0])
+        assert_array_equal(other[0], data[2])
+        self.assertTrue(np.may_share_memory(self.result[0], data))
+
+    def testDeinterleaveBits(self):
+        results = [[] for i in range(6)]
+        targets = [collector(r) for r in results]
+        stage = pipeline.deinterleave_bits(targets)
+        data = np.random.randint(0, 64, size=50).astype('int8')
+        stage.send(data)
+        for bit, result in enumerate(results):
+            assert_array_equal(result[0], (data >> bit) & 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from cns.simulated_dsp import (SimulatedDSPProject, ReplaySource,
+                               SnippetSource, EventSource)
+
+class Clock(object):
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+class TestSimulatedDSP(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.project = SimulatedDSPProject(fs=1000.0, buffer_duration=1.0,
+                                           clock=self.clock)
+        self.circuit = self.project.load_circuit('physiology', 'RZ5')
+
+    def testThroughput(self):
+        buffer = self.circuit.get_buffer('craw', 'r', channels=16)
+        self.assertEqual(buffer.read().shape, (16, 0))
+        self.project.start()
+        samples = 0
+        for i in range(20):
+            self.clock.time += 0.1
+            data = buffer.read()
+            self.assertEqual(data.shape[0], 16)
+            samples += data.shape[-1]
+        self.assertEqual(samples, 2000)
+        stats = buffer.statistics()
+        self.assertEqual(stats['dropped'], 0)
+        self.assertAlmostEqual(stats['max_latency'], 0.1, 2)
+
+    def testDropped(self):
+        buffer = self.circuit.get_buffer('craw', 'r', channels=4)
+        self.project.start()
+        self.clock.time = 2.5
+        data = buffer.read()
+        self.assertEqual(data.shape, (4, 1000))
+        self.assertEqual(buffer.dropped, 1500)
+        self.assertAlmostEqual(buffer.max_latency, 1.0, 2)
+
+    def testReplay(self):
+        node = np.arange(30).reshape((3, 10))
+        source = ReplaySource(node)
+        self.project.sources['craw'] = source
+        buffer = self.circuit.get_buffer('craw', 'r', channels=4)
+        self.project.start()
+        self.clock.time = 0.015
+        expected = np.tile(node, 2)[[0, 1, 2, 0], :15]
+        assert_array_equal(buffer.read(5), expected[:, :5])
+        assert_array_equal(buffer.read(), expected[:, 5:])
+
+    def testSnippets(self):
+        self.project.sources['spike1'] = SnippetSource(rate=20, seed=1)
+        buffer = self.circuit.get_buffer('spike1', 'r', block_size=28)
+        self.project.start()
+        self.clock.time = 1.0
+        data = buffer.read().reshape((-1, 28))
+        self.assertTrue(len(data) > 0)
+        ts = data[:, 0].view('int32')
+        self.assertTrue((np.diff(ts) >= 0).all())
+        self.assertTrue(((ts >= 0) & (ts < 1000)).all())
+
+    def testEventEnds(self):
+        self.project.sources['trig/'] = EventSource(rate=5, duration=0.1,
+                                                    seed=1)
+        starts = self.circuit.get_buffer('trig/', 'r', src_type='int32')
+        ends = self.circuit.get_buffer('trig\\', 'r', src_type='int32')
+        self.project.start()
+        self.clock.time = 0.5
+        # The end buffer is read first to ensure it does not report ends for
+        # events that differ from those in the start buffer.
+        e = ends.read()
+        self.clock.time = 1.0
+        e = np.concatenate((e, ends.read()))
+        s = starts.read()
+        self.assertTrue(len(e) > 0)
+        self.assertTrue(len(s) >= len(e))
+        assert_array_equal(e, s[:len(e)]+100)
+
+    def testTags(self):
+        self.circuit.cset_tag('resp_dur_n', 0.5, 's', 'n')
+        self.assertEqual(self.circuit.get_tag('resp_dur_n'), 500)
+        self.project.start()
+        self.clock.time = 0.25
+        self.assertEqual(self.circuit.get_tag('zTime'), 250)
+
+if __name__ == '__main__':
+    unittest.main()
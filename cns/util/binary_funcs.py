@@ -92,7 +92,7 @@ def epochs_overlap(a, b):
     j = np.searchsorted(a[:,1], b[:,1])
     return i != j
 
-def int_to_TTL(a, width):
+def int_to_TTL(a, width, out=None):
     '''
     Converts a 1D array of integers to a 2D boolean array based on the binary
     representation of each integer.
@@ -114,8 +114,12 @@ def int_to_TTL(a, width):
     Using this approach, the memory overhead and amount of data being
     transferred has been reduced by a factor of 24.
 
-    This function uses Numpy's bitshift and bitmask operators, so the algorithm
-    should be pretty efficient.
+    Rather than shifting and masking the array once for each bit (which creates
+    several temporary arrays per bit), the integers are viewed as raw bytes and
+    each byte is expanded into its 8 bits in a single pass using
+    `np.unpackbits`.  Only the bytes needed to represent `width` bits are
+    decoded.  When the TTLs fit in a single byte and `out` is not provided, the
+    result is a view of the unpacked bits (no additional copy is made).
 
     Parameters
     ==========
@@ -124,6 +128,11 @@ def int_to_TTL(a, width):
         The dtype (either int8, int16 or int32) of the array is used to figure
         out the size of the second dimension.  This will depend on your
         combination of `FromBits` and the shuffle/compression components.
+    width : int
+        Number of bits to decode
+    out : { None, array }
+        Boolean array of shape (width, len(a)) to write the result to.  Useful
+        for avoiding reallocation when decoding a large dataset in chunks.
 
     Returns
     =======
@@ -137,9 +146,69 @@ def int_to_TTL(a, width):
            [False, False, False,  True, False, False],
            [ True, False,  True, False, False, False]], dtype=bool)
     '''
-    a = np.array(a)
-    bitarray = [(a>>bit) & 1 for bit in range(width)]
-    return np.array(bitarray, dtype=np.bool)
+    a = np.asarray(a)
+    shape = a.shape
+    a = np.ascontiguousarray(a.ravel(), dtype=a.dtype.newbyteorder('<'))
+    itemsize = a.dtype.itemsize
+
+    # View each integer as an array of bytes (least-significant byte first).
+    # np.unpackbits expands each byte into 8 rows with the most-significant bit
+    # first, so we reverse the rows to obtain little-endian order.
+    n_bytes = min(itemsize, (width+7)//8)
+    a_bytes = a.view(np.uint8).reshape((-1, itemsize))
+    if out is None and n_bytes == 1 and width <= 8:
+        bits = np.unpackbits(a_bytes[:, 0][np.newaxis], axis=0)
+        return bits[::-1][:width].view(np.bool).reshape((width,)+shape)
+
+    if out is None:
+        out = np.empty((width, a.size), dtype=np.bool)
+    out = out.reshape((width, a.size))
+    for i in range(n_bytes):
+        lb, ub = i*8, min(i*8+8, width)
+        bits = np.unpackbits(a_bytes[:, i][np.newaxis], axis=0)
+        out[lb:ub] = bits[::-1][:ub-lb].view(np.bool)
+
+    # Bits beyond the width of the dtype are set only for negative numbers
+    # (i.e. sign extension, for consistency with the bitshift operator).
+    if width > itemsize*8:
+        out[itemsize*8:] = (a < 0)
+    return out.reshape((width,)+shape)
+
+def iter_int_to_TTL(x, width, chunk_samples=None):
+    '''
+    Decode a large (e.g. on-disk) 1D array of integers in chunks.  See
+    `int_to_TTL`.
+
+    Chunks are read via `cns.arraytools.chunk_iter` and decoded into a single
+    preallocated boolean array that is reused on each iteration.  If you need to
+    hold on to the decoded chunk, be sure to make a copy.
+
+    Parameters
+    ==========
+    x : array_like
+        1D array (e.g. an instance of tables.Array) of integers to decode
+    width : int
+        Number of bits to decode
+    chunk_samples : { None, int }
+        Number of samples per chunk.  If None, a chunk size is chosen
+        automatically (see `cns.arraytools.chunk_samples`).
+
+    Example
+    =======
+    >>> x = np.array([0, 1, 3, 2, 0, 1])
+    >>> for TTL in iter_int_to_TTL(x, 2, chunk_samples=4):
+    ...     print TTL.astype('i')
+    [[0 1 1 0]
+     [0 0 1 1]]
+    [[0 1]
+     [0 0]]
+    '''
+    from cns.arraytools import chunk_iter, chunk_samples as get_chunk_samples
+    if chunk_samples is None:
+        chunk_samples = get_chunk_samples(x)
+    buffer = np.empty((width, chunk_samples), dtype=np.bool)
+    for chunk in chunk_iter(x, chunk_samples, out=True):
+        yield int_to_TTL(chunk, width, out=buffer[:, :len(chunk)])
 
 def bin_array(number, bits):
     '''Return binary representation of an integer as an integer array
@@ -159,7 +228,7 @@ def test_speed():
     setup = """
 from numpy.random import randint
 from cns.util.binary_funcs import int_to_TTL
-arr = randint(0, 8, 10e3)
+arr = randint(0, 8, int(10e3))
     """
     print timeit.timeit("int_to_TTL(arr, 8)", setup, number=20)
 
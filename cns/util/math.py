@@ -3,7 +3,6 @@ Collection of math-related functions to assist in various computations.
 '''
 from __future__ import division
 import numpy as np
-from scipy.stats import norm
 
 def rcount(sequence):
     '''
@@ -74,6 +73,7 @@ def dprime(n_nogo, n_go, n_fa, n_hit, clip=0.01):
     >>> d_prime(10, 10, 0, 10, 0.05)
     3.290
     '''
+    from scipy.stats import norm
 
     fa_frac = np.clip(n_fa/n_nogo, clip, 1-clip)
     hit_frac = np.clip(n_hit/n_go, clip, 1-clip)
@@ -83,6 +83,80 @@ def dprime(n_nogo, n_go, n_fa, n_hit, clip=0.01):
     c = (z_hit+z_fa)/2
     return d
 
+class RunningCovariance(object):
+    '''
+    Accumulates the mean and covariance of a stream of observations in
+    constant memory.
+
+    Observations are added in blocks (see `update`).  Each block is combined
+    with the running estimate using the pairwise algorithm of Chan, Golub and
+    LeVeque (1979), a generalization of Welford's algorithm that is
+    numerically stable (unlike accumulating the sum and sum of squares).
+    Partial estimates (e.g. from segments of a recording processed in
+    parallel) can be combined using `merge`.
+
+    >>> x = np.random.normal(size=(1000, 3))
+    >>> c = RunningCovariance(3)
+    >>> for block in np.array_split(x, 7):
+    ...     c.update(block)
+    >>> np.allclose(c.covariance(), np.cov(x.T))
+    True
+
+    >>> a, b = RunningCovariance(3), RunningCovariance(3)
+    >>> a.update(x[:300])
+    >>> b.update(x[300:])
+    >>> np.allclose(a.merge(b).covariance(), np.cov(x.T))
+    True
+    '''
+
+    def __init__(self, n_features):
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros((n_features, n_features))
+
+    @classmethod
+    def from_covariance(cls, n, mean, covariance, ddof=1):
+        '''
+        Restore the accumulator from a saved estimate (e.g. so it can be
+        merged with another)
+        '''
+        mean = np.asarray(mean, dtype=np.float64)
+        accumulator = cls(len(mean))
+        accumulator.n = n
+        accumulator.mean = mean.copy()
+        accumulator.m2 = np.asarray(covariance, dtype=np.float64)*(n-ddof)
+        return accumulator
+
+    def update(self, x):
+        '''
+        Add a block of observations (observation, feature)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) == 0:
+            return
+        mean = x.mean(axis=0)
+        deviation = x-mean
+        self._combine(len(x), mean, deviation.T.dot(deviation))
+
+    def merge(self, other):
+        '''
+        Combine the observations accumulated by another instance into this one
+        '''
+        self._combine(other.n, other.mean, other.m2)
+        return self
+
+    def _combine(self, n, mean, m2):
+        if n == 0:
+            return
+        total = self.n+n
+        delta = mean-self.mean
+        self.m2 += m2 + np.outer(delta, delta)*(self.n*n/total)
+        self.mean += delta*(n/total)
+        self.n = total
+
+    def covariance(self, ddof=1):
+        return self.m2/(self.n-ddof)
+
 if __name__ == '__main__':
     import doctest
     doctest.testmod()
@@ -2,6 +2,7 @@ from datetime import datetime
 from cns.data.h5_utils import get_or_append_node
 
 import subprocess
+import platform
 from os import path
 import os
 
@@ -174,8 +175,9 @@ class AbstractExperimentController(Controller):
     # The DSP process that will be responsible for handling all communication
     # with the DSPs.  All circuits must be loaded and buffers initialized before
     # the process is started (so the process can appropriately allocate the
-    # required shared memory resources).
-    process         = Instance('tdt.DSPProject')
+    # required shared memory resources).  This is either a tdt.DSPProject or,
+    # when simulating the hardware, a cns.simulated_dsp.SimulatedDSPProject.
+    process         = Any
     system_tray     = Any
 
     # Calibration objects
@@ -190,6 +192,11 @@ class AbstractExperimentController(Controller):
     # aware version of the TDTPy library.
     address = Trait(None, None, Tuple(Str, Int))
 
+    # Use simulated hardware (see cns.simulated_dsp) rather than TDTPy.  Useful
+    # for testing whether the controller can keep up with the data on
+    # computers that are not connected to the hardware.
+    simulate = Bool(False)
+
     # Start time of the experiment, in seconds
     start_time = Any
 
@@ -200,6 +207,9 @@ class AbstractExperimentController(Controller):
         # computers without having to install the tdt module.  Obviously the
         # experiment code will fail to run if TDTPy has not been installed, but
         # you should at least be able to get to a GUI.
+        if self.simulate:
+            from cns.simulated_dsp import SimulatedDSPProject
+            return SimulatedDSPProject(address=self.address)
         import tdt
         return tdt.DSPProject(address=self.address)
 
@@ -341,7 +351,9 @@ class AbstractExperimentController(Controller):
                 node._v_attrs['setting_' + k] = v
 
             # Get the computer host name so we know which computer was used
-            node._v_attrs['computer'] = os.environ['COMPUTERNAME']
+            # (COMPUTERNAME is only defined on Windows).
+            node._v_attrs['computer'] = os.environ.get('COMPUTERNAME',
+                                                       platform.node())
 
             # This will actually store a pickled copy of the calibration data
             # that can *only* be recovered with Python (and a copy of the
@@ -5,8 +5,9 @@ log = logging.getLogger(__name__)
 from traits.api import (List, Property, Tuple, cached_property, Any,
                                   Int, Event, HasTraits)
 
+from cns import get_config
 from cns.data.h5_utils import get_or_append_node
-from cns.channel import FileChannel
+from cns.channel import FileChannel, FileEdgeChannel
 from cns.util.math import rcount
 
 def string_array_equal(a, string):
@@ -31,8 +32,16 @@ class AbstractExperimentData(HasTraits):
     def apply_par_mask(self, fun, sequence):
         return self.apply_mask(fun, self.par_mask, sequence)
 
+    # Channels with attributes that are only saved when flushed (see
+    # cns.channel.FileMixin.flush)
+    _deferred_channels = List
+
     def _create_channel(self, name, dtype):
         contact_node = get_or_append_node(self.store_node, 'contact')
+        if np.dtype(dtype) == np.bool and get_config('TTL_STORAGE') == 'edges':
+            channel = FileEdgeChannel(node=contact_node, name=name)
+            self._deferred_channels.append(channel)
+            return channel
         return FileChannel(node=contact_node, name=name, dtype=dtype)
 
     def get_context(self):
@@ -130,6 +139,9 @@ class AbstractExperimentData(HasTraits):
         Called by stop_experiment when the stop button is pressed.  This is your
         chance to save relevant data.
         '''
+        for channel in self._deferred_channels:
+            channel.flush()
+
         # Dump the trial log table
         fh = self.store_node._v_file
         if len(self.trial_log):
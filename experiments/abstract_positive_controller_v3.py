@@ -87,7 +87,10 @@ class AbstractPositiveController(AbstractExperimentController):
         '''
         # Again, we hide the import so people can launch the GUI without being
         # able to run the experiment.
-        from tdt.device import RZ6
+        if self.simulate:
+            from cns.simulated_dsp import RZ6
+        else:
+            from tdt.device import RZ6
 
         # TDT's built-in attenuators for the RZ6 function in 20 dB steps, so we
         # need to determine the next greater step size for the attenuator.  The
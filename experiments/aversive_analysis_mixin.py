@@ -4,7 +4,9 @@ import numpy as np
 from matplotlib import mlab
 
 from traits.api import (Int, HasTraits, Range, Float, Enum,
-        cached_property, Property)
+        cached_property, Property, Any)
+
+from cns.channel import CumulativeSumIndex, FileEdgeChannel
 
 from sdt_data_mixin import SDTDataMixin
 
@@ -54,7 +56,8 @@ class AversiveAnalysisMixin(SDTDataMixin):
     contact_reference = Enum('trial start', 'trial end')
 
     # Basic analysis of masked data
-    contact_scores = Property(depends_on='trial_log, contact_dur, contact_offset')
+    contact_scores = Property(depends_on='trial_log, contact_dur, '
+                              'contact_offset, contact_reference')
     on_spout_seq = Property(depends_on='trial_log')
     off_spout_seq = Property(depends_on='trial_log')
     fa_seq = Property(depends_on='trial_log')
@@ -79,14 +82,25 @@ class AversiveAnalysisMixin(SDTDataMixin):
     def _get_go_seq(self):
         return self.warn_seq
 
+    # Cumulative sum of contact_digital.  Scores for all trials are computed
+    # from this index in a single vectorized operation, so changing the analysis
+    # window does not require re-reading the contact data from the file.
+    contact_index = Any
+
+    def _contact_index_default(self):
+        # Channels stored as edges can compute the window means directly
+        if isinstance(self.contact_digital, FileEdgeChannel):
+            return self.contact_digital
+        return CumulativeSumIndex(self.contact_digital)
+
     @cached_property
     def _get_contact_scores(self):
         if self.contact_reference == 'trial start':
             timestamps = self.ts_start_seq
         else:
             timestamps = self.ts_end_seq
-        return self.contact_digital.summarize(timestamps, self.contact_offset,
-                self.contact_dur, np.mean)
+        return self.contact_index.window_mean(timestamps, self.contact_offset,
+                self.contact_dur)
 
     @cached_property
     def _get_on_spout_seq(self):
@@ -244,6 +244,7 @@ def prepare_experiment(args, store_node, create_child=True):
             'cal_primary':      cal1,
             'cal_secondary':    cal2,
             'address':          args.address,
+            'simulate':         args.simulate,
             }
     
     log.debug('store_node: %s', store_node)
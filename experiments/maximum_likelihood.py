@@ -5,7 +5,6 @@ def sweetpoint(a, m, k):
     Compute point of minimum variance when estimating sigmoid
     a (false alarm rate), m (midpoint of function) and k (slope)
     '''
-    print a, m, k
     return m+(k**-1)*np.log((1+(1+a*a)**0.5)/2.0)
 
 p_yes = lambda a, m, k, x: a + (1-a)*(1+np.exp(-k*(x-m)))**-1
@@ -33,6 +32,13 @@ class MaximumLikelihood(object):
             midpoints of the function
         k : array-like
             slopes of the function
+
+        Rather than storing the likelihood of each trial and multiplying across
+        the full history whenever the best estimate is requested (which grows
+        linearly with the number of trials and underflows after a few hundred
+        trials), we maintain a running log-likelihood surface over the
+        parameter grid.  Each trial requires a single addition to this surface,
+        so the cost of an update is constant regardless of session length.
         '''
         sa = len(a)
         sm = len(m)
@@ -41,10 +47,20 @@ class MaximumLikelihood(object):
         self.a = np.array(a)[:, np.newaxis, np.newaxis]
         self.m = np.array(m)[np.newaxis, :, np.newaxis]
         self.k = np.array(k)[np.newaxis, np.newaxis, :]
-        self.p_history = np.array([]).reshape((-1, sa, sm, sk))
+        self.log_likelihood = np.zeros(self.shape)
         self.t_history = []
         self.r_history = []
 
+        # The sweetpoint for each combination of coefficients never changes, so
+        # we can compute it once for the entire grid.  The sweetpoint for the
+        # current best guess is then simply a lookup.
+        self.sweetpoints = np.empty(self.shape)
+        self.sweetpoints[:] = sweetpoint(self.a, self.m, self.k)
+        self._best_index = np.unravel_index(0, self.shape)
+
+        # Scratch buffer for the likelihood of the current trial
+        self._p = np.empty(self.shape)
+
     def update_estimate(self, x, yes):
         '''
         Update the maximum likelihood estimate with a new trial
@@ -54,22 +70,32 @@ class MaximumLikelihood(object):
         yes : bool
             True if subject indicated they heard the stimulus, False otherwise
         '''
-
-        p = self.p(x, yes)
+        self._p[:] = self.p(x, yes)
+        # Guard against log(0) when the grid includes a point that predicts the
+        # response with certainty.
+        np.clip(self._p, np.finfo(self._p.dtype).tiny, 1, out=self._p)
+        np.log(self._p, out=self._p)
+        self.log_likelihood += self._p
         self.t_history.append(x)
         self.r_history.append(yes)
-        self.p_history = np.concatenate((self.p_history, p[np.newaxis]))
-        
+        self._best_index = np.unravel_index(self.log_likelihood.argmax(),
+                                            self.shape)
+
     def best_coefficients(self):
         '''
         Given current trial history, compute the ML coefficients
 
         Returns a three-tuple (a, m, k)
         '''
-        p = self.p_history.prod(axis=0)
-        ai, mi, ki = np.unravel_index(p.argmax(), self.shape)
+        ai, mi, ki = self._best_index
         return self.a[ai, 0, 0], self.m[0, mi, 0], self.k[0, 0, ki]
 
+    def best_sweetpoint(self):
+        '''
+        Sweetpoint of the current ML coefficients (see `sweetpoint`)
+        '''
+        return self.sweetpoints[self._best_index]
+
     def sweetpoint(self, a, m, k):
         '''
         Stimulus value at which the variance (i.e. error) of the threshold
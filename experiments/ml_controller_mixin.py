@@ -32,7 +32,7 @@ class MLControllerMixin(HasTraits):
     def _evaluate_track(self, track):
         current_guess = self.model.data.ml_coefficients
         ml = self.model.data.ml
-        context = { 'sweetpoint': ml.sweetpoint(*current_guess),
+        context = { 'sweetpoint': ml.best_sweetpoint(),
                     'percent_correct': partial(percent_correct, *current_guess)
                   }
         return eval(track, context, {})
@@ -1,3 +1,5 @@
+import numpy as np
+
 from traits.api import (Instance, Any, List, on_trait_change, Enum,
                                   Dict)
 
@@ -25,7 +27,7 @@ class PhysiologyController(Controller):
     physiology_ttl_pipeline = Any
     buffer_spikes           = List(Any)
     state                   = Enum('master', 'client')
-    process                 = Instance('tdt.DSPProject')
+    process                 = Any
     timer                   = Instance(Timer)
     parent                  = Any
 
@@ -96,11 +98,8 @@ class PhysiologyController(Controller):
     @on_trait_change('model.data')
     def update_data(self):
         # Ensure that the data store has the correct sampling frequency
-        for i in range(CHANNELS):
-            data_spikes = self.model.data.spikes
-            for src, dest in zip(self.buffer_spikes, data_spikes):
-                dest.fs = src.fs
-                dest.snippet_size = SPIKE_SNIPPET_SIZE
+        self.model.data.snippets.fs = self.buffer_spikes[0].fs
+        self.model.data.snippets.snippet_size = SPIKE_SNIPPET_SIZE
         self.model.data.raw.fs = self.buffer_raw.fs
         self.model.data.processed.fs = self.buffer_filt.fs
         self.model.data.ts.fs = self.iface_physiology.fs
@@ -142,11 +141,19 @@ class PhysiologyController(Controller):
         # Get the spikes.  Each channel has a separate buffer for the spikes
         # detected online.  Need to add 2 to the snippet size to compensate for
         # the extra samples provided with the snippet (the timestamp and the
-        # classifier).
+        # classifier).  The snippets from all channels are saved to the file in
+        # a single batch.
         snippet_shape = (-1, SPIKE_SNIPPET_SIZE+2)
+        blocks = []
+        channels = []
         for i in range(CHANNELS):
             data = self.buffer_spikes[i].read().reshape(snippet_shape)
+            if len(data):
+                blocks.append(data)
+                channels.append(np.ones(len(data), dtype=np.int16)*i)
 
+        if blocks:
+            data = np.concatenate(blocks)
             # First sample of each snippet is the timestamp (as a 32 bit
             # integer) and last sample is the classifier (also as a 32 bit
             # integer).  The bits in between should be interpreted as 32-bit
@@ -154,7 +161,8 @@ class PhysiologyController(Controller):
             snip = data[:,1:-1]
             ts = data[:,0].view('int32')
             cl = data[:,-1].view('int32')
-            self.model.data.spikes[i].send(snip, ts, cl)
+            self.model.data.snippets.send(np.concatenate(channels), snip, ts,
+                                          cl)
 
     @on_trait_change('model.settings.spike_signs')
     def set_spike_signs(self, value):
@@ -3,11 +3,14 @@ from tempfile import mkdtemp
 from os import path
 from cns import get_config
 from traits.api import HasTraits, Instance, List, Any
-from cns.channel import (FileMultiChannel, FileChannel, FileSnippetChannel,
-                         FileTimeseries, FileEpoch)
+from cns.channel import (FileMultiChannel, FileChannel, FileSnippetTable,
+                         SnippetRing, FileTimeseries, FileEpoch,
+                         ScaledFileMultiChannel)
 import numpy as np
 
 CHANNELS = get_config('PHYSIOLOGY_CHANNELS')
+RAW_STORAGE = get_config('PHYSIOLOGY_RAW_STORAGE')
+RAW_FULL_SCALE = get_config('PHYSIOLOGY_RAW_FULL_SCALE')
 SNIPPET_SIZE = get_config('PHYSIOLOGY_SPIKE_SNIPPET_SIZE')
 
 class PhysiologyData(HasTraits):
@@ -30,6 +33,15 @@ class PhysiologyData(HasTraits):
                            use_checksum=True)
 
     def _raw_default(self):
+        if RAW_STORAGE == 'int16':
+            gain = np.ones(CHANNELS)*RAW_FULL_SCALE/np.iinfo(np.int16).max
+            return ScaledFileMultiChannel(node=self.store_node,
+                                          channels=CHANNELS, name='raw',
+                                          dtype=np.int16, gain=gain,
+                                          offset=np.zeros(CHANNELS),
+                                          compression_type='lzo',
+                                          compression_level=1,
+                                          use_shuffle=True, use_checksum=True)
         return FileMultiChannel(node=self.store_node, channels=CHANNELS,
                                 name='raw', dtype=np.float32,
                                 compression_type='lzo', compression_level=1,
@@ -51,7 +63,10 @@ class PhysiologyData(HasTraits):
     # Where to store the temporary data
     temp_node   = Any
     processed   = Instance(FileMultiChannel)
-    spikes      = List(Instance(FileSnippetChannel))
+    snippets    = Instance(FileSnippetTable)
+
+    # Most recent snippets on each channel (for display)
+    spikes      = List(Instance(SnippetRing))
 
     def _temp_node_default(self):
         filename = path.join(mkdtemp(), 'processed_physiology.h5')
@@ -62,11 +77,9 @@ class PhysiologyData(HasTraits):
         return FileMultiChannel(node=self.temp_node, channels=CHANNELS,
                                 name='processed', dtype=np.float32)
 
+    def _snippets_default(self):
+        return FileSnippetTable(node=self.temp_node, name='snippets',
+                                channels=CHANNELS, snippet_size=SNIPPET_SIZE)
+
     def _spikes_default(self):
-        channels = []
-        for i in range(CHANNELS):
-            name = 'spike_{:02}'.format(i+1)
-            ch = FileSnippetChannel(node=self.temp_node, name=name,
-                    dtype=np.float32, snippet_size=SNIPPET_SIZE)
-            channels.append(ch)
-        return channels
+        return self.snippets.rings
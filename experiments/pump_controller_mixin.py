@@ -1,8 +1,11 @@
+import time
 from cns.widgets.toolbar import ToolBar
 from traitsui.api import View, HGroup, Item
-from traits.api import Instance, Bool, HasTraits, Tuple, Float
+from traits.api import (Instance, Bool, HasTraits, Tuple, Float, Property,
+                        Any, on_trait_change)
 from enable.savage.trait_defs.ui.svg_button import SVGButton
 from cns.widgets.icons import icons
+from .pump_worker import PumpWorker, call
 
 class PumpToolBar(ToolBar):
     '''
@@ -29,52 +32,101 @@ class PumpToolBar(ToolBar):
 class PumpControllerMixin(HasTraits):
 
     pump_toolbar        = Instance(PumpToolBar, (), toolbar=True)
-    iface_pump          = Instance('new_era.PumpInterface', ())
+    iface_pump          = Any
     pump_toggle         = Bool(False)
     pump_trigger_cache  = Tuple
     pump_volume_cache   = Float
 
+    # All communication with the pump once the experiment is running goes
+    # through this worker so that a slow response from the serial port never
+    # blocks the controller (see `PumpWorker`).  The worker is started the first
+    # time it is needed.
+    pump_worker         = Property(depends_on='_pump_worker')
+    _pump_worker        = Instance(PumpWorker)
+
+    # Time (as returned by time.time) and timestamp (as returned by get_ts) of
+    # the previous call to monitor_pump.  Used to estimate the timestamp at
+    # which the pump was polled.
+    _pump_reference     = Tuple
+
+    def _iface_pump_default(self):
+        # The controllers define `simulate` when the hardware is simulated (see
+        # cns.simulated_dsp)
+        if getattr(self, 'simulate', False):
+            from cns.simulated_dsp import SimulatedPump
+            return SimulatedPump()
+        from new_era import PumpInterface
+        return PumpInterface()
+
+    def _get_pump_worker(self):
+        if self._pump_worker is None:
+            self._pump_worker = PumpWorker(self.iface_pump)
+            self._pump_worker.start()
+        return self._pump_worker
+
+    @on_trait_change('state')
+    def _stop_pump_worker(self, new):
+        if new == 'complete' and self._pump_worker is not None:
+            self._pump_worker.stop()
+            self._pump_worker = None
+
     def monitor_pump(self):
-        infused = self.iface_pump.get_infused(unit='ml')
-        ts = self.get_ts()
-        self.model.data.log_water(ts, infused)
+        # Reads the most recent value polled by the worker (no serial I/O).
+        # Errors raised by the worker are re-raised here so they are reported
+        # to the user (see run_tasks).
+        worker = self.pump_worker
+        worker.check_error()
+        now, ts = time.time(), self.get_ts()
+        infused, infused_time = worker.infused, worker.infused_time
+
+        # Only log new readings.  The timestamp of each reading is interpolated
+        # between the timestamps obtained on this and the previous call
+        # (readings taken before the first call cannot be timestamped and are
+        # skipped).
+        if self._pump_reference:
+            last_time, last_ts = self._pump_reference
+            if infused_time is not None and infused_time > last_time:
+                fraction = min(1, (infused_time-last_time)/(now-last_time))
+                poll_ts = last_ts + int(round((ts-last_ts)*fraction))
+                self.model.data.log_water(poll_ts, infused)
+        self._pump_reference = now, ts
 
     def pump_trigger(self, info):
-        self.iface_pump.run()
+        self.pump_worker.submit(None, call('run'))
 
     def pump_override(self, info):
         if not self.pump_toggle:
-            self.pump_trigger_cache = self.iface_pump.get_trigger()
-            self.pump_volume_cache = self.iface_pump.get_volume()
-            self.iface_pump.set_volume(0)
-            self.iface_pump.set_trigger('rising', None)
-            self.iface_pump.run()
+            self.pump_trigger_cache = self.pump_worker.request('get_trigger')
+            self.pump_volume_cache = self.pump_worker.request('get_volume')
+            self.pump_worker.submit(None, call('set_volume', 0),
+                                    call('set_trigger', 'rising', None),
+                                    call('run'))
             self.pump_toggle = True
         else:
-            self.iface_pump.stop()
-            self.iface_pump.set_trigger(*self.pump_trigger_cache)
-            self.iface_pump.set_volume(self.pump_volume_cache)
+            self.pump_worker.submit(None, call('stop'),
+                                    call('set_trigger', *self.pump_trigger_cache),
+                                    call('set_volume', self.pump_volume_cache))
             self.pump_toggle = False
 
     def set_pump_volume(self, value):
-        self.iface_pump.pause()
-        self.iface_pump.set_volume(value, unit='ul')
-        self.iface_pump.resume()
+        self.pump_worker.submit('volume', call('pause'),
+                                call('set_volume', value, unit='ul'),
+                                call('resume'))
 
     def set_pump_rate(self, value):
-        self.iface_pump.pause()
-        self.iface_pump.set_rate(value, unit='ml/min')
-        self.iface_pump.resume()
+        self.pump_worker.submit('rate', call('pause'),
+                                call('set_rate', value, unit='ml/min'),
+                                call('resume'))
 
     def set_pump_syringe_diameter(self, value):
-        self.iface_pump.pause()
-        self.iface_pump.set_diameter(value, unit='mm')
-        self.iface_pump.resume()
+        self.pump_worker.submit('diameter', call('pause'),
+                                call('set_diameter', value, unit='mm'),
+                                call('resume'))
 
     def set_pump_rate_delta(self, value):
-        self.iface_pump.pause()
+        # This setting is only used by the controller, so there is no need to
+        # communicate with the pump.
         self.current_pump_rate_delta = value
-        self.iface_pump.resume()
 
 if __name__ == '__main__':
     PumpToolBar().configure_traits()
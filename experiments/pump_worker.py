@@ -0,0 +1,194 @@
+'''
+Background thread that handles all communication with the pump
+
+The pump is controlled over a serial port and each command requires a round
+trip to the pump.  A slow response would otherwise stall the controller timer
+(which is also responsible for monitoring behavior and physiology) for the
+duration of the round trip.  Instead, all serial I/O is handled by a single
+worker thread:
+
+* Commands (e.g. changing the rate or volume) are queued and executed in order
+  by the worker.  If a command is queued while an earlier command of the same
+  kind is still pending, the pending command is replaced (i.e. only the most
+  recent value is sent to the pump).
+* The volume infused is polled at a fixed interval and cached.  Controller
+  tasks read the cached value without touching the serial port.
+* The round-trip time of every call is tracked so we can monitor how
+  responsive the pump is over the course of an experiment.
+'''
+import threading
+import time
+from collections import deque
+
+import logging
+log = logging.getLogger(__name__)
+
+def call(method, *args, **kwargs):
+    '''
+    Convenience function for building a call to pass to `PumpWorker.submit`
+
+    >>> worker.submit('volume', call('pause'), call('set_volume', 10,
+    ...               unit='ul'), call('resume'))
+    '''
+    return method, args, kwargs
+
+class PumpWorker(threading.Thread):
+
+    # Maximum time (in seconds) to wait for the reply to a request
+    request_timeout = 10
+
+    def __init__(self, iface, poll_interval=0.5):
+        '''
+        iface : instance of new_era.PumpInterface
+            The pump to control.  Once the worker is started, all communication
+            with the pump must go through the worker.
+        poll_interval : float (seconds)
+            How often to query the pump for the volume infused
+        '''
+        threading.Thread.__init__(self, name='PumpWorker')
+        self.daemon = True
+        self.iface = iface
+        self.poll_interval = poll_interval
+
+        self._commands = deque()
+        self._condition = threading.Condition()
+        self._running = True
+
+        # Most recent reading of the volume infused (in ml) and the time (as
+        # returned by time.time) the reading was obtained.  Both are None until
+        # the first reading is available.
+        self.infused = None
+        self.infused_time = None
+
+        # Most recent exception raised while communicating with the pump
+        self.error = None
+
+        self.n_calls = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+    def submit(self, key, *calls):
+        '''
+        Queue a sequence of calls to be executed by the worker (in order) and
+        return immediately.
+
+        If `key` is not None and a command with the same key is still pending,
+        the pending command is replaced.  This ensures that rapid changes to a
+        single setting (e.g. the user dragging a slider) result in only one
+        round trip to the pump.
+        '''
+        with self._condition:
+            self._check_running()
+            if key is not None:
+                for i, command in enumerate(self._commands):
+                    if command[0] == key:
+                        self._commands[i] = key, calls, None
+                        return
+            self._commands.append((key, calls, None))
+            self._condition.notify()
+
+    def request(self, method, *args, **kwargs):
+        '''
+        Call the method on the pump interface and wait for the result.
+
+        This blocks until all pending commands have been executed.  It should
+        only be used for infrequent, user-initiated actions that need a value
+        from the pump.
+        '''
+        reply = [threading.Event(), None, None]
+        with self._condition:
+            self._check_running()
+            self._commands.append((None, [call(method, *args, **kwargs)],
+                                   reply))
+            self._condition.notify()
+        reply[0].wait(self.request_timeout)
+        if not reply[0].is_set():
+            raise IOError, 'No reply from pump to {}'.format(method)
+        if reply[2] is not None:
+            raise reply[2]
+        return reply[1]
+
+    def _check_running(self):
+        if not (self._running and self.is_alive()):
+            raise IOError, 'Pump worker is not running'
+
+    def check_error(self):
+        '''
+        Raise the most recent exception raised while communicating with the
+        pump (if any).  The exception is cleared so it is only raised once.
+        '''
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def stop(self, timeout=5):
+        '''
+        Execute the remaining commands and stop the worker
+        '''
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self.join(timeout)
+
+    def latency_statistics(self):
+        '''
+        Returns dictionary containing the number of calls made to the pump and
+        the mean, maximum and most recent round-trip latency (in seconds)
+        '''
+        mean = self.total_latency/self.n_calls if self.n_calls else 0.0
+        return dict(n=self.n_calls, mean=mean, max=self.max_latency,
+                    last=self.last_latency)
+
+    def run(self):
+        next_poll = time.time()
+        while True:
+            with self._condition:
+                while self._running and not self._commands:
+                    timeout = next_poll-time.time()
+                    if timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                if not self._running and not self._commands:
+                    break
+                command = self._commands.popleft() if self._commands else None
+
+            if command is not None:
+                self._execute(*command)
+            if self._running and time.time() >= next_poll:
+                self._poll()
+                next_poll = time.time() + self.poll_interval
+
+    def _call(self, method, args, kwargs):
+        start = time.time()
+        try:
+            return getattr(self.iface, method)(*args, **kwargs)
+        finally:
+            latency = time.time()-start
+            self.n_calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.last_latency = latency
+
+    def _execute(self, key, calls, reply):
+        try:
+            for method, args, kwargs in calls:
+                result = self._call(method, args, kwargs)
+            if reply is not None:
+                reply[1] = result
+        except Exception, e:
+            log.exception(e)
+            self.error = e
+            if reply is not None:
+                reply[2] = e
+        finally:
+            if reply is not None:
+                reply[0].set()
+
+    def _poll(self):
+        try:
+            infused = self._call('get_infused', (), {'unit': 'ml'})
+            self.infused, self.infused_time = infused, time.time()
+        except Exception, e:
+            log.exception(e)
+            self.error = e
@@ -1,6 +1,7 @@
 import tables
 from cns import h5
-from cns.io import update_progress
+from os import path
+from cns.io import update_progress, processed_cache_filename
 from cns.analysis import running_rms
 
 def compute_rms(ext_filename, force_overwrite=False):
@@ -28,11 +29,24 @@ def compute_rms(ext_filename, force_overwrite=False):
         processing['diff_mode'] = fh.root.filter._v_attrs.diff_mode
         #channels = fh.root.event_data._v_attrs.extracted_channels[:]-1
 
+        # Use the processed cache if available (it will be ignored if it was
+        # generated using different processing settings).
+        cache_filename = processed_cache_filename(raw_filename)
+        fh_cache = None
+        processed_cache = None
+        if path.exists(cache_filename):
+            fh_cache = tables.openFile(cache_filename, 'r')
+            processed_cache = fh_cache.root.processed
+
         with tables.openFile(raw_filename, 'r') as fh_raw:
             input_node = h5.p_get_node(fh_raw.root, '*')
             output_node = fh.createGroup('/', 'rms')
             running_rms(input_node, output_node, 1, 0.25, processing=processing,
-                        algorithm='median', progress_callback=update_progress)
+                        algorithm='median', progress_callback=update_progress,
+                        processed_cache=processed_cache)
+
+        if fh_cache is not None:
+            fh_cache.close()
 
 if __name__ == '__main__':
     import argparse
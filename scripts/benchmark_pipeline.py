@@ -0,0 +1,47 @@
+'''
+Report the time each cns.pipeline stage needs to process a single block
+
+Data is downloaded from the DSP roughly every 100 msec.  Each stage should
+consume only a small fraction of this budget.  The block sizes are those we
+typically see at the sampling rates of the physiology (16 channels at ~25 kHz)
+and behavior (TTLs at ~500 Hz) circuits.
+'''
+
+import timeit
+import numpy as np
+
+from cns import pipeline
+
+PHYSIOLOGY_BLOCK = 16, 2500
+TTL_BLOCK = 50
+
+def per_block_cost(stage, block, number=100):
+    '''
+    Returns the best-case time (in seconds) required to send a single block
+    through the stage.
+    '''
+    timer = timeit.Timer(lambda: stage.send(block))
+    return min(timer.repeat(3, number))/number
+
+def benchmark():
+    from scipy import signal
+    results = []
+
+    b, a = signal.butter(4, (0.01, 0.5), btype='band')
+    stage = pipeline.lfilter(b, a, pipeline.broadcast([]))
+    block = np.random.uniform(size=PHYSIOLOGY_BLOCK)
+    results.append(('lfilter', per_block_cost(stage, block)))
+
+    stage = pipeline.moving_average(25, None, 0, pipeline.broadcast([]))
+    block = np.random.uniform(size=PHYSIOLOGY_BLOCK).T
+    results.append(('moving_average', per_block_cost(stage, block)))
+
+    targets = [pipeline.broadcast([]) for i in range(6)]
+    stage = pipeline.deinterleave_bits(targets)
+    block = np.random.randint(0, 64, size=TTL_BLOCK).astype('int8')
+    results.append(('deinterleave_bits', per_block_cost(stage, block)))
+    return results
+
+if __name__ == '__main__':
+    for name, cost in benchmark():
+        print '{:20s} {:8.3f} ms'.format(name, cost*1e3)
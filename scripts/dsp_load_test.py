@@ -0,0 +1,164 @@
+'''
+Measure whether the physiology controller keeps up with the data acquired
+
+Runs the acquisition loop of experiments.physiology_controller (the same
+buffers and the same `monitor_physiology` method used during an experiment,
+including saving the data to a HDF5 file) against the simulated hardware in
+cns.simulated_dsp.  The data is either Gaussian noise or replayed from the raw
+physiology saved in a previous experiment.
+
+The controller normally downloads the data every 100 msec.  At the end of the
+run, the time spent on each download (the fraction of the 100 msec budget
+used), the throughput and the number of samples dropped by each buffer is
+reported.
+
+    python scripts/dsp_load_test.py --channels 32 --duration 30
+    python scripts/dsp_load_test.py --replay experiment_raw.h5
+'''
+
+from __future__ import division
+
+import time
+from os import path
+from tempfile import mkdtemp
+
+import numpy as np
+import tables
+
+from cns import get_config, set_config
+
+def load_test(channels=None, duration=10.0, interval=0.1, replay=None,
+              transfer_rate=None, spike_rate=20.0):
+    '''
+    Run the physiology acquisition loop against the simulated hardware and
+    return a dictionary summarizing the result
+
+    Parameters
+    ----------
+    channels : int
+        Number of channels to acquire.  Defaults to PHYSIOLOGY_CHANNELS.
+    duration : float
+        Duration of the test (in seconds)
+    interval : float
+        How often (in seconds) the data is downloaded from the hardware
+    replay : str
+        Replay the raw physiology stored in this file rather than generating
+        Gaussian noise
+    transfer_rate : float
+        Emulate the cost of downloading the data from the hardware (in bytes
+        per second).  See `SimulatedDSPProject`.
+    spike_rate : float
+        Mean rate (per channel) of spikes detected online
+    '''
+    # The physiology modules read the number of channels when they are first
+    # imported, so the setting must be updated before they are imported.
+    if channels is not None:
+        set_config('PHYSIOLOGY_CHANNELS', channels)
+    channels = get_config('PHYSIOLOGY_CHANNELS')
+
+    from traits.api import HasTraits, Any
+    from cns import h5
+    from cns.simulated_dsp import (SimulatedDSPProject, ReplaySource,
+                                   SnippetSource)
+    from experiments.physiology_controller import PhysiologyController
+    from experiments.physiology_data import PhysiologyData
+
+    class LoadTestExperiment(HasTraits):
+        data = Any
+
+    sources = dict(('spike{}'.format(i+1), SnippetSource(spike_rate)) \
+                   for i in range(channels))
+    fh_replay = None
+    if replay is not None:
+        fh_replay = tables.openFile(replay, 'r')
+        node = h5.p_get_node(fh_replay, '*/data/physiology/raw')
+        # Raw data stored as int16 must be scaled back to volts (see
+        # cns.channel.ScaledFileMultiChannel)
+        gain = getattr(node._v_attrs, 'gain', 1)
+        if np.ndim(gain):
+            gain = np.asarray(gain)[:, np.newaxis]
+        sources['craw'] = ReplaySource(node, gain)
+        sources['cfilt'] = ReplaySource(node, gain)
+
+    project = SimulatedDSPProject(sources=sources,
+                                  transfer_rate=transfer_rate)
+    controller = PhysiologyController(process=project)
+    controller.setup_physiology()
+
+    filename = path.join(mkdtemp(), 'dsp_load_test.h5')
+    ticks = []
+    with tables.openFile(filename, 'w') as fh:
+        data = PhysiologyData(store_node=fh.root)
+        controller.model = LoadTestExperiment(data=data)
+        project.start()
+        t_start = time.time()
+        while time.time()-t_start < duration:
+            t_tick = time.time()
+            controller.monitor_physiology()
+            ticks.append(time.time()-t_tick)
+            time.sleep(max(0, interval-ticks[-1]))
+        elapsed = time.time()-t_start
+        project.stop()
+        samples = data.raw.get_size()
+        data.temp_node._v_file.close()
+
+    if fh_replay is not None:
+        fh_replay.close()
+
+    ticks = np.array(ticks)
+    return {
+        'channels': channels,
+        'elapsed': elapsed,
+        'interval': interval,
+        'ticks': len(ticks),
+        'mean_tick': ticks.mean(),
+        'max_tick': ticks.max(),
+        'over_budget': (ticks > interval).mean(),
+        'samples_saved': samples,
+        'samples_expected': int(elapsed*controller.buffer_raw.fs),
+        'buffers': project.statistics(),
+        }
+
+def format_report(report):
+    lines = ['{channels} channels for {elapsed:.1f} s'.format(**report)]
+    lines.append('  download: mean {:.1f} ms, max {:.1f} ms, {:.0%} of {} ' \
+                 'downloads over the {:.0f} ms budget' \
+                 .format(report['mean_tick']*1e3, report['max_tick']*1e3,
+                         report['over_budget'], report['ticks'],
+                         report['interval']*1e3))
+    lines.append('  raw samples saved: {samples_saved} of ~{samples_expected}' \
+                 .format(**report))
+    for stats in report['buffers']:
+        if stats['name'].startswith('spike'):
+            continue
+        lines.append('  {name}: {samples} samples, {dropped} dropped, ' \
+                     'latency mean {:.1f} ms, max {:.1f} ms' \
+                     .format(stats['mean_latency']*1e3,
+                             stats['max_latency']*1e3, **stats))
+    spikes = [s for s in report['buffers'] if s['name'].startswith('spike')]
+    if spikes:
+        dropped = sum(s['dropped'] for s in spikes)
+        lines.append('  spike buffers: {} samples dropped'.format(dropped))
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Physiology load test')
+    parser.add_argument('--channels', type=int, default=None,
+                        help='Number of channels (default PHYSIOLOGY_CHANNELS)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Duration of test (sec)')
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='Download interval (sec)')
+    parser.add_argument('--replay', help='Replay raw physiology from file')
+    parser.add_argument('--transfer-rate', type=float, default=None,
+                        help='Emulated download rate (MB/s)')
+    parser.add_argument('--spike-rate', type=float, default=20.0,
+                        help='Mean spike rate per channel (spikes/sec)')
+    args = parser.parse_args()
+
+    transfer_rate = None if args.transfer_rate is None \
+            else args.transfer_rate*1e6
+    report = load_test(args.channels, args.duration, args.interval,
+                       args.replay, transfer_rate, args.spike_rate)
+    print format_report(report)
@@ -7,11 +7,16 @@ from cns import io
 from cns import analysis
 from cns import h5
 
-def extract_spikes(raw_filename, template=None, force_overwrite=False):
+def extract_spikes(raw_filename, template=None, force_overwrite=False,
+                   use_cache=False):
     '''
     Extract spikes from raw data based on information stored in the channel
     metadata table.  Use the review physiology GUI to configure and save the
     settings for spike extraction.
+
+    If use_cache is True, the referenced and filtered data is read from the
+    processed cache saved alongside the raw file (the cache is created, or
+    regenerated if the processing settings have changed, as needed).
     '''
     ext_filename = raw_filename.replace('raw', 'extracted')
 
@@ -46,9 +51,21 @@ def extract_spikes(raw_filename, template=None, force_overwrite=False):
     kwargs['input_node'] = h5.p_get_node(fh_in, '*') 
     kwargs['output_node'] = fh_out.root
     kwargs['progress_callback'] = io.update_progress
+
+    fh_cache = None
+    if use_cache:
+        cache_filename = io.processed_cache_filename(raw_filename)
+        analysis.update_processed_cache(kwargs['input_node'], cache_filename,
+                                        kwargs['processing'],
+                                        progress_callback=io.update_progress)
+        fh_cache = tables.openFile(cache_filename, 'r')
+        kwargs['processed_cache'] = fh_cache.root.processed
+
     analysis.extract_spikes(**kwargs)
     fh_in.close()
     fh_out.close()
+    if fh_cache is not None:
+        fh_cache.close()
 
     return ext_filename
 
@@ -61,6 +78,8 @@ if __name__ == '__main__':
                         help='Overwrite existing file')
     parser.add_argument('--add-rms', action='store_true', help='Add RMS to file')
     parser.add_argument('--template', help='Use settings defined in this file')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='Create and use cache of processed data')
     parser.add_argument('--skip-missing', action='store_true',
                         help='Skip file if channel metadata missing')
 
@@ -69,7 +88,8 @@ if __name__ == '__main__':
         try:
             ext_filename = extract_spikes(raw_filename, 
                                           template=args.template,
-                                          force_overwrite=args.force_overwrite)
+                                          force_overwrite=args.force_overwrite,
+                                          use_cache=args.use_cache)
             if args.add_rms:
                 compute_rms(ext_filename)
         except:
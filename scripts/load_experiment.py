@@ -109,6 +109,10 @@ tested.  Use at your own risk.'''
 SERVER_HELP = '''TDT RPC server address (in the format hostname:port).  For
 example, localhost:3333 or regina.cns.nyu.edu:3333.'''
 
+SIMULATE_HELP = '''Run the experiment using simulated hardware (see
+cns.simulated_dsp) rather than the TDT hardware.  Useful for testing on
+computers that are not connected to the hardware.'''
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Launch experiment")
 
@@ -145,6 +149,8 @@ if __name__ == '__main__':
                         action='store_true', help='Acquire neurophysiology',
                         default=False)
     parser.add_argument('--address', help=SERVER_HELP, action=VerifyServer)
+    parser.add_argument('--simulate', action='store_true', default=False,
+                        help=SIMULATE_HELP)
 
     #parser.add_argument('--paradigm', help='Paradigm settings file to load')
     #parser.add_argument('--physiology', help='Physiology settings file to load')
@@ -0,0 +1,91 @@
+'''
+Report how long it takes to import a module and which modules it pulls in
+
+Heavy optional dependencies (e.g. scipy.signal, pandas, mne and the TDT
+drivers) are imported inside the functions that need them so that headless
+workers (e.g. scripts/extract_spikes.py running on a cluster node) start
+quickly.  This script is a quick check that a module has not (accidentally)
+started importing one of these at the top level again.
+
+The time reported for each module is inclusive (i.e. it includes the time
+spent importing the modules it depends on).  Run it in a fresh interpreter
+since modules that have already been imported are not reloaded.
+
+    python scripts/profile_startup.py cns.analysis scripts.extract_spikes
+'''
+
+from __future__ import division
+
+import sys
+import time
+import __builtin__
+
+# Modules that are slow to import and not needed by every entry point
+HEAVY_MODULES = ('traits', 'traitsui', 'pyface', 'enable', 'chaco',
+                 'scipy.signal', 'scipy.stats', 'pandas', 'mne', 'pylab',
+                 'matplotlib', 'tdt')
+
+class ImportProfiler(object):
+    '''
+    Wraps the builtin __import__ and records the time spent on the first
+    import of each module
+    '''
+
+    def __init__(self):
+        self.times = {}
+        self._import = None
+
+    def __enter__(self):
+        self._import = __builtin__.__import__
+        __builtin__.__import__ = self._profiled_import
+        return self
+
+    def __exit__(self, *args):
+        __builtin__.__import__ = self._import
+
+    def _profiled_import(self, name, *args, **kwargs):
+        t_start = time.time()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            if name not in self.times:
+                self.times[name] = time.time()-t_start
+
+def profile_startup(modules):
+    '''
+    Import the modules and return the total time (in seconds), the inclusive
+    time for each module and the list of heavy modules that were loaded
+    '''
+    t_start = time.time()
+    with ImportProfiler() as profiler:
+        for module in modules:
+            __import__(module)
+    total = time.time()-t_start
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    return total, profiler.times, loaded
+
+def format_report(modules, total, times, loaded, top=20):
+    lines = ['Imported {} in {:.3f} s'.format(', '.join(modules), total)]
+    lines.append('')
+    lines.append('Slowest imports (inclusive)')
+    ranked = sorted(times.items(), key=lambda x: x[1], reverse=True)
+    for name, elapsed in ranked[:top]:
+        lines.append('  {:8.3f} s  {}'.format(elapsed, name))
+    lines.append('')
+    if loaded:
+        lines.append('Heavy modules loaded: {}'.format(', '.join(loaded)))
+    else:
+        lines.append('No heavy modules loaded')
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Profile module startup')
+    parser.add_argument('modules', nargs='*', default=['cns.analysis'],
+                        help='Modules to import')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of imports to list')
+    args = parser.parse_args()
+
+    total, times, loaded = profile_startup(args.modules)
+    print format_report(args.modules, total, times, loaded, args.top)
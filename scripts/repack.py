@@ -0,0 +1,273 @@
+'''
+Rewrite HDF5 files with a new chunk layout and compression filter
+
+Removing nodes, truncating or zeroing waveforms (see cns.analysis) leaves dead
+space in the file that HDF5 does not reclaim.  Rather than shelling out to
+ptrepack or h5repack, this copies each node into a new file using PyTables.
+
+The chunkshape of the multichannel arrays (e.g. the raw physiology) is chosen
+to match the way cns.arraytools.chunk_iter reads the data: all channels are
+read at once and the array is traversed along the time (last) axis.  Each HDF5
+chunk therefore spans all channels and a contiguous block of samples.  All
+other nodes keep their original chunkshape.
+
+Soft and external links are copied as links.  The new file is checked against
+the original before the original is optionally replaced: both files must
+contain the same set of nodes and the data in each leaf must match (via MD5
+checksums).
+
+Supports processing a list of filenames in parallel (hint, use a shell such as
+bash that supports wildcard expansion).
+'''
+
+from __future__ import division
+
+import os
+import re
+import time
+import hashlib
+from os import path
+
+import numpy as np
+import tables
+
+from cns.arraytools import chunk_samples, chunk_iter
+
+import logging
+log = logging.getLogger(__name__)
+
+# Approximate size (in bytes) of each HDF5 chunk for the multichannel arrays
+CHUNK_BYTES = 256*1024
+
+# Size (in bytes) of the blocks read when computing checksums
+BLOCK_BYTES = 50e6
+
+def repack_filename(filename):
+    return re.sub(r'(.*)\.(h5|hd5|hdf5)$', r'\1_repack.\2', filename)
+
+def _is_multichannel(leaf):
+    # Multichannel arrays are extended along the last (time) axis
+    return isinstance(leaf, tables.EArray) and len(leaf.shape) > 1 and \
+            leaf.maindim == len(leaf.shape)-1
+
+def _chunkshape(leaf, chunk_bytes):
+    '''
+    Chunk that spans all channels and a contiguous block of samples
+    '''
+    other = int(np.prod(leaf.shape[:-1]))
+    samples = max(1, int(chunk_bytes//(other*leaf.atom.itemsize)))
+    return tuple(leaf.shape[:-1]) + (samples,)
+
+def _update(h, data):
+    if isinstance(data, np.ndarray):
+        h.update(np.ascontiguousarray(data).tostring())
+    else:
+        h.update(repr(data))
+
+def _checksum(leaf, block_bytes=BLOCK_BYTES):
+    '''
+    MD5 checksum of the data stored in the leaf.  The data is read in blocks
+    along the main dimension so that large arrays do not have to fit in
+    memory.  Leaves with variable-length rows (e.g. VLArray) do not have a
+    fixed row size and are read one row at a time.
+    '''
+    h = hashlib.md5()
+    if leaf.shape == ():
+        h.update(repr(leaf.read()))
+        return h.hexdigest()
+    rowsize = getattr(leaf, 'rowsize', None)
+    if rowsize is None:
+        for row in leaf.iterrows():
+            _update(h, row)
+        return h.hexdigest()
+    n = leaf.shape[leaf.maindim]
+    step = max(1, int(block_bytes//max(1, rowsize)))
+    for start in range(0, n, step):
+        _update(h, leaf.read(start, min(n, start+step)))
+    return h.hexdigest()
+
+def _pathnames(fh):
+    return set(node._v_pathname for node in fh.walkNodes('/'))
+
+def _read_throughput(leaf, max_bytes=500e6):
+    '''
+    Read (up to max_bytes of) the array the same way the analysis routines do
+    and return the throughput in MB/s.  Note that recently read files may be
+    served from the operating system cache.
+    '''
+    c_samples = chunk_samples(leaf, 50e6)
+    n_bytes = 0
+    t_start = time.time()
+    for chunk in chunk_iter(leaf, c_samples):
+        n_bytes += chunk.nbytes
+        if n_bytes >= max_bytes:
+            break
+    return n_bytes/(time.time()-t_start)/1e6
+
+def repack(filename, output_filename=None, complib='lzo', complevel=1,
+           shuffle=True, chunk_bytes=CHUNK_BYTES, verify=True,
+           benchmark=False, replace=False):
+    '''
+    Copy all nodes in filename to a new file using the requested compression
+    filter and return a dictionary summarizing the result.
+
+    Parameters
+    ----------
+    filename : str
+        File to repack
+    output_filename : str
+        Name of the repacked file.  Defaults to the original filename with
+        _repack appended.
+    complib : {'lzo', 'zlib', 'blosc'}
+        Compression library.  Set complevel to 0 to disable compression.
+    complevel : int
+        Between 0 and 9, with 0=uncompressed and 9=maximum
+    shuffle : bool
+        Apply the shuffle filter before compressing
+    chunk_bytes : int
+        Approximate size of each chunk for the multichannel arrays
+    verify : bool
+        Check that the new file contains the same nodes as the original and
+        compare the checksum of each leaf against the original
+    benchmark : bool
+        Measure the read throughput of the multichannel arrays in both files
+    replace : bool
+        Replace the original file with the repacked file.  The original is
+        replaced only if all nodes were verified.
+    '''
+    if output_filename is None:
+        output_filename = repack_filename(filename)
+    if replace and not verify:
+        raise ValueError, 'Repacked file must be verified to replace original'
+
+    report = {'filename': filename, 'output_filename': output_filename}
+    t_start = time.time()
+    with tables.openFile(filename, 'r') as fh_in:
+        with tables.openFile(output_filename, 'w') as fh_out:
+            fh_in.root._v_attrs._f_copy(fh_out.root)
+
+            # Groups are returned in top-down order, so the parent of each group
+            # will already exist in the new file.
+            for group in fh_in.walkGroups('/'):
+                if group is fh_in.root:
+                    continue
+                parent = fh_out.getNode(group._v_parent._v_pathname)
+                group._f_copy(parent, recursive=False)
+
+            mismatched = []
+            tuned = []
+            for leaf in fh_in.walkNodes('/'):
+                if isinstance(leaf, tables.Group):
+                    continue
+                parent = fh_out.getNode(leaf._v_parent._v_pathname)
+                if isinstance(leaf, tables.link.Link):
+                    # Copies the link itself rather than the node it points to
+                    leaf._f_copy(parent)
+                    continue
+                if isinstance(leaf, tables.UnImplemented):
+                    log.warn('Skipping unsupported node %s', leaf._v_pathname)
+                    continue
+                kwargs = {}
+                if leaf.chunkshape is not None:
+                    kwargs['filters'] = tables.Filters(complevel=complevel,
+                            complib=complib, shuffle=shuffle,
+                            fletcher32=leaf.filters.fletcher32)
+                    if _is_multichannel(leaf) and leaf.nrows:
+                        kwargs['chunkshape'] = _chunkshape(leaf, chunk_bytes)
+                        tuned.append(leaf._v_pathname)
+                new_leaf = leaf._f_copy(parent, **kwargs)
+                if verify and _checksum(leaf) != _checksum(new_leaf):
+                    mismatched.append(leaf._v_pathname)
+
+            if benchmark:
+                throughput = []
+                for pathname in tuned:
+                    before = _read_throughput(fh_in.getNode(pathname))
+                    after = _read_throughput(fh_out.getNode(pathname))
+                    throughput.append((pathname, before, after))
+                report['throughput'] = throughput
+
+        # Nodes that could not be copied (e.g. unsupported nodes) are lost in
+        # the new file.  Links copied into a file open for writing are not
+        # listed until it is reopened, so the new file is checked once closed.
+        missing = []
+        if verify:
+            with tables.openFile(output_filename, 'r') as fh_out:
+                missing = sorted(_pathnames(fh_in)-_pathnames(fh_out))
+
+    report['elapsed'] = time.time()-t_start
+    report['size_before'] = path.getsize(filename)
+    report['size_after'] = path.getsize(output_filename)
+    report['verified'] = verify and not mismatched and not missing
+    report['mismatched'] = mismatched
+    report['missing'] = missing
+    report['replaced'] = False
+
+    if replace and report['verified']:
+        os.remove(filename)
+        os.rename(output_filename, filename)
+        report['output_filename'] = filename
+        report['replaced'] = True
+    return report
+
+def format_report(report):
+    lines = ['{filename} -> {output_filename}'.format(**report)]
+    mb_before = report['size_before']/1e6
+    mb_after = report['size_after']/1e6
+    lines.append('  size: {:.1f} MB -> {:.1f} MB ({:.0%}) in {:.1f} s' \
+                 .format(mb_before, mb_after, mb_after/mb_before,
+                         report['elapsed']))
+    for pathname in report['missing']:
+        lines.append('  MISSING: {}'.format(pathname))
+    for pathname in report['mismatched']:
+        lines.append('  CHECKSUM MISMATCH: {}'.format(pathname))
+    if report['verified']:
+        lines.append('  all nodes verified')
+    for pathname, before, after in report.get('throughput', []):
+        lines.append('  read {}: {:.1f} MB/s -> {:.1f} MB/s' \
+                     .format(pathname, before, after))
+    if report['replaced']:
+        lines.append('  original replaced')
+    return '\n'.join(lines)
+
+def _repack_job(args):
+    filename, kwargs = args
+    try:
+        return format_report(repack(filename, **kwargs))
+    except Exception, e:
+        return '{}: {}'.format(filename, e)
+
+if __name__ == '__main__':
+    import argparse
+    from multiprocessing import Pool
+
+    parser = argparse.ArgumentParser(description='Repack HDF5 files')
+    parser.add_argument('files',  nargs='+', help='Files to repack')
+    parser.add_argument('--complib', default='lzo',
+                        choices=('lzo', 'zlib', 'blosc'))
+    parser.add_argument('--complevel', type=int, default=1)
+    parser.add_argument('--no-shuffle', action='store_true',
+                        help='Do not apply the shuffle filter')
+    parser.add_argument('--chunk-kb', type=float, default=CHUNK_BYTES/1024,
+                        help='Chunk size (in KB) of multichannel arrays')
+    parser.add_argument('--no-verify', action='store_true',
+                        help='Do not verify checksums of the repacked data')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Report read throughput before and after')
+    parser.add_argument('--replace', action='store_true',
+                        help='Replace original file once verified')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of files to process in parallel')
+    args = parser.parse_args()
+
+    kwargs = dict(complib=args.complib, complevel=args.complevel,
+                  shuffle=not args.no_shuffle,
+                  chunk_bytes=int(args.chunk_kb*1024),
+                  verify=not args.no_verify, benchmark=args.benchmark,
+                  replace=args.replace)
+    jobs = [(filename, kwargs) for filename in args.files]
+    pool = Pool(args.processes)
+    for result in pool.imap_unordered(_repack_job, jobs):
+        print result
+    pool.close()
+    pool.join()
@@ -8,6 +8,10 @@ def rethreshold_extracted(ext_filename):
     the artifact threshold (in the raw physiology file), then you can simply
     recompute the artifact metadata, otherwise, you'll need to run the full
     extraction process.
+
+    Files extracted with the peak amplitude of each event (the
+    event_data/peak_amplitudes array) are rethresholded without reading the
+    waveforms.
     '''
     with tables.openFile(ext_filename, 'a') as fh:
         raw_filename = ext_filename.replace('extracted', 'raw')
@@ -17,11 +21,17 @@ def rethreshold_extracted(ext_filename):
         rms = fh.root.event_data._v_attrs.noise_std
         rej_thresholds_std = md['artifact_std'][channels]
         rej_thresholds = rms * rej_thresholds_std
-        rej_thresholds = rej_thresholds[..., np.newaxis]
-        fh_waveforms = fh.root.event_data.waveforms
-        exp = tables.Expr("(fh_waveforms >= rej_thresholds) |" 
-                          "(fh_waveforms < -rej_thresholds)")
-        artifacts = np.any(exp.eval(), axis=-1)
+        if 'peak_amplitudes' in fh.root.event_data:
+            peak_amplitudes = fh.root.event_data.peak_amplitudes[:]
+            artifacts = peak_amplitudes >= rej_thresholds
+        else:
+            # Reshape (without modifying rej_thresholds, which is saved to the
+            # file below) for broadcasting against the waveforms
+            rej_waveforms = rej_thresholds[..., np.newaxis]
+            fh_waveforms = fh.root.event_data.waveforms
+            exp = tables.Expr("(fh_waveforms >= rej_waveforms) |" 
+                              "(fh_waveforms < -rej_waveforms)")
+            artifacts = np.any(exp.eval(), axis=-1)
 
         # We can represent up to 256 values with an 8 bit integer.  That's overkill
         # for a boolean datatype; however Matlab doesn't support pure boolean
@@ -35,6 +45,7 @@ def rethreshold_extracted(ext_filename):
 
         fh.root.event_data._v_attrs['reject_threshold'] = rej_thresholds
         fh.root.event_data._v_attrs['reject_threshold_std'] = rej_thresholds_std
+        fh.root.event_data._v_attrs['artifact_counts'] = artifacts.sum(axis=0)
         node[:] = artifacts
 
 if __name__ == '__main__':
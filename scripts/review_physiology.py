@@ -26,9 +26,11 @@ from traitsui.menu import MenuBar, Menu, ActionGroup, Action
 from traitsui.api import TabularEditor
 from traitsui.tabular_adapter import TabularAdapter
 
-from cns import get_config
+from cns import get_config, set_config
 from cns.channel import ProcessedFileMultiChannel, FileChannel, \
-        FileMultiChannel, FileEpoch, FileTimeseries
+        FileMultiChannel, FileEpoch, FileTimeseries, ttl_channel_from_node, \
+        ScaledFileMultiChannel, ChannelMask
+from cns.io import processed_cache_filename
 
 from cns.chaco_exts.helpers import add_default_grids, add_time_axis
 from cns.chaco_exts.channel_data_range import ChannelDataRange
@@ -43,7 +45,14 @@ from cns.chaco_exts.threshold_overlay import ThresholdOverlay
 from cns.chaco_exts.extracted_spike_overlay import ExtractedSpikeOverlay
 
 from cns.analysis import (extract_spikes, median_std, decimate_waveform,
-    truncate_waveform, zero_waveform, running_rms)
+    truncate_waveform, zero_waveform, running_rms, update_processed_cache,
+    apply_mask)
+
+# The progress dialogs run the Qt event loop, so plots read the file while the
+# data is being processed.  These reads do not hold hdf5_lock, so the chunks
+# must not be read ahead in a background thread (see
+# cns.arraytools.prefetch_iter).
+set_config('PREFETCH_BYTES', 0)
 
 COLORS = get_config('EXPERIMENT_COLORS')
 RAW_WILDCARD = get_config('PHYSIOLOGY_RAW_WILDCARD')
@@ -341,11 +350,13 @@ class PhysiologyReviewController(Controller):
         if info.object.data_node and info.object.data_file.isopen:
             info.object.data_file.close()
 
-        # Save the information back to the object
+        # Save the information back to the object.  The filename must be set
+        # before the node since the processed cache is located using the
+        # filename when the node changes.
         info.object.data_file = fh
-        info.object.data_node = fh.root
         info.object.data_filename = dialog.path
         info.object.data_pathname = nodepath
+        info.object.data_node = fh.root
         self._update_title(info)
         self.load_settings(info)
 
@@ -495,43 +506,48 @@ class PhysiologyReviewController(Controller):
         info.object.std_lb = lb
         info.object.std_ub = ub
 
-    def truncate_waveform(self, info):
-        result = confirm(info.ui.control, "This action will permanently alter"
-                         "the data in the file and cannot be undone.  Are "
-                         "you sure you wish to continue?", 
-                         title="Truncate waveform")
-        if result != YES:
-            return
+    def _update_mask(self, info):
+        # Load a new instance of the mask so the channel is notified that the
+        # data has changed.
+        raw = info.object.data_node.data.physiology.raw
+        info.object.channel.mask = ChannelMask.from_array(raw)
 
-        result = confirm(info.ui.control, "Are you really sure?",
-                         title="Truncate waveform")
-        if result != YES:
-            return
+    def truncate_waveform(self, info):
+        # The raw data is not modified.  Instead, the trimmed portion is masked
+        # when the data are read (see apply_masks).
+        truncate_waveform(info.object.data_node, info.object.index_range.high,
+                          virtual=True)
+        self._update_mask(info)
 
-        # Truncate the waveform
-        truncate_waveform(info.object.data_node, info.object.index_range.high)
+    def zero_waveform(self, info):
+        zero_waveform(info.object.data_node, info.object.index_range.low,
+                      virtual=True)
+        self._update_mask(info)
 
-        information(info.ui.control, "Truncated waveform.  Be sure to run "
-                    "ptrepack or h5repack to regain the unused disk space.")
+    def clear_masks(self, info):
+        mask = info.object.channel.mask
+        if mask is not None:
+            mask.clear()
+        self._update_mask(info)
 
-    def zero_waveform(self, info):
+    def apply_masks(self, info):
         result = confirm(info.ui.control, "This action will permanently alter"
                          "the data in the file and cannot be undone.  Are "
                          "you sure you wish to continue?", 
-                         title="Zero waveform")
+                         title="Apply masks")
         if result != YES:
             return
 
-        result = confirm(info.ui.control, "Are you really sure?", 
-                         title="Zero waveform")
+        result = confirm(info.ui.control, "Are you really sure?",
+                         title="Apply masks")
         if result != YES:
             return
 
-        # Zero the waveform
-        zero_waveform(info.object.data_node, info.object.index_range.low)
+        apply_mask(info.object.data_node)
+        self._update_mask(info)
 
-        information(info.ui.control, "Zeroed waveform.  Be sure to run "
-                    "ptrepack or h5repack to recompress the file.")
+        information(info.ui.control, "Applied masks.  Be sure to run "
+                    "scripts/repack.py to recompress the file.")
 
     def _prepare_processing_settings(self, info):
         # Compile our referencing and filtering instructions
@@ -602,7 +618,41 @@ class PhysiologyReviewController(Controller):
                 return not cont
 
             running_rms(input_node, output_node, 1, 1, processing=processing,
-                        progress_callback=callback, algorithm='median')
+                        progress_callback=callback, algorithm='median',
+                        processed_cache=self._processed_cache_node(info))
+
+    def _processed_cache_node(self, info):
+        cache = info.object.channel.processed_cache
+        if cache is not None:
+            return cache._buffer
+
+    def cache_processed(self, info):
+        # The cache is saved alongside the raw data file.  If a cache generated
+        # using the current processing settings already exists, nothing needs
+        # to be done.
+        filename = processed_cache_filename(info.object.data_filename)
+        processing = self._prepare_processing_settings(info)
+        info.object.close_processed_cache()
+
+        dialog = ProgressDialog(title='Caching processed data', 
+                                min=0,
+                                can_cancel=True,
+                                max=int(info.object.channel.shape[-1]),
+                                message='Initializing ...')
+        dialog.open()
+
+        def callback(samples, max_samples, mesg):
+            if samples == max_samples:
+                dialog.close()
+            dialog.change_message(mesg)
+            cont, skip = dialog.update(samples)
+            return not cont
+
+        try:
+            update_processed_cache(info.object.data_node, filename, processing,
+                                   progress_callback=callback)
+        finally:
+            info.object.load_processed_cache()
 
 
     def extract_spikes(self, info):
@@ -641,6 +691,7 @@ class PhysiologyReviewController(Controller):
                 return not cont
             
             # Run the extraction script
+            kwargs['processed_cache'] = self._processed_cache_node(info)
             extract_spikes(progress_callback=callback, **kwargs)
 
     def overlay_extracted_spikes(self, info):
@@ -780,6 +831,9 @@ class PhysiologyReviewController(Controller):
             'output_file':  outputfile,
             'output_path':  '/',
             }
+        cache_filename = processed_cache_filename(info.object.data_filename)
+        if path.exists(cache_filename):
+            file_info['processed_cache'] = cache_filename
         self._append_batchfile('extract_spikes', file_info, kwargs, info)
 
     def queue_decimation(self, info):
@@ -887,6 +941,8 @@ class PhysiologyReview(HasTraits):
     data_file           = Any(transient=True)
     # Actual PyTables node of the experiments file
     data_node           = Any(transient=True)
+    # File containing the processed cache (see cns.analysis.cache_processed)
+    processed_file      = Any(transient=True)
 
     batchfile           = File(transient=True)
     channel             = Instance('cns.channel.ProcessedMultiChannel', (),
@@ -953,9 +1009,28 @@ class PhysiologyReview(HasTraits):
             self.visible_channels = [setting.index]
             self.channel_dclick_toggle = True
 
+    def close_processed_cache(self):
+        self.channel.processed_cache = None
+        if self.processed_file is not None and self.processed_file.isopen:
+            self.processed_file.close()
+        self.processed_file = None
+
+    def load_processed_cache(self):
+        # The cache is used for browsing only while the referencing and
+        # filtering settings match those used to generate it.
+        self.close_processed_cache()
+        filename = processed_cache_filename(self.data_filename)
+        if path.exists(filename):
+            self.processed_file = tables.openFile(filename, 'r')
+            if 'processed' in self.processed_file.root:
+                node = self.processed_file.root.processed
+                cache = ScaledFileMultiChannel.from_node(node)
+                self.channel.processed_cache = cache
+
     def _data_node_changed(self, node):
         raw = node.data.physiology.raw
         self.channel = ProcessedFileMultiChannel.from_node(raw) 
+        self.load_processed_cache()
 
         # If this is not a modified trial log, let's back it up (call it
         # "original_trial_log", add a "valid" column and save it back as the
@@ -1030,7 +1105,7 @@ class PhysiologyReview(HasTraits):
                 node = self.data_node.data.contact._f_getChild(name)
                 if name.endswith('_TTL'):
                     plot_class = TTLPlot
-                    source = FileChannel.from_node(node)
+                    source = ttl_channel_from_node(node)
                 elif name.endswith('_ts'):
                     plot_class = TimeseriesPlot
                     source = FileTimeseries.from_node(node)
@@ -1227,6 +1302,10 @@ class PhysiologyReview(HasTraits):
                            action='compute_rms',
                            enabled_when='object.data_node is not None'
                           ),
+                    Action(name='Cache processed data',
+                           action='cache_processed',
+                           enabled_when='object.data_node is not None'
+                          ),
                 ),
                 ActionGroup(
                     Action(name='Extract spikes',
@@ -1258,6 +1337,12 @@ class PhysiologyReview(HasTraits):
                     Action(name='Zero waveform',
                            action='zero_waveform',
                            enabled_when='object.data_node is not None'),
+                    Action(name='Clear masks',
+                           action='clear_masks',
+                           enabled_when='object.channel.mask is not None'),
+                    Action(name='Apply masks to file',
+                           action='apply_masks',
+                           enabled_when='object.channel.mask is not None'),
                 ),
                 name='&Actions',
             ),
@@ -1,8 +1,8 @@
 import argparse
-from subprocess import call
-import re
 import tables 
 
+from repack import repack, format_report
+
 def main(filename, dry_run=False):
     file_edited = False
     mode = 'r' if dry_run else 'a'
@@ -34,8 +34,7 @@ def main(filename, dry_run=False):
                 pass
     if file_edited and not dry_run:
         print 'file edited'
-        repack_filename = re.sub(r'(.*)\.hd5', r'\1_repack.hd5', filename)
-        print call(['ptrepack', filename+':/', repack_filename+':/'])
+        print format_report(repack(filename))
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser("Strip redundant data from physiology files")